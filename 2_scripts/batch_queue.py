@@ -0,0 +1,253 @@
+"""
+Dynamic micro-batching in front of the demo server's models.
+
+The combined inference.ipynb app calls generate() once per click, so
+concurrent users serialize on the GPU and latency grows with the queue.
+MicroBatcher is an asyncio request queue that coalesces concurrent requests
+for the same model variant into one batched generate call:
+
+  - a variant's batch goes out when it has max_batch requests, or when its
+    oldest request has waited max_wait seconds (at once if the GPU was busy
+    longer than that);
+  - batches run one at a time on a single generation thread, since the
+    variants share one GPU, while the event loop keeps taking requests; a
+    batch is formed only once the GPU is free, so requests that arrive while
+    another batch runs still join it;
+  - a request cancelled while queued (the client went away) is dropped
+    before its batch is formed; one cancelled mid-batch has its result
+    discarded, and a batch whose requests are all cancelled stops at the
+    next token;
+  - BatchStats records queue depth at each arrival, batch sizes, queue wait
+    and cancellations.
+
+GenerateRunner is the batch function for Hugging Face models: it formats
+prompts like the training data, left-pads the batch (canary.generate_padded)
+and cuts each row to its own max_new_tokens.  A variant can be a
+(model, tokenizer) pair, or (model, tokenizer, adapter_on) for the base and
+fine-tuned Llama that share one PeftModel; the adapter is switched on the
+generation thread, per batch.  A model_pool.ModelPool can stand in for the
+variants dict, so variants load on first request and are evicted under a
+memory budget.
+
+Gradio use (async handlers run on Gradio's event loop; raise the event's
+concurrency limit so concurrent clicks reach the queue together):
+    sys.path.insert(0, f"{REPO_DIR}/2_scripts")
+    from batch_queue import GenerateRunner, MicroBatcher
+    batcher = MicroBatcher(GenerateRunner({
+        "Base Llama": (llama_model, llama_tokenizer, False),
+        "Fine-tuned Llama": (llama_model, llama_tokenizer, True),
+        "Base GPT-2": (gpt2_base_model, gpt2_base_tokenizer),
+        "Fine-tuned GPT-2": (gpt2_ft_model, gpt2_ft_tokenizer),
+    }), max_batch=8, max_wait=0.05)
+
+    async def generate(model_name, prompt, max_tokens):
+        return await batcher.submit(model_name, (prompt, int(max_tokens)))
+
+    gen_btn.click(generate, [model_choice, prompt, max_tokens], output, concurrency_limit=None)
+
+load_test.py drives it with simulated clients.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import statistics
+import sys
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
+
+class BatchStats:
+    """Queue and batch metrics for one MicroBatcher."""
+
+    def __init__(self):
+        self.depths: list[int] = []         # requests queued (all variants) at each arrival
+        self.batch_sizes: Counter = Counter()
+        self.waits: list[float] = []        # seconds from arrival to batch start
+        self.cancelled = 0
+        self.failed = 0
+
+    def summary(self) -> dict:
+        batches = sum(self.batch_sizes.values())
+        requests = sum(size * n for size, n in self.batch_sizes.items())
+        waits = sorted(self.waits)
+        return {
+            "batches": batches,
+            "batched_requests": requests,
+            "mean_batch_size": round(requests / batches, 2) if batches else None,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "max_queue_depth": max(self.depths, default=0),
+            "mean_queue_depth": round(statistics.fmean(self.depths), 2) if self.depths else None,
+            "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 2) if waits else None,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+        }
+
+
+class _Request:
+    __slots__ = ("item", "future", "arrived")
+
+    def __init__(self, item, future: asyncio.Future, arrived: float):
+        self.item = item
+        self.future = future
+        self.arrived = arrived
+
+
+class MicroBatcher:
+    """Coalesce concurrent requests per variant into batched calls.
+
+    run_batch(variant, items, stop) runs on the generation thread and returns
+    one result per item; stop is a threading.Event set once every request in
+    the batch has been cancelled.
+    """
+
+    def __init__(self, run_batch: Callable[[str, list, threading.Event], list], max_batch: int = 8,
+                 max_wait: float = 0.02):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+        self.queues: dict[str, deque[_Request]] = {}
+        self.wakeups: dict[str, asyncio.Event] = {}
+        self.workers: dict[str, asyncio.Task] = {}
+        self.gpu: asyncio.Lock | None = None  # held from forming a batch until it has run
+        self.stats = BatchStats()
+
+    def depth(self) -> int:
+        """Requests waiting for a batch, across variants."""
+        return sum(len(q) for q in self.queues.values())
+
+    async def submit(self, variant: str, item: Any) -> Any:
+        """Queue one request and wait for its result; cancelling the await cancels the request."""
+        loop = asyncio.get_running_loop()
+        if self.gpu is None:
+            self.gpu = asyncio.Lock()  # made on the running loop
+        if variant not in self.workers:
+            self.queues[variant] = deque()
+            self.wakeups[variant] = asyncio.Event()
+            self.workers[variant] = loop.create_task(self._worker(variant))
+        request = _Request(item, loop.create_future(), loop.time())
+        self.queues[variant].append(request)
+        self.stats.depths.append(self.depth())
+        profiling.count("queued_requests")
+        self.wakeups[variant].set()
+        try:
+            return await request.future
+        except asyncio.CancelledError:
+            self.stats.cancelled += 1
+            raise
+
+    def _live(self, variant: str) -> deque[_Request]:
+        """The variant's queue, with cancelled requests dropped."""
+        queue = self.queues[variant]
+        for _ in range(len(queue)):
+            request = queue.popleft()
+            if not request.future.done():
+                queue.append(request)
+        return queue
+
+    async def _worker(self, variant: str) -> None:
+        loop = asyncio.get_running_loop()
+        wake = self.wakeups[variant]
+        while True:
+            while not self._live(variant):
+                wake.clear()
+                await wake.wait()
+            # Wait for company until the oldest request has waited max_wait
+            deadline = self.queues[variant][0].arrived + self.max_wait
+            while len(self._live(variant)) < self.max_batch and loop.time() < deadline:
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            async with self.gpu:
+                queue = self._live(variant)
+                if not queue:
+                    continue
+                batch = [queue.popleft() for _ in range(min(self.max_batch, len(queue)))]
+                now = loop.time()
+                self.stats.waits.extend(now - r.arrived for r in batch)
+                self.stats.batch_sizes[len(batch)] += 1
+                await self._dispatch(loop, variant, batch)
+
+    async def _dispatch(self, loop: asyncio.AbstractEventLoop, variant: str, batch: list[_Request]) -> None:
+        """Run one batch on the generation thread and settle its futures."""
+        stop = threading.Event()
+
+        def cancelled(_future):
+            if all(r.future.cancelled() for r in batch):
+                stop.set()
+
+        for r in batch:
+            r.future.add_done_callback(cancelled)
+        try:
+            results = await loop.run_in_executor(self.executor, self._run, variant, batch, stop)
+        except Exception as e:
+            self.stats.failed += len(batch)
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+            return
+        if len(results) != len(batch):
+            # A short result list would leave the unmatched clients waiting forever
+            error = RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} requests")
+            self.stats.failed += len(batch)
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(error)
+            return
+        for r, result in zip(batch, results):
+            if not r.future.done():
+                r.future.set_result(result)
+
+    def _run(self, variant: str, batch: list[_Request], stop: threading.Event) -> list:
+        with profiling.span("batch_queue.batch", variant=variant, size=len(batch)):
+            return self.run_batch(variant, [r.item for r in batch], stop)
+
+    async def close(self) -> None:
+        """Stop the workers; requests still queued are cancelled."""
+        for task in self.workers.values():
+            task.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        for queue in self.queues.values():
+            for request in queue:
+                request.future.cancel()
+        self.executor.shutdown(wait=True)
+
+
+class GenerateRunner:
+    """run_batch for Hugging Face models: items are (prompt, max_new_tokens), results decoded text."""
+
+    def __init__(self, variants: dict[str, tuple], gen_kwargs: dict | None = None):
+        self.variants = variants  # or a model_pool.ModelPool, which loads them on first use
+        self.gen_kwargs = gen_kwargs
+        self.tokens = 0  # tokens generated, all batches
+
+    def __call__(self, variant: str, items: list[tuple[str, int]], stop: threading.Event) -> list[str]:
+        from canary import GEN_KWARGS, count_new_tokens, format_prompt, generate_padded, prompt_style
+        from streaming import stop_criteria
+
+        model, tokenizer, *adapter = self.variants[variant]
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token  # as the notebooks do
+        if adapter and adapter[0] is not None:
+            if adapter[0]:
+                model.enable_adapter_layers()
+            else:
+                model.disable_adapter_layers()
+        style = prompt_style(tokenizer)
+        rows = [tokenizer(format_prompt(tokenizer, prompt, style), add_special_tokens=False)["input_ids"]
+                for prompt, _ in items]
+        new = generate_padded(model, tokenizer, rows, max(n for _, n in items),
+                              GEN_KWARGS if self.gen_kwargs is None else self.gen_kwargs,
+                              stopping_criteria=stop_criteria(stop))
+        rows_new = [new[r, :n] for r, (_, n) in enumerate(items)]
+        self.tokens += sum(count_new_tokens(row.unsqueeze(0), tokenizer.pad_token_id) for row in rows_new)
+        return [tokenizer.decode(row, skip_special_tokens=True) for row in rows_new]
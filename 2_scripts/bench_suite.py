@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Timing suite for the data-prep hot paths, with saved baselines.
+
+benchmark.py checks each optimization against the code it replaced; this
+suite tracks the current code over time.  Every case runs on a seeded
+synthetic corpus (synthetic_corpus.py), generated once per size and seed
+under .cache/bench/ and reused:
+
+    preprocess          preprocess.preprocess() on every raw essay
+    extract_footnotes   extract_footnotes.extract_footnotes() on every raw essay
+    strip_prompt        token_budget.strip_prompt_from_essay() for every tier 3 prompt
+    truncate_response   llama_to_gpt2.truncate_response() for every tier 2-4 train pair,
+                        from a cold token cache (as a first run of llama_to_gpt2.py)
+    parse_pairs_file    format_jsonl.parse_pairs_file() on llama_train.md
+    write_jsonl         format_jsonl.write_jsonl() of the llama_train entries
+
+Results are JSON:
+    {"meta": {"essays", "seed", "corpus_version", "repeat", "python", "platform", "commit", ...},
+     "cases": {name: {"seconds": [...], "best", "median", "items", "bytes"}}}
+
+With --compare, each case's median is checked against the baseline's; a
+case slower by more than --tolerance (and by at least 5 ms, below which
+timer noise dominates) is flagged as a regression and the exit status is 1.
+
+Usage:
+    python bench_suite.py                               # 1,000 essays → .cache/bench/latest.json
+    python bench_suite.py preprocess strip_prompt       # some cases
+    python bench_suite.py --essays 100000 --repeat 1    # large corpus
+    python bench_suite.py --save-baseline               # also save as .cache/bench/baseline.json
+    python bench_suite.py --compare                     # flag regressions against that baseline
+    python bench_suite.py --compare base.json --tolerance 0.1 -o new.json
+    python bench_suite.py preprocess --repeat 1 --profile  # where a case's time goes (profiling.py)
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import format_jsonl
+import llama_to_gpt2
+import preprocess
+import profiling
+import synthetic_corpus
+from extract_footnotes import extract_footnotes
+from manifest import rules_version
+from pairs_file import iter_pairs
+from token_budget import parse_prompts_file, strip_prompt_from_essay
+from token_cache import TokenCache, count_tokens, use_cache
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = REPO_ROOT / ".cache" / "bench"
+DEFAULT_OUTPUT = BENCH_DIR / "latest.json"
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+
+# Generator edits change the corpus, so they get a fresh directory (and a baseline warning)
+CORPUS_VERSION = rules_version(synthetic_corpus.__file__)
+
+DEFAULT_TOLERANCE = 0.2
+MIN_DELTA = 0.005  # seconds; smaller slowdowns are noise
+
+
+# ── corpus ───────────────────────────────────────────────────────────────
+
+def corpus_dir(essays: int, seed: int) -> Path:
+    """The synthetic corpus for (essays, seed), generated on first use."""
+    root = BENCH_DIR / f"corpus-{essays}-s{seed}-{CORPUS_VERSION}"
+    if not (root / "1_data" / "corpus.json").exists():  # written last, so its presence means complete
+        shutil.rmtree(root, ignore_errors=True)
+        print(f"Generating {essays} synthetic essays (seed {seed}) in {root} ...", file=sys.stderr)
+        synthetic_corpus.write_corpus(root, essays, seed, progress=essays >= 10_000)
+    return root / "1_data"
+
+
+class Corpus:
+    """The corpus files a suite run reads, loaded once before any timing."""
+
+    def __init__(self, data: Path):
+        self.data = data
+        self.raw = [p.read_text(encoding="utf-8") for p in sorted((data / "raw").glob("*.md"))]
+        self.pairs_path = data / "pairs" / "llama_train.md"
+        self.train_pairs = [p for p in iter_pairs(self.pairs_path) if p["name"]]
+
+        cleaned = data / "cleaned"
+        self.strip_jobs = []  # (cleaned essay, tier 3 prompt)
+        for slug, entry in parse_prompts_file(data / "pairs" / "prompts.md").items():
+            essay = cleaned / f"{slug}_clean.md"
+            if entry["tier"] == 3 and essay.exists():
+                self.strip_jobs.append((essay.read_text(encoding="utf-8").strip(), entry["prompt"]))
+
+
+# ── cases ────────────────────────────────────────────────────────────────
+# Each returns (fn to time, items processed, bytes processed)
+
+def case_preprocess(corpus: Corpus):
+    return (lambda: [preprocess.preprocess(t) for t in corpus.raw],
+            len(corpus.raw), sum(len(t.encode("utf-8")) for t in corpus.raw))
+
+
+def case_extract_footnotes(corpus: Corpus):
+    return (lambda: [extract_footnotes(t) for t in corpus.raw],
+            len(corpus.raw), sum(len(t.encode("utf-8")) for t in corpus.raw))
+
+
+def case_strip_prompt(corpus: Corpus):
+    return (lambda: [strip_prompt_from_essay(essay, prompt) for essay, prompt in corpus.strip_jobs],
+            len(corpus.strip_jobs), sum(len(e.encode("utf-8")) for e, _ in corpus.strip_jobs))
+
+
+def case_truncate_response(corpus: Corpus):
+    jobs = [(p["response"] or "", count_tokens(p["prompt"] or "", llama_to_gpt2.enc.name))
+            for p in corpus.train_pairs if p["tier"] != 1]
+
+    def run():
+        use_cache(TokenCache(path=None))  # every response tokenized, as on a first run
+        for response, prompt_tokens in jobs:
+            llama_to_gpt2.truncate_response(response, prompt_tokens)
+
+    return run, len(jobs), sum(len(r.encode("utf-8")) for r, _ in jobs)
+
+
+def case_parse_pairs_file(corpus: Corpus):
+    return (lambda: format_jsonl.parse_pairs_file(corpus.pairs_path),
+            len(corpus.train_pairs), corpus.pairs_path.stat().st_size)
+
+
+def case_write_jsonl(corpus: Corpus):
+    entries = [format_jsonl.to_llama_format(p["prompt"] or "", p["response"] or "") for p in corpus.train_pairs]
+    out = corpus.data / "jsonl" / "llama_train.jsonl"
+
+    def run():
+        format_jsonl.write_jsonl(out, entries)
+
+    run()
+    return run, len(entries), out.stat().st_size
+
+
+CASES = {
+    "preprocess": case_preprocess,
+    "extract_footnotes": case_extract_footnotes,
+    "strip_prompt": case_strip_prompt,
+    "truncate_response": case_truncate_response,
+    "parse_pairs_file": case_parse_pairs_file,
+    "write_jsonl": case_write_jsonl,
+}
+
+
+def time_case(fn, repeat: int) -> list[float]:
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_suite(names: list[str], corpus: Corpus, repeat: int) -> dict:
+    """name → {"seconds", "best", "median", "items", "bytes"} for each case."""
+    results = {}
+    for name in names:
+        fn, items, size = CASES[name](corpus)
+        with profiling.span(f"bench_suite.{name}"):
+            seconds = time_case(fn, repeat)
+        results[name] = {"seconds": seconds, "best": min(seconds), "median": statistics.median(seconds),
+                         "items": items, "bytes": size}
+        print(f"  {name:<18s}  {items:7d} items  {size / 1e6:8.1f} MB  "
+              f"best {min(seconds):8.3f}s  median {statistics.median(seconds):8.3f}s", file=sys.stderr)
+    return results
+
+
+def run_meta(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "essays": args.essays,
+        "seed": args.seed,
+        "corpus_version": CORPUS_VERSION,
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# ── comparison ───────────────────────────────────────────────────────────
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print current vs baseline medians; returns the names of regressed cases."""
+    base_meta, base_cases = baseline.get("meta", {}), baseline.get("cases", {})
+    meta = results["meta"]
+    for key in ("essays", "seed", "corpus_version"):
+        if base_meta.get(key) != meta[key]:
+            print(f"WARNING: baseline {key} is {base_meta.get(key)}, this run's is {meta[key]} — "
+                  f"timings aren't comparable")
+
+    print(f"\n  {'Case':<18s}  {'Median':>9s}  {'Baseline':>9s}  {'Change':>8s}  Status")
+    print(f"  {'-'*18}  {'-'*9}  {'-'*9}  {'-'*8}  ------")
+    regressed = []
+    for name, r in results["cases"].items():
+        base = base_cases.get(name)
+        if base is None:
+            print(f"  {name:<18s}  {r['median']:8.3f}s  {'-':>9s}  {'-':>8s}  new")
+            continue
+        change = r["median"] / base["median"] - 1 if base["median"] else 0.0
+        if change > tolerance and r["median"] - base["median"] >= MIN_DELTA:
+            status = "REGRESSION"
+            regressed.append(name)
+        elif change < -tolerance and base["median"] - r["median"] >= MIN_DELTA:
+            status = "faster"
+        else:
+            status = "ok"
+        print(f"  {name:<18s}  {r['median']:8.3f}s  {base['median']:8.3f}s  {change:+8.1%}  {status}")
+    return regressed
+
+
+# ── main ─────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Time data-prep hot paths on a synthetic corpus")
+    parser.add_argument("cases", nargs="*", help=f"Cases to run: {', '.join(CASES)} (default: all)")
+    parser.add_argument("--essays", type=int, default=1000, help="Synthetic corpus size (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic corpus seed (default: 0)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (default: 5)")
+    parser.add_argument("-o", "--output", type=Path, default=DEFAULT_OUTPUT,
+                        help=f"Results file (default: {DEFAULT_OUTPUT.relative_to(REPO_ROOT)})")
+    parser.add_argument("--save-baseline", type=Path, nargs="?", const=DEFAULT_BASELINE, metavar="PATH",
+                        help="Also save the results as the baseline")
+    parser.add_argument("--compare", type=Path, nargs="?", const=DEFAULT_BASELINE, metavar="PATH",
+                        help="Compare against a baseline and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Slowdown allowed before flagging, as a fraction (default: {DEFAULT_TOLERANCE})")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    unknown = [c for c in args.cases if c not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+    if args.profile and (args.save_baseline or args.compare):
+        parser.error("--profile timings include the profiler's own overhead; "
+                     "don't save or compare them as a baseline")
+    if args.compare and not args.compare.exists():
+        print(f"ERROR: no baseline at {args.compare} — run with --save-baseline first")
+        sys.exit(1)
+
+    baseline = json.loads(args.compare.read_text(encoding="utf-8")) if args.compare else None
+    use_cache(TokenCache(path=None))  # keep synthetic text out of the on-disk token cache
+    corpus = Corpus(corpus_dir(args.essays, args.seed))
+    print(f"Suite: {args.essays} essays (seed {args.seed}), {args.repeat} run(s) per case", file=sys.stderr)
+    results = {"meta": run_meta(args), "cases": run_suite(args.cases or list(CASES), corpus, args.repeat)}
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=1) + "\n", encoding="utf-8")
+    print(f"\nResults → {args.output}")
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(json.dumps(results, indent=1) + "\n", encoding="utf-8")
+        print(f"Baseline → {args.save_baseline}")
+
+    if baseline is not None:
+        regressed = compare(results, baseline, args.tolerance)
+        if regressed:
+            print(f"\nERROR: {len(regressed)} case(s) slower than the baseline: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
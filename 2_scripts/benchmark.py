@@ -0,0 +1,615 @@
+#!/usr/bin/env python3
+"""
+Benchmark the data-prep hot paths against their original implementations.
+
+Each case times the current code and a frozen copy of the implementation it
+replaced on synthetic essays of growing length, and checks that both produce
+identical output.
+
+Usage:
+    python benchmark.py                       # all cases
+    python benchmark.py truncation            # one case
+    python benchmark.py --sizes 10 100 1000   # essay lengths in paragraphs
+    python benchmark.py --repeat 5            # best of N timings
+    python benchmark.py dedup --profile       # where a case's time goes (profiling.py)
+
+Cases:
+    truncation  — token_budget.cut_essay / llama_to_gpt2.truncate_response
+    strip       — token_budget.strip_prompt_from_essay (differential over many prompts)
+    preprocess  — preprocess.preprocess, pass engine vs fused engine (MB/s; differential
+                  over 1_data/raw/, synthetic Substack exports and random markup)
+    pairs       — pairs_file streaming parser, PairIndex lookups and write_pairs splicing
+                  vs the regex split and full rewrite (pair files of 50 × --sizes pairs,
+                  50,000 at the default 1000)
+    matching    — slug → essay and essay → prompt matching, SlugIndex vs per-slug scans
+                  (10 × --sizes essays and prompts, 10,000 at the default 1000)
+    store       — "Tier 3 val pairs over N GPT-2 tokens": corpus_store query vs reparsing
+                  the pair file (50 × --sizes pairs, warm token cache)
+    dedup       — dedup.py near-duplicate search, MinHash LSH vs comparing every pair
+                  (10 × --sizes responses with planted near-copies, 10,000 at the default 1000)
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import corpus_store
+import dedup
+import format_jsonl
+import llama_to_gpt2
+import pairs_file
+import slug_index
+import preprocess
+import profiling
+import prompts_to_llama
+import token_budget
+from synthetic_corpus import WORDS, synthetic_essay, synthetic_pairs_file, synthetic_raw_essay
+from token_cache import TokenCache, use_cache
+from token_budget import GPT2_MAX, SEPARATOR_TOKENS, enc, normalize_text
+
+def best_of(fn, repeat: int) -> float:
+    """Fastest of `repeat` runs, each starting from a cold token-count cache."""
+    best = float("inf")
+    for _ in range(repeat):
+        use_cache(TokenCache(path=None))
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# ── reference implementations (pre-optimization) ────────────────────────
+
+def legacy_cut_essay(essay_text: str, prompt_tokens: int) -> str:
+    budget = GPT2_MAX - prompt_tokens - SEPARATOR_TOKENS
+    paragraphs = essay_text.split("\n\n")
+    running = 0
+    cut_idx = None
+    for i, para in enumerate(paragraphs):
+        if i > 0:
+            running += len(enc.encode("\n\n"))
+        running += len(enc.encode(para))
+        if running > budget:
+            cut_idx = i
+            break
+    if cut_idx is None:
+        return essay_text
+    while cut_idx > 0:
+        result = "\n\n".join(paragraphs[:cut_idx])
+        if len(enc.encode(result)) <= budget:
+            return result
+        cut_idx -= 1
+    return ""
+
+
+def legacy_truncate_response(response: str, prompt_tokens: int) -> tuple[str, int, int]:
+    orig_tokens = len(enc.encode(response)) if response else 0
+    budget = GPT2_MAX - prompt_tokens - llama_to_gpt2.SEP_TOKENS
+    if budget <= 0:
+        return "", 0, orig_tokens
+    if not response or orig_tokens <= budget:
+        return response, orig_tokens, orig_tokens
+    paragraphs = response.split("\n\n")
+    running = 0
+    cut_idx = len(paragraphs)
+    for i, para in enumerate(paragraphs):
+        if i > 0:
+            running += len(enc.encode("\n\n"))
+        running += len(enc.encode(para))
+        if running > budget:
+            cut_idx = i
+            break
+    while cut_idx > 0:
+        truncated = "\n\n".join(paragraphs[:cut_idx])
+        trunc_tokens = len(enc.encode(truncated))
+        if trunc_tokens <= budget:
+            break
+        cut_idx -= 1
+    else:
+        return "", 0, orig_tokens
+    return truncated, trunc_tokens, orig_tokens
+
+
+def legacy_strip_prompt_from_essay(essay_text: str, prompt_text: str) -> str:
+    norm_prompt = normalize_text(prompt_text)
+    norm_essay = normalize_text(essay_text)
+    idx = norm_essay.find(norm_prompt)
+    if idx == -1:
+        return essay_text
+    end_pos = idx + len(norm_prompt)
+    norm_count = 0
+    orig_pos = 0
+    for orig_pos, ch in enumerate(essay_text):
+        if norm_count >= end_pos:
+            break
+        test = normalize_text(essay_text[:orig_pos + 1])
+        norm_count = len(test)
+    rest = essay_text[orig_pos:]
+    next_para = rest.find("\n\n")
+    if next_para != -1:
+        return rest[next_para:].lstrip("\n")
+    return rest.strip()
+
+
+def legacy_parse_pairs(text: str) -> list[dict]:
+    """llama_to_gpt2.parse_pairs before pairs_file.py: regex split of the whole file."""
+    pairs: list[dict] = []
+    for block in re.split(r"\n(?=## pair:)", text):
+        if not block.strip().startswith("## pair:"):
+            continue
+        name_m = re.match(r"## pair:\s*(.+)", block)
+        if not name_m:
+            continue
+        tier_m = re.search(r"^tier:\s*(\d+)", block, re.MULTILINE)
+        prompt_m = re.search(r"### prompt\n(.*?)(?=\n### response)", block, re.DOTALL)
+        resp_m = re.search(r"### response\n(.*?)(?=\n-{2,3}\s*$|\Z)", block, re.DOTALL)
+        pairs.append({
+            "name": name_m.group(1).strip(),
+            "tier": int(tier_m.group(1)) if tier_m else None,
+            "prompt": prompt_m.group(1).strip() if prompt_m else "",
+            "response": resp_m.group(1).strip() if resp_m else "",
+        })
+    return pairs
+
+
+def legacy_find_essay(slug: str, cleaned_dir: Path) -> Path | None:
+    """prompts_to_llama.find_essay before slug_index.py: glob and scan per slug."""
+    n = prompts_to_llama.norm(slug)
+    for f in sorted(cleaned_dir.glob("*_clean.md")):
+        if n in prompts_to_llama.norm(f.stem):
+            return f
+    return None
+
+
+def legacy_match_prompt(filename: str, prompts: dict[str, dict]) -> tuple[str, dict] | None:
+    """token_budget.match_prompt before slug_index.py: scan every slug per file."""
+    for slug, entry in prompts.items():
+        if slug in filename:
+            return slug, entry
+    return None
+
+
+def synthetic_slugs(n: int, seed: int = 0) -> tuple[list[str], list[str]]:
+    """Seeded (essay stems, prompt slugs) shaped like the real corpus.
+
+    Most prompts name one essay; some have no essay, some use underscores
+    where the file has hyphens, and some are short enough to match several.
+    """
+    rng = random.Random(seed)
+    words = [w for w in (re.sub(r"[^a-z0-9]", "", w.lower()) for w in WORDS) if w]
+    titles = [f"{i}-" + "-".join(rng.choice(words) for _ in range(rng.randint(2, 6))) for i in range(n)]
+    stems = [f"{t}_clean" for t in titles]
+    slugs = []
+    for i, t in enumerate(titles):
+        roll = rng.random()
+        if roll < 0.05:
+            slugs.append(f"missing-{i}")
+        elif roll < 0.10:
+            slugs.append(t.replace("-", "_"))
+        elif roll < 0.12:
+            slugs.append(t.split("-", 1)[1][:8])  # matches many
+        else:
+            slugs.append(t)
+    rng.shuffle(slugs)
+    return stems, slugs
+
+
+# ── cases ────────────────────────────────────────────────────────────────
+
+def bench_truncation(sizes: list[int], repeat: int) -> bool:
+    """Time both truncation entry points as the scripts call them; essays grow, budget is fixed.
+
+    cut = token_budget.process_file --cut (total count + cut_essay)
+    trunc = llama_to_gpt2.truncate_response
+    """
+    prompt_tokens = 80
+    ok = True
+
+    print(f"\n  truncation (prompt={prompt_tokens} tokens, best of {repeat})")
+    print(f"  {'Shape':<5}  {'Paras':>6}  {'Tokens':>7}  {'cut old':>8}  {'cut new':>8}  {'trunc old':>9}  {'trunc new':>9}  Match")
+    print(f"  {'-'*5}  {'-'*6}  {'-'*7}  {'-'*8}  {'-'*8}  {'-'*9}  {'-'*9}  -----")
+
+    for short, n in [(short, n) for short in (False, True) for n in sizes]:
+        essay = synthetic_essay(n, seed=n, short=short)
+        use_cache(TokenCache(path=None))
+        tokens = len(enc.encode(essay))
+
+        match = (
+            token_budget.cut_essay(essay, prompt_tokens) == legacy_cut_essay(essay, prompt_tokens)
+            and llama_to_gpt2.truncate_response(essay, prompt_tokens)
+            == legacy_truncate_response(essay, prompt_tokens)
+        )
+        ok &= match
+
+        def cut_old():
+            len(enc.encode(essay))
+            legacy_cut_essay(essay, prompt_tokens)
+
+        def cut_new():
+            layout = token_budget.ParagraphTokens(essay)
+            layout.total  # process_file counts the whole response, like cut_old's encode
+            token_budget.cut_essay(essay, prompt_tokens, layout)
+
+        timings = [best_of(fn, repeat) * 1e3 for fn in (
+            cut_old, cut_new,
+            lambda: legacy_truncate_response(essay, prompt_tokens),
+            lambda: llama_to_gpt2.truncate_response(essay, prompt_tokens),
+        )]
+        print(f"  {'notes' if short else 'essay':<5}  {n:6d}  {tokens:7d}  {timings[0]:8.2f}  {timings[1]:8.2f}  "
+              f"{timings[2]:9.2f}  {timings[3]:9.2f}  {'ok' if match else 'DIFF'}")
+
+    print("  (ms per essay)")
+    return ok
+
+
+def prompt_variants(essay: str, rng: random.Random, n: int) -> list[str]:
+    """Prompts cut from the essay the way they drift in prompts.md: straight
+    quotes, rewrapped whitespace, arbitrary start/end points, plus misses."""
+    prompts = ["", "   ", "not in the essay at all", essay[:200]]
+    for _ in range(n):
+        start = rng.choice([0, rng.randrange(len(essay))])
+        piece = essay[start:start + rng.randint(1, 600)]
+        piece = piece.replace("\u201c", '"').replace("\u2019", "'")
+        if rng.random() < 0.5:
+            piece = " ".join(piece.split())
+        prompts.append(piece)
+    return prompts
+
+
+def bench_strip(sizes: list[int], repeat: int) -> bool:
+    """Time strip_prompt_from_essay for an opening and a deep prompt; check random prompts."""
+    legacy_limit = 20_000  # chars; the old mapping is quadratic in match depth
+    ok = True
+
+    print(f"\n  strip_prompt_from_essay (best of {repeat}; old timed up to {legacy_limit:,} chars)")
+    print(f"  {'Paras':>6}  {'Chars':>8}  {'open old':>8}  {'open new':>8}  {'deep old':>9}  {'deep new':>9}  Match")
+    print(f"  {'-'*6}  {'-'*8}  {'-'*8}  {'-'*8}  {'-'*9}  {'-'*9}  -----")
+
+    for n in sizes:
+        essay = synthetic_essay(n, seed=n)
+        paragraphs = essay.split("\n\n")
+        opening = "\n\n".join(paragraphs[:2])
+        deep = paragraphs[len(paragraphs) * 3 // 4]
+        with_legacy = len(essay) <= legacy_limit
+
+        match = None
+        if with_legacy:
+            prompts = [opening, deep] + prompt_variants(essay, random.Random(n), 25)
+            batch = token_budget.strip_prompts_from_essay(essay, prompts)
+            match = batch == [legacy_strip_prompt_from_essay(essay, p) for p in prompts]
+            ok &= match
+
+        cells = []
+        for prompt in (opening, deep):
+            old = (best_of(lambda: legacy_strip_prompt_from_essay(essay, prompt), repeat) * 1e3
+                   if with_legacy else None)
+            new = best_of(lambda: token_budget.strip_prompt_from_essay(essay, prompt), repeat) * 1e3
+            cells += [f"{old:.2f}" if old is not None else "skip", f"{new:.2f}"]
+
+        status = "ok" if match else ("DIFF" if match is False else "-")
+        print(f"  {n:6d}  {len(essay):8d}  {cells[0]:>8}  {cells[1]:>8}  {cells[2]:>9}  {cells[3]:>9}  {status}")
+
+    print("  (ms per call)")
+    return ok
+
+
+def random_markup(rng: random.Random) -> str:
+    """Short document of markdown fragments in random order, to stress rule interactions."""
+    pieces = ["[", "]", "(", ")", "![", "](", "[1]", "[2](u)", "[](u)", "[![a](b)](c)Cap",
+              "http://x.co/a", "https://s.com/p#footnote-1-2", "\n", "\n", "\n\n", " ", "\t",
+              "word", "Word.", "---", "***", "* * *", "Subscribe", "Share", "Feb 23, 2024", "_Thanks to A"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 60)))
+
+
+def bench_preprocess(sizes: list[int], repeat: int) -> bool:
+    """Throughput of both preprocess() engines; differential check on every input."""
+    ok = True
+
+    raw_files = sorted(preprocess.RAW_DIR.glob("*.md")) if preprocess.RAW_DIR.exists() else []
+    real = [f.read_text(encoding="utf-8") for f in raw_files]
+    fuzz_rng = random.Random(0)
+    fuzz = [random_markup(fuzz_rng) for _ in range(5000)]
+
+    def check(docs: list[str]) -> tuple[int, int]:
+        diffs = sum(preprocess.preprocess(d) != preprocess.preprocess(d, engine="fused") for d in docs)
+        bodies = [preprocess.strip_endmatter(preprocess.strip_header(d)) for d in docs]
+        fallbacks = sum(preprocess._preprocess_fused(body) is None for body in bodies)
+        return diffs, fallbacks
+
+    print(f"\n  preprocess engines (best of {repeat})")
+    print(f"  {'Input':<16}  {'Docs':>5}  {'MB':>7}  {'passes':>8}  {'fused':>8}  {'Fallback':>8}  Match")
+    print(f"  {'-'*16}  {'-'*5}  {'-'*7}  {'-'*8}  {'-'*8}  {'-'*8}  -----")
+
+    corpora = [(f"synthetic {n}p", [synthetic_raw_essay(n, seed=s) for s in range(20)]) for n in sizes]
+    if real:
+        corpora.insert(0, ("1_data/raw", real))
+    for label, docs in corpora:
+        mb = sum(len(d.encode("utf-8")) for d in docs) / 1e6
+        diffs, fallbacks = check(docs)
+        ok &= diffs == 0
+        rates = [mb / best_of(lambda: [preprocess.preprocess(d, engine=e) for d in docs], repeat)
+                 for e in preprocess.ENGINES]
+        print(f"  {label:<16}  {len(docs):5d}  {mb:7.2f}  {rates[0]:8.1f}  {rates[1]:8.1f}  "
+              f"{fallbacks:8d}  {'ok' if diffs == 0 else f'{diffs} DIFF'}")
+
+    diffs, fallbacks = check(fuzz)
+    ok &= diffs == 0
+    print(f"  {'random markup':<16}  {len(fuzz):5d}  {'':>7}  {'':>8}  {'':>8}  {fallbacks:8d}  "
+          f"{'ok' if diffs == 0 else f'{diffs} DIFF'}")
+    print("  (MB/s; fallback = documents the fused engine hands back to the pass engine)")
+    return ok
+
+
+def bench_pairs(sizes: list[int], repeat: int) -> bool:
+    """Full parse of a pairs file, and fetching single pairs: reparse vs PairIndex seek."""
+    ok = True
+    lookups = 100
+
+    print(f"\n  pairs files (best of {repeat}, {lookups} lookups)")
+    print(f"  {'Pairs':>6}  {'MB':>6}  {'parse old':>9}  {'parse new':>9}  {'index':>7}  "
+          f"{'get old':>8}  {'get new':>8}  {'rewrite':>7}  {'splice':>7}  Match")
+    print(f"  {'-'*6}  {'-'*6}  {'-'*9}  {'-'*9}  {'-'*7}  {'-'*8}  {'-'*8}  {'-'*7}  {'-'*7}  -----")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            n_pairs = 50 * n
+            path = Path(tmp) / f"pairs_{n_pairs}.md"
+            path.write_text(synthetic_pairs_file(n_pairs, seed=n), encoding="utf-8")
+            mb = path.stat().st_size / 1e6
+            names = random.Random(n).sample(range(n_pairs), min(lookups, n_pairs))
+            names = [f"{i:05d}-synthetic-pair" for i in names]
+
+            old = legacy_parse_pairs(path.read_text(encoding="utf-8"))
+            index = pairs_file.PairIndex(path)
+            by_name = {p["name"]: p for p in old}
+            match = (llama_to_gpt2.parse_pairs(path.read_text(encoding="utf-8")) == old
+                     and all({k: index.get(m)[k] for k in ("name", "tier", "prompt", "response")}
+                             == by_name[m] for m in names))
+            ok &= match
+
+            def get_old():
+                for m in names[:10]:  # a full reparse per lookup; a sample is enough
+                    next(p for p in legacy_parse_pairs(path.read_text(encoding="utf-8")) if p["name"] == m)
+
+            timings = [best_of(fn, repeat) * 1e3 for fn in (
+                lambda: legacy_parse_pairs(path.read_text(encoding="utf-8")),
+                lambda: list(pairs_file.iter_pairs(path)),
+                lambda: pairs_file.PairIndex(path),
+            )]
+            get_old_ms = best_of(get_old, 1) * 1e3 / len(names[:10])
+            get_new_ms = best_of(lambda: [index.get(m) for m in names], repeat) * 1e3 / len(names)
+
+            # One response edited: full rewrite vs splicing the one block
+            header, pairs = prompts_to_llama.parse_target(path.read_text(encoding="utf-8"))
+            edited = pairs[len(pairs) // 2]
+            rewrite_path = path.with_name("rewrite.md")
+
+            def splice():
+                edited["response"] += " edit"
+                pairs_file.write_pairs(path, header, pairs, {edited["name"]})
+
+            rewrite_ms = best_of(lambda: rewrite_path.write_text(
+                prompts_to_llama.build_output(header, pairs), encoding="utf-8"), repeat) * 1e3
+            splice_ms = best_of(splice, repeat) * 1e3
+            spliced = prompts_to_llama.parse_target(path.read_text(encoding="utf-8"))[1]
+            match &= spliced == pairs
+            ok &= match
+            print(f"  {n_pairs:6d}  {mb:6.1f}  {timings[0]:9.1f}  {timings[1]:9.1f}  {timings[2]:7.1f}  "
+                  f"{get_old_ms:8.2f}  {get_new_ms:8.3f}  {rewrite_ms:7.1f}  {splice_ms:7.1f}  "
+                  f"{'ok' if match else 'DIFF'}")
+
+    print("  (parse/index/rewrite/splice in ms per file; get in ms per pair — reparse + scan vs index seek;\n"
+          "   rewrite formats the whole file, splice copies all but one edited block, atomically)")
+    return ok
+
+
+def bench_matching(sizes: list[int], repeat: int) -> bool:
+    """Every prompt to its essay and every essay to its prompt: index vs nested scans."""
+    ok = True
+    sample = 20
+
+    print(f"\n  slug matching (best of {repeat}; old times from {sample} sampled lookups, scaled)")
+    print(f"  {'Essays':>6}  {'find old':>9}  {'find new':>9}  {'match old':>9}  {'match new':>9}  "
+          f"{'Ambig':>5}  Match")
+    print(f"  {'-'*6}  {'-'*9}  {'-'*9}  {'-'*9}  {'-'*9}  {'-'*5}  -----")
+
+    for n in sizes:
+        n_essays = 10 * n
+        stems, slugs = synthetic_slugs(n_essays, seed=n)
+        prompts = {slug: {"tier": 3, "prompt": "x"} for slug in slugs}
+        picks = random.Random(n).sample(range(n_essays), min(sample, n_essays))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cleaned = Path(tmp)
+            for stem in stems:
+                (cleaned / f"{stem}.md").touch()
+
+            index = prompts_to_llama.essay_index(slugs, cleaned)
+            budget_index = slug_index.SlugIndex(slugs, stems)
+            match = all(
+                legacy_find_essay(slugs[i], cleaned) == prompts_to_llama.find_essay(slugs[i], cleaned)
+                == (cleaned / f"{index.first_name(slugs[i])}.md" if index.first_name(slugs[i]) else None)
+                and legacy_match_prompt(stems[i], prompts)
+                == token_budget.match_prompt(stems[i], prompts, budget_index)
+                for i in picks
+            )
+            ok &= match
+
+            find_old = best_of(lambda: [legacy_find_essay(slugs[i], cleaned) for i in picks], 1) \
+                * n_essays / len(picks)
+            find_new = best_of(lambda: [ix.first_name(s) for ix in [prompts_to_llama.essay_index(slugs, cleaned)]
+                                        for s in slugs], repeat)
+            match_old = best_of(lambda: [legacy_match_prompt(stems[i], prompts) for i in picks], 1) \
+                * n_essays / len(picks)
+            match_new = best_of(lambda: [token_budget.match_prompt(st, prompts, ix)
+                                         for ix in [slug_index.SlugIndex(slugs, stems)] for st in stems],
+                                repeat)
+        print(f"  {n_essays:6d}  {find_old:8.2f}s  {find_new:8.2f}s  {match_old:8.2f}s  {match_new:8.2f}s  "
+              f"{len(index.ambiguous_slugs()):5d}  {'ok' if match else 'DIFF'}")
+
+    print("  (seconds to match every prompt / every essay once; Ambig = slugs matching several essays)")
+    return ok
+
+
+def bench_store(sizes: list[int], repeat: int) -> bool:
+    """A filtered pair query: corpus store vs reparse + count (token cache warm for both)."""
+    ok = True
+    tier, over = 3, 250
+
+    print(f"\n  corpus store (best of {repeat}; tier {tier} val pairs over {over} GPT-2 tokens)")
+    print(f"  {'Pairs':>6}  {'import':>8}  {'resync':>8}  {'reparse':>9}  {'query':>8}  {'Found':>6}  Match")
+    print(f"  {'-'*6}  {'-'*8}  {'-'*8}  {'-'*9}  {'-'*8}  {'-'*6}  -----")
+
+    def reparse(path: Path) -> list[str]:
+        found = []
+        for p in format_jsonl.collect_pairs(pairs_file.iter_pairs(path))[0]:
+            text = format_jsonl.to_gpt2_format(p["prompt"], p["response"])["text"]
+            if p["tier"] == tier and format_jsonl.count_tokens_gpt2(text) > over:
+                found.append(p["label"])
+        return found
+
+    def timed(fn) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            n_pairs = 50 * n
+            pairs_dir = Path(tmp) / f"pairs_{n_pairs}"
+            pairs_dir.mkdir()
+            path = pairs_dir / "llama_val.md"
+            path.write_text(synthetic_pairs_file(n_pairs, seed=n), encoding="utf-8")
+            use_cache(TokenCache(path=None))
+
+            with corpus_store.CorpusStore(Path(tmp) / f"store_{n_pairs}.sqlite3", pairs_dir) as store:
+                start = time.perf_counter()
+                store.sync_pairs()  # counts every pair once (fills the token cache too)
+                import_s = time.perf_counter() - start
+                resync_ms = timed(store.sync_pairs) * 1e3
+
+                expected = reparse(path)
+                found = [p["name"] for p in store.pairs(split="val", tier=tier, gpt2_over=over)]
+                match = found == expected
+                ok &= match
+                reparse_ms = timed(lambda: reparse(path)) * 1e3
+                query_ms = timed(lambda: store.pairs(split="val", tier=tier, gpt2_over=over)) * 1e3
+            print(f"  {n_pairs:6d}  {import_s:7.2f}s  {resync_ms:8.2f}  {reparse_ms:9.1f}  {query_ms:8.2f}  "
+                  f"{len(found):6d}  {'ok' if match else 'DIFF'}")
+
+    print("  (import: first sync, tokenizing every pair; resync/reparse/query in ms —\n"
+          "   resync is the stat check readers do before querying)")
+    return ok
+
+
+def bench_dedup(sizes: list[int], repeat: int) -> bool:
+    """All near-duplicate response pairs: LSH candidates vs every pair, plus cached reruns."""
+    ok = True
+    sample = 20
+    threshold = dedup.DEFAULT_THRESHOLD
+
+    print(f"\n  near-duplicates (best of {repeat}; threshold {threshold}; "
+          f"all-pairs time from {sample} sampled rows, scaled)")
+    print(f"  {'Texts':>6}  {'all pairs':>9}  {'lsh':>8}  {'cached':>8}  {'Found':>6}  {'Recall':>7}  Match")
+    print(f"  {'-'*6}  {'-'*9}  {'-'*8}  {'-'*8}  {'-'*6}  {'-'*7}  -----")
+
+    for n in sizes:
+        n_texts = 10 * n
+        rng = random.Random(n)
+        texts = dedup.Texts()
+        for i in range(n_texts):
+            if i and rng.random() < 0.05:  # plant a near-copy of an earlier text
+                w = texts.texts[rng.randrange(len(texts.texts))].split(" ")
+                w[rng.randrange(len(w))] = "edited"
+                text = " ".join(w)
+            else:
+                text = synthetic_essay(rng.randint(2, 6), seed=n * 100_000 + i)
+            texts.add(text, "train", f"{i:05d}")
+
+        found = {}
+
+        def lsh(cache):
+            found["pairs"] = {(i, j) for i, j, _ in dedup.similar_texts(texts, threshold, cache) if i != j}
+
+        lsh_s = best_of(lambda: lsh(dedup.SignatureCache(None)), repeat)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = Path(tmp) / "minhash.sqlite3"
+            warm = dedup.SignatureCache(cache_path)
+            lsh(warm)
+            warm.close()
+
+            def cached():
+                cache = dedup.SignatureCache(cache_path)
+                lsh(cache)
+                cache.close()
+            cached_s = best_of(cached, repeat)
+
+        # Every pair, for the sampled rows: recall of the LSH result on those rows
+        rows = rng.sample(range(len(texts.texts)), min(sample, len(texts.texts)))
+        start = time.perf_counter()
+        sets = [dedup.shingles(t) for t in texts.texts]
+        shingle_s = time.perf_counter() - start
+        start = time.perf_counter()
+        truth = {(min(i, j), max(i, j)) for i in rows for j in range(len(sets))
+                 if i != j and dedup.jaccard(sets[i], sets[j]) >= threshold}
+        all_pairs_s = shingle_s + (time.perf_counter() - start) * len(sets) / len(rows) / 2
+        recall = len(truth & found["pairs"]) / len(truth) if truth else 1.0
+        match = recall >= 0.99  # LSH is probabilistic; the split is tuned so misses are rare
+        ok &= match
+        print(f"  {len(texts.texts):6d}  {all_pairs_s:8.2f}s  {lsh_s:7.2f}s  {cached_s:7.2f}s  "
+              f"{len(found['pairs']):6d}  {recall:7.1%}  {'ok' if match else 'DIFF'}")
+
+    print("  (seconds for the whole search; cached = rerun with every signature cached;\n"
+          "   recall = sampled rows' true near-duplicate pairs that LSH found)")
+    return ok
+
+
+CASES = {
+    "truncation": bench_truncation,
+    "strip": bench_strip,
+    "preprocess": bench_preprocess,
+    "pairs": bench_pairs,
+    "matching": bench_matching,
+    "store": bench_store,
+    "dedup": bench_dedup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data-prep hot paths")
+    parser.add_argument("cases", nargs="*",
+                        help=f"Cases to run: {', '.join(CASES)} (default: all)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200, 1000],
+                        help="Essay lengths in paragraphs (default: 10 50 200 1000)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timing repetitions, best is reported (default: 3)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    unknown = [c for c in args.cases if c not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    ok = True
+    for name in args.cases or CASES:
+        with profiling.span(f"benchmark.{name}"):
+            ok &= CASES[name](args.sizes, args.repeat)
+
+    if not ok:
+        print("\nERROR: optimized output differs from reference implementation.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Batched canary generation.
+
+The notebooks generate canary samples one model.generate call at a time
+(N_SAMPLES = 5 per prompt, canaries A/B for GPT-2 and A/B/C for Llama).  This
+runs the same set as batched generation: every sample of every prompt is a row,
+rows are left-padded and packed into as few generate calls as fit the token
+budget (rows × (longest prompt + max_new_tokens), which bounds the KV cache),
+and the outputs are written as the {letter: [samples]} JSON that
+format_canary.py turns into markdown.
+
+Prompt formatting follows the training data: GPT-2 gets the prompt plus the
+"\\n\\n---\\n\\n" separator, Llama the chat-templated user turn with the
+assistant header.  Chat templates spell out BOS themselves, so prompts are
+tokenized without adding special tokens (the notebooks' tokenizer(input_text)
+call puts a second BOS in front).  The format is read off the tokenizer
+(a chat_template means Llama) unless --format says otherwise.
+
+"tiny-gpt2" and "tiny-llama" stand in for a model path: small randomly
+initialized models with a byte-level BPE trained on the canary prompts, built
+in memory, so the runner can be tried and timed on CPU without downloads.
+
+--shared-prefix samples each canary from a single prefill of its prompt
+(prefix_sampling.py) with a seed per sample, and --temperatures sweeps
+several temperatures off that same prefill.  It pays off for long prompts and
+many samples per prompt (Canary C, temperature sweeps); the default padded
+batch across prompts does more per decode step when prompts are short.
+
+Usage:
+    python canary.py path/to/gpt2-voice-v1 -o "4_experiments/experiment logs/3_full-dataset/gpt2_finetuned.json"
+    python canary.py meta-llama/Llama-3.1-8B-Instruct --adapter path/to/llama-voice-v1 -o llama_finetuned.json
+    python canary.py tiny-gpt2 -o /tmp/canary.json --max-new-tokens 64
+    python canary.py tiny-llama -o /tmp/canary.json --max-new-tokens 64 --serial    # notebook loop, to compare
+    python canary.py tiny-gpt2 -o /tmp/canary.json --memory-budget 256 --profile
+    python canary.py tiny-llama -o /tmp/canary.json --shared-prefix --seed 0      # one prefill per canary
+    python canary.py tiny-llama -o /tmp/sweep.json --temperatures 0.5 0.8 1.2 --seed 0   # sweep_t0.5.json, ...
+    python format_canary.py /tmp/canary.json
+
+Notebook use:
+    sys.path.insert(0, f"{REPO_DIR}/2_scripts")
+    from canary import run_canaries
+    outputs = run_canaries(model, tokenizer)        # {"A": [5 samples], "B": [...]}
+    json.dump(outputs, f, indent=2)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from format_canary import CANARY_PROMPTS
+from token_dataset import GPT2_SEPARATOR, LLAMA3_BOS, LLAMA3_GENERATION_PROMPT, LLAMA3_TURN
+
+# Same settings as the notebooks' GEN_KWARGS
+GEN_KWARGS = dict(
+    temperature=0.8,
+    top_p=0.9,
+    top_k=50,
+    repetition_penalty=1.1,
+    do_sample=True,
+)
+N_SAMPLES = 5
+MODEL_CANARIES = {"gpt2": "AB", "llama": "ABC"}  # C needs essay-length output GPT-2's 1,024 tokens can't hold
+MAX_NEW_TOKENS = {"gpt2": 512, "llama": 1024}
+
+# Rows × (longest prompt + max_new_tokens) per generate call: the Llama set
+# (15 rows × ~1,100) fits in one call
+DEFAULT_MAX_BATCH_TOKENS = 32_768
+
+TINY_MODELS = ("tiny-gpt2", "tiny-llama")
+TINY_CHAT_TEMPLATE = (
+    "{{ bos_token }}{% for m in messages %}"
+    + LLAMA3_TURN.replace("{role}", "{{ m['role'] }}").replace("{content}", "{{ m['content'] }}")
+    + "{% endfor %}{% if add_generation_prompt %}" + LLAMA3_GENERATION_PROMPT + "{% endif %}"
+)
+
+
+def _import_torch():
+    try:
+        import torch
+        import transformers
+    except ImportError:
+        raise ImportError("canary generation needs torch and transformers: "
+                          "pip install torch transformers") from None
+    return torch, transformers
+
+
+# ── prompts and batches ──────────────────────────────────────────────────
+
+def prompt_style(tokenizer) -> str:
+    """"llama" when the tokenizer has a chat template, else "gpt2"."""
+    return "llama" if getattr(tokenizer, "chat_template", None) else "gpt2"
+
+
+def format_prompt(tokenizer, prompt: str, style: str) -> str:
+    """The text the model saw before each response in training."""
+    if style == "gpt2":
+        return prompt + GPT2_SEPARATOR
+    return tokenizer.apply_chat_template([{"role": "user", "content": prompt}],
+                                         tokenize=False, add_generation_prompt=True)
+
+
+def plan_batches(lengths: list[int], max_new_tokens: int, max_tokens: int,
+                 max_rows: int | None = None) -> list[list[int]]:
+    """Row indices per generate call, longest prompts first.
+
+    Each call's rows × (longest prompt + max_new_tokens) stays within
+    max_tokens; a row that is over the budget on its own runs alone.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches: list[list[int]] = []
+    for i in order:
+        if batches:
+            batch = batches[-1]
+            width = lengths[batch[0]] + max_new_tokens
+            if (len(batch) + 1) * width <= max_tokens and (max_rows is None or len(batch) < max_rows):
+                batch.append(i)
+                continue
+        batches.append([i])
+    return batches
+
+
+def kv_bytes_per_token(model) -> int:
+    """KV-cache bytes one token holds: keys and values for every layer."""
+    config = model.config
+    heads = getattr(config, "num_attention_heads")
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // heads
+    dtype_bytes = next(model.parameters()).element_size()
+    return 2 * config.num_hidden_layers * kv_heads * head_dim * dtype_bytes
+
+
+# ── generation ───────────────────────────────────────────────────────────
+
+def generate_padded(model, tokenizer, rows: list[list[int]], max_new_tokens: int, gen_kwargs: dict,
+                    **generate_kwargs):
+    """One generate call over left-padded rows; the new tokens, one row each.
+
+    Rows that finish early are padded out to the longest with pad_token_id.
+    generate_kwargs go to model.generate as well (e.g. stopping_criteria).
+    """
+    torch, _ = _import_torch()
+    pad_id = tokenizer.pad_token_id
+    width = max(map(len, rows))
+    ids = torch.full((len(rows), width), pad_id, dtype=torch.long)
+    mask = torch.zeros((len(rows), width), dtype=torch.long)
+    for r, row in enumerate(rows):
+        ids[r, width - len(row):] = torch.tensor(row, dtype=torch.long)
+        mask[r, width - len(row):] = 1
+    with profiling.span("canary.generate", rows=len(rows), width=width), torch.no_grad():
+        output = model.generate(
+            input_ids=ids.to(model.device), attention_mask=mask.to(model.device),
+            max_new_tokens=max_new_tokens, pad_token_id=pad_id, **gen_kwargs, **generate_kwargs,
+        )
+    new = output[:, width:]
+    profiling.count("tokens_generated", count_new_tokens(new, pad_id))
+    return new
+
+
+def count_new_tokens(new, pad_id: int) -> int:
+    """Tokens generate() produced in new: the padding after a finished row isn't generated."""
+    return int((new != pad_id).sum()) + int((new == pad_id).any(dim=1).sum())
+
+
+def generate_rows(model, tokenizer, rows: list[list[int]], max_new_tokens: int,
+                  gen_kwargs: dict) -> tuple[list[str], int]:
+    """One generate call over left-padded rows; (decoded responses, new tokens)."""
+    new = generate_padded(model, tokenizer, rows, max_new_tokens, gen_kwargs)
+    return tokenizer.batch_decode(new, skip_special_tokens=True), count_new_tokens(new, tokenizer.pad_token_id)
+
+
+def encode_canaries(tokenizer, canaries: str, style: str) -> dict[str, list[int]]:
+    """{letter: formatted prompt's token IDs}; chat templates already carry BOS."""
+    return {letter: tokenizer(format_prompt(tokenizer, CANARY_PROMPTS[letter], style),
+                              add_special_tokens=False)["input_ids"]
+            for letter in canaries}
+
+
+def run_canaries(model, tokenizer, style: str | None = None, canaries: str | None = None,
+                 n_samples: int = N_SAMPLES, max_new_tokens: int | None = None,
+                 gen_kwargs: dict | None = None, max_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+                 max_rows: int | None = None, shared_prefix: bool = False, seed: int | None = None,
+                 log=None) -> dict[str, list[str]]:
+    """{letter: [n_samples responses]} for the model's canaries, batched.
+
+    max_rows=1 is the notebooks' one-call-per-sample loop.  shared_prefix
+    samples each canary from one prefill instead (sweep_canaries; seed then
+    fixes every sample).  log, if given, is called with (call number, rows,
+    prompt tokens, seconds, new tokens) after each call.
+    """
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token  # as the notebooks do
+    style = style or prompt_style(tokenizer)
+    canaries = canaries or MODEL_CANARIES[style]
+    max_new_tokens = max_new_tokens or MAX_NEW_TOKENS[style]
+    gen_kwargs = GEN_KWARGS if gen_kwargs is None else gen_kwargs
+    if shared_prefix:
+        temperature = gen_kwargs.get("temperature", 1.0)
+        return sweep_canaries(model, tokenizer, [temperature], style, canaries, n_samples, max_new_tokens,
+                              gen_kwargs, seed, log)[temperature]
+
+    encoded = encode_canaries(tokenizer, canaries, style)
+    rows = [(letter, i) for letter in canaries for i in range(n_samples)]
+    lengths = [len(encoded[letter]) for letter, _ in rows]
+
+    outputs: dict[str, list[str]] = {letter: [""] * n_samples for letter in canaries}
+    for number, batch in enumerate(plan_batches(lengths, max_new_tokens, max_tokens, max_rows), 1):
+        start = time.perf_counter()
+        texts, new_tokens = generate_rows(model, tokenizer, [encoded[rows[r][0]] for r in batch],
+                                          max_new_tokens, gen_kwargs)
+        for r, text in zip(batch, texts):
+            letter, i = rows[r]
+            outputs[letter][i] = text
+        if log:
+            log(number, len(batch), max(lengths[r] for r in batch), time.perf_counter() - start, new_tokens)
+    profiling.count("samples", len(rows))
+    return outputs
+
+
+def sweep_canaries(model, tokenizer, temperatures: list[float], style: str | None = None,
+                   canaries: str | None = None, n_samples: int = N_SAMPLES,
+                   max_new_tokens: int | None = None, gen_kwargs: dict | None = None,
+                   seed: int | None = None, log=None) -> dict[float, dict[str, list[str]]]:
+    """{temperature: {letter: [n_samples responses]}}, one prefill per canary.
+
+    Every sample at every temperature forks the canary's prompt KV cache
+    (prefix_sampling.py).  With a seed, sample i of a canary uses the same
+    seed at each temperature, so the sweep compares temperatures on the same
+    random draws, and a sample comes out the same however the run is batched.
+    """
+    from prefix_sampling import SamplingParams, eos_token_ids, sample_continuations
+
+    style = style or prompt_style(tokenizer)
+    canaries = canaries or MODEL_CANARIES[style]
+    max_new_tokens = max_new_tokens or MAX_NEW_TOKENS[style]
+    gen_kwargs = GEN_KWARGS if gen_kwargs is None else gen_kwargs
+    encoded = encode_canaries(tokenizer, canaries, style)
+    eos_ids = eos_token_ids(model, tokenizer)
+
+    outputs: dict[float, dict[str, list[str]]] = {t: {} for t in temperatures}
+    for number, letter in enumerate(canaries, 1):
+        seeds = [None if seed is None else seed + (number - 1) * n_samples + i for i in range(n_samples)]
+        params = [SamplingParams.from_kwargs({**gen_kwargs, "temperature": t}, seed=s)
+                  for t in temperatures for s in seeds]
+        start = time.perf_counter()
+        samples = sample_continuations(model, encoded[letter], params, max_new_tokens, eos_ids)
+        for k, t in enumerate(temperatures):
+            outputs[t][letter] = [tokenizer.decode(ids, skip_special_tokens=True)
+                                  for ids in samples[k * n_samples:(k + 1) * n_samples]]
+        if log:
+            log(number, len(params), len(encoded[letter]), time.perf_counter() - start, sum(map(len, samples)))
+    profiling.count("samples", len(canaries) * n_samples * len(temperatures))
+    return outputs
+
+
+# ── models ───────────────────────────────────────────────────────────────
+
+def build_tiny_model(name: str, seed: int = 0):
+    """(model, tokenizer) for "tiny-gpt2" or "tiny-llama": random weights, a BPE trained on the canaries."""
+    torch, transformers = _import_torch()
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+    llama = name == "tiny-llama"
+    specials = (["<|begin_of_text|>", "<|end_of_text|>", "<|start_header_id|>", "<|end_header_id|>",
+                 "<|eot_id|>"] if llama else ["<|endoftext|>"])
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(CANARY_PROMPTS.values(), trainers.BpeTrainer(
+        vocab_size=512, special_tokens=specials, initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        show_progress=False,
+    ))
+    if llama:
+        tokenizer = transformers.PreTrainedTokenizerFast(
+            tokenizer_object=bpe, bos_token=LLAMA3_BOS, eos_token="<|eot_id|>")
+        tokenizer.chat_template = TINY_CHAT_TEMPLATE
+    else:
+        tokenizer = transformers.PreTrainedTokenizerFast(
+            tokenizer_object=bpe, bos_token="<|endoftext|>", eos_token="<|endoftext|>")
+
+    vocab = len(tokenizer)
+    if llama:
+        config = transformers.LlamaConfig(
+            vocab_size=vocab, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+            num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=2048,
+            bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+        )
+    else:
+        config = transformers.GPT2Config(
+            vocab_size=vocab, n_positions=1024, n_embd=64, n_layer=2, n_head=4,
+            bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+        )
+    torch.manual_seed(seed)
+    model = transformers.AutoModelForCausalLM.from_config(config)
+    return model.eval(), tokenizer
+
+
+def load_model(spec: str, adapter: Path | None = None, device: str | None = None, dtype: str = "auto"):
+    """(model, tokenizer) for a local path, a Hub model id, or one of TINY_MODELS."""
+    torch, transformers = _import_torch()
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    if dtype == "auto":
+        dtype = "float16" if device.startswith("cuda") else "float32"
+
+    with profiling.span("canary.load", model=spec):
+        if spec in TINY_MODELS:
+            model, tokenizer = build_tiny_model(spec)
+            model = model.to(getattr(torch, dtype))
+        else:
+            model = transformers.AutoModelForCausalLM.from_pretrained(spec, dtype=getattr(torch, dtype))
+            tokenizer_source = spec
+            if adapter is not None:
+                try:
+                    from peft import PeftModel
+                except ImportError:
+                    raise ImportError("--adapter needs peft: pip install peft") from None
+                model = PeftModel.from_pretrained(model, str(adapter))
+                if (adapter / "tokenizer_config.json").exists():
+                    tokenizer_source = str(adapter)  # the notebooks save the tokenizer with the adapter
+            tokenizer = transformers.AutoTokenizer.from_pretrained(tokenizer_source)
+        model = model.to(device).eval()
+    return model, tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate canary samples with batched generation")
+    parser.add_argument("model", help=f"Model path or Hub id, or {' / '.join(TINY_MODELS)} (random, offline)")
+    parser.add_argument("-o", "--output", type=Path, required=True,
+                        help="Output JSON ({letter: [samples]}, as format_canary.py reads)")
+    parser.add_argument("--adapter", type=Path, default=None, help="LoRA adapter folder to apply (needs peft)")
+    parser.add_argument("--format", choices=sorted(MODEL_CANARIES), default=None,
+                        help="Prompt format (default: llama if the tokenizer has a chat template, else gpt2)")
+    parser.add_argument("--canaries", default=None,
+                        help="Canary letters to run (default: AB for gpt2, ABC for llama)")
+    parser.add_argument("--samples", type=int, default=N_SAMPLES,
+                        help=f"Samples per canary (default: {N_SAMPLES})")
+    parser.add_argument("--max-new-tokens", type=int, default=None,
+                        help="Tokens per sample (default: 512 for gpt2, 1024 for llama)")
+    parser.add_argument("--max-batch-tokens", type=int, default=DEFAULT_MAX_BATCH_TOKENS,
+                        help="Rows × (longest prompt + max new tokens) per generate call "
+                             f"(default: {DEFAULT_MAX_BATCH_TOKENS})")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="KV-cache budget per generate call in MB; replaces --max-batch-tokens")
+    parser.add_argument("--max-batch-size", type=int, default=None, help="Rows per generate call cap")
+    parser.add_argument("--serial", action="store_true",
+                        help="One sample per generate call, like the notebooks (for comparison)")
+    parser.add_argument("--shared-prefix", action="store_true",
+                        help="Sample each canary from one prefill, per-sample seeds (prefix_sampling.py)")
+    parser.add_argument("--temperatures", type=float, nargs="+", default=None,
+                        help="Sweep these temperatures from each canary's one prefill (implies --shared-prefix); "
+                             "writes {output}_t{T}.json per temperature")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="torch.manual_seed before generating; with --shared-prefix, sample i of the "
+                             "k-th canary (from 0) uses seed + k × samples + i, at every temperature")
+    parser.add_argument("--device", default=None, help="Device (default: cuda if available, else cpu)")
+    parser.add_argument("--dtype", choices=["auto", "float32", "float16", "bfloat16"], default="auto",
+                        help="Weights dtype (default: float16 on cuda, float32 on cpu)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    if args.canaries and set(args.canaries) - set(CANARY_PROMPTS):
+        print(f"ERROR: unknown canary letter(s) in {args.canaries!r} (have {''.join(CANARY_PROMPTS)})")
+        sys.exit(1)
+    if args.adapter is not None and not args.adapter.is_dir():
+        print(f"ERROR: adapter folder not found: {args.adapter}")
+        sys.exit(1)
+
+    torch, _ = _import_torch()
+    model, tokenizer = load_model(args.model, args.adapter, args.device, args.dtype)
+    style = args.format or prompt_style(tokenizer)
+    max_tokens = args.max_batch_tokens
+    if args.memory_budget is not None:
+        per_token = kv_bytes_per_token(model)
+        max_tokens = int(args.memory_budget * 2**20 // per_token)
+        print(f"Memory budget {args.memory_budget:g} MB at {per_token:,} KV bytes/token → {max_tokens:,} tokens per call")
+    max_rows = 1 if args.serial else args.max_batch_size
+
+    shared = args.shared_prefix or args.temperatures is not None
+    print(f"{args.model}: {style} format on {model.device}, canaries {args.canaries or MODEL_CANARIES[style]}, "
+          f"{args.samples} samples each{' from one prefill' if shared else ''}")
+
+    generated = []
+
+    def log(number, rows, width, seconds, new_tokens):
+        generated.append(new_tokens)
+        print(f"  call {number:3d}: {rows:3d} rows × {width} prompt tokens, "
+              f"{new_tokens:,} new tokens in {seconds:.2f}s")
+
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+    start = time.perf_counter()
+    if args.temperatures is not None:
+        runs = sweep_canaries(model, tokenizer, args.temperatures, style, args.canaries, args.samples,
+                              args.max_new_tokens, seed=args.seed, log=log)
+        if len(runs) > 1:
+            runs = {args.output.with_name(f"{args.output.stem}_t{t:g}.json"): out for t, out in runs.items()}
+        else:
+            runs = {args.output: next(iter(runs.values()))}
+    else:
+        runs = {args.output: run_canaries(model, tokenizer, style, args.canaries, args.samples,
+                                          args.max_new_tokens, max_tokens=max_tokens, max_rows=max_rows,
+                                          shared_prefix=shared, seed=args.seed, log=log)}
+    elapsed = time.perf_counter() - start
+
+    samples = sum(len(v) for outputs in runs.values() for v in outputs.values())
+    print(f"\n{samples} samples, {sum(generated):,} new tokens in {elapsed:.2f}s — "
+          f"{samples / elapsed:.2f} samples/s, {sum(generated) / elapsed:,.0f} tokens/s")
+    for path, outputs in runs.items():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(outputs, f, indent=2)
+        print(f"→ {path}  (markdown: python format_canary.py {path})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Optional SQLite store for the corpus: essays, prompts, pairs and their token counts.
+
+The markdown files stay the source of truth: the store is a queryable copy of
+prompts.md, the four pair files and the cleaned essays, with every pair's
+GPT-2 and Llama token counts computed once at import.  Syncing is
+incremental: a file whose size and mtime are unchanged is skipped from a
+stat(), and one that was touched but has the same content is only re-hashed.
+Export writes the store back out in the same markdown formats (pairs through
+pairs_file.write_pairs, so unchanged blocks keep their bytes), so the store
+can also restore a deleted or clobbered file.
+
+A store mirrors one pairs directory (1_data/pairs unless opened with another
+pairs_dir): pair rows are keyed by model and split, so a {model}_{split}.md
+anywhere else would replace the real file's rows, and is never synced in.
+
+Readers open the store, sync the files they depend on, then query:
+
+    with CorpusStore() as store:
+        store.sync_pairs()
+        slow = store.pairs(split="val", tier=3, gpt2_over=900)
+
+format_jsonl.py, llama_to_gpt2.py and token_budget.py take --store to read
+pairs or prompts from here instead of reparsing the markdown.
+
+Usage:
+    python corpus_store.py import                             # sync from 1_data (changed files only)
+    python corpus_store.py import --full                      # rebuild from scratch
+    python corpus_store.py export                             # write prompts.md + pair files from the store
+    python corpus_store.py export --out /tmp/pairs            # ... somewhere else
+    python corpus_store.py query --split val --tier 3 --gpt2-over 900   # pair files synced first
+    python corpus_store.py query --model llama --name 15-the-9-11 --show
+    python corpus_store.py stats                              # counts by file and tier
+    python corpus_store.py --db other.sqlite3 stats           # another store
+    python corpus_store.py --profile import                   # time hashing, parsing and counting
+
+Pair rows:
+    {"model": str, "split": str, "name": str, "tier": int | None,
+     "prompt": str | None, "response": str | None,
+     "gpt2_tokens": int | None, "llama_tokens": int | None}
+gpt2_tokens counts the GPT-2 training text (to_gpt2_format) under gpt2 and
+llama_tokens counts prompt + response under cl100k_base, the same counts as
+the .lengths.json manifests.  Both are None without tiktoken.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from format_jsonl import TIKTOKEN_AVAILABLE, count_tokens_gpt2, count_tokens_llama, to_gpt2_format
+from manifest import content_hash
+from pairs_file import iter_pairs_text, split_header, write_pairs
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_STORE = REPO_ROOT / "1_data" / "corpus.sqlite3"
+PAIRS_DIR = REPO_ROOT / "1_data" / "pairs"
+PROMPTS_FILE = PAIRS_DIR / "prompts.md"
+CLEANED_DIR = REPO_ROOT / "1_data" / "cleaned"
+
+PAIR_FILE_RE = re.compile(r"(llama|gpt2)_(train|val)")  # {model}_{split}.md
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path     TEXT PRIMARY KEY,   -- relative to the repo root
+    kind     TEXT NOT NULL,      -- prompts | pairs | essay
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash     TEXT NOT NULL,
+    header   TEXT,               -- text before the first block (prompts and pair files)
+    counted  INTEGER NOT NULL    -- token counts were taken (tiktoken was available)
+);
+CREATE TABLE IF NOT EXISTS essays (
+    slug        TEXT PRIMARY KEY,  -- file stem without _clean
+    path        TEXT NOT NULL,
+    text        TEXT NOT NULL,
+    gpt2_tokens INTEGER
+);
+CREATE TABLE IF NOT EXISTS prompts (
+    slug     TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    tier     INTEGER,
+    prompt   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prompts_tier ON prompts (tier);
+CREATE TABLE IF NOT EXISTS pairs (
+    model        TEXT NOT NULL,
+    split        TEXT NOT NULL,
+    position     INTEGER NOT NULL,
+    name         TEXT NOT NULL,
+    tier         INTEGER,
+    prompt       TEXT,
+    response     TEXT,
+    gpt2_tokens  INTEGER,
+    llama_tokens INTEGER,
+    PRIMARY KEY (model, split, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pairs_name ON pairs (name);
+CREATE INDEX IF NOT EXISTS pairs_split_tier ON pairs (split, tier, gpt2_tokens);
+"""
+
+PAIR_COLUMNS = ("model", "split", "name", "tier", "prompt", "response", "gpt2_tokens", "llama_tokens")
+
+
+def _rel(path: Path) -> str:
+    path = path.resolve()
+    try:
+        return path.relative_to(REPO_ROOT).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+# ── prompts.md format ────────────────────────────────────────────────────
+
+def prompts_header(text: str) -> str:
+    """Everything before the first "## slug" block (token_budget.parse_prompts_file skips it)."""
+    if text.startswith("## "):
+        return ""
+    return re.split(r"\n(?=## )", text, maxsplit=1)[0]
+
+
+def format_prompt(slug: str, entry: dict) -> str:
+    """One prompts.md block, ending in a newline (blocks are joined by blank lines)."""
+    lines = [f"## {slug}"]
+    if entry["tier"] is not None:
+        lines.append(f"tier: {entry['tier']}")
+    if entry["prompt"]:
+        lines.append(entry["prompt"])
+    return "\n".join(lines) + "\n"
+
+
+def render_prompts(header: str, prompts: dict[str, dict]) -> str:
+    """prompts.md text that parse_prompts_file reads back as the same {slug: {tier, prompt}}."""
+    blocks = [format_prompt(slug, entry) for slug, entry in prompts.items()]
+    header = header.rstrip()
+    return "\n".join(([header + "\n"] if header else []) + blocks)
+
+
+# ── store ────────────────────────────────────────────────────────────────
+
+class CorpusStore:
+    """A SQLite copy of the corpus files, kept in sync from their stat and content hash."""
+
+    def __init__(self, path: Path = DEFAULT_STORE, pairs_dir: Path = PAIRS_DIR):
+        self.path = path
+        self.pairs_dir = pairs_dir  # the pair files and prompts.md this store mirrors
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self) -> CorpusStore:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    # ── syncing ──────────────────────────────────────────────────────────
+
+    def _sync_file(self, path: Path, kind: str, load) -> bool:
+        """Reload one file if its content changed; load(text) replaces its rows.
+
+        Files imported without tiktoken are reloaded once it is available, to
+        fill in their token counts.  Returns True if the file was (re)imported.
+        """
+        rel = _rel(path)
+        st = path.stat()
+        row = self.db.execute("SELECT size, mtime_ns, hash, counted FROM sources WHERE path = ?",
+                              (rel,)).fetchone()
+        uncounted = TIKTOKEN_AVAILABLE and row is not None and not row[3]
+        if row and row[:2] == (st.st_size, st.st_mtime_ns) and not uncounted:
+            return False
+        data = path.read_bytes()
+        profiling.count("bytes_read", len(data))
+        h = content_hash(data)
+        with self.db:
+            if row and row[2] == h and not uncounted:
+                self.db.execute("UPDATE sources SET size = ?, mtime_ns = ? WHERE path = ?",
+                                (st.st_size, st.st_mtime_ns, rel))
+                return False
+            with profiling.span(f"corpus_store.load_{kind}", file=rel):
+                header = load(data.decode("utf-8"))
+            self.db.execute(
+                "INSERT OR REPLACE INTO sources (path, kind, size, mtime_ns, hash, header, counted) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (rel, kind, st.st_size, st.st_mtime_ns, h, header, TIKTOKEN_AVAILABLE))
+        return True
+
+    def covers(self, path: Path) -> bool:
+        """Whether path is in the pairs directory this store mirrors."""
+        return path.resolve().parent == self.pairs_dir.resolve()
+
+    def sync_pairs(self) -> list[str]:
+        """Import changed pair files ({model}_{split}.md); returns the files imported."""
+        done = []
+        for path in sorted(self.pairs_dir.glob("*.md")):
+            m = PAIR_FILE_RE.fullmatch(path.stem)
+            if m and self._sync_file(path, "pairs", lambda text: self._load_pairs(m[1], m[2], text)):
+                done.append(path.name)
+        return done
+
+    def sync_prompts(self) -> list[str]:
+        """Import prompts.md if it changed; returns [its name] if it was imported."""
+        prompts_file = self.pairs_dir / PROMPTS_FILE.name
+        if prompts_file.exists() and self._sync_file(prompts_file, "prompts", self._load_prompts):
+            return [prompts_file.name]
+        return []
+
+    def sync_essays(self, cleaned_dir: Path = CLEANED_DIR) -> list[str]:
+        """Import changed cleaned essays and drop essays whose file is gone."""
+        done = []
+        present = set()
+        for path in sorted(cleaned_dir.glob("*_clean.md")):
+            rel = _rel(path)
+            present.add(rel)
+            if self._sync_file(path, "essay", lambda text: self._load_essay(rel, path, text)):
+                done.append(path.name)
+        gone = [r for (r,) in self.db.execute("SELECT path FROM sources WHERE kind = 'essay'")
+                if r not in present]
+        with self.db:
+            self.db.executemany("DELETE FROM essays WHERE path = ?", [(r,) for r in gone])
+            self.db.executemany("DELETE FROM sources WHERE path = ?", [(r,) for r in gone])
+        return done
+
+    def sync(self) -> list[str]:
+        """Sync prompts, pairs and essays; returns the files imported."""
+        return self.sync_prompts() + self.sync_pairs() + self.sync_essays()
+
+    def clear(self) -> None:
+        with self.db:
+            for table in ("sources", "essays", "prompts", "pairs"):
+                self.db.execute(f"DELETE FROM {table}")
+
+    # Loaders run inside _sync_file's transaction and return the file header
+
+    def _load_pairs(self, model: str, split: str, text: str) -> str:
+        rows = []
+        for i, p in enumerate(iter_pairs_text(text)):
+            gpt2 = llama = None
+            if TIKTOKEN_AVAILABLE and p["prompt"] is not None and p["response"] is not None:
+                gpt2 = count_tokens_gpt2(to_gpt2_format(p["prompt"], p["response"])["text"])
+                llama = count_tokens_llama(p["prompt"] + p["response"])
+            rows.append((model, split, i, p["name"], p["tier"], p["prompt"], p["response"], gpt2, llama))
+        self.db.execute("DELETE FROM pairs WHERE model = ? AND split = ?", (model, split))
+        self.db.executemany("INSERT INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return split_header(text)
+
+    def _load_prompts(self, text: str) -> str:
+        from token_budget import parse_prompts_text  # needs tiktoken, like the import command
+
+        prompts = parse_prompts_text(text)
+        self.db.execute("DELETE FROM prompts")
+        self.db.executemany("INSERT INTO prompts VALUES (?, ?, ?, ?)",
+                            [(slug, i, e["tier"], e["prompt"]) for i, (slug, e) in enumerate(prompts.items())])
+        return prompts_header(text)
+
+    def _load_essay(self, rel: str, path: Path, text: str) -> None:
+        text = text.strip()
+        tokens = count_tokens_gpt2(text) if TIKTOKEN_AVAILABLE else None
+        self.db.execute("INSERT OR REPLACE INTO essays VALUES (?, ?, ?, ?)",
+                        (path.stem.removesuffix("_clean"), rel, text, tokens))
+
+    # ── queries ──────────────────────────────────────────────────────────
+
+    def pairs(self, model: str | None = None, split: str | None = None, tier: int | None = None,
+              name: str | None = None, gpt2_over: int | None = None,
+              llama_over: int | None = None) -> list[dict]:
+        """Pair rows matching every given filter, in file order.
+
+        name matches pairs whose name contains it; *_over keeps pairs with
+        more than that many tokens.
+        """
+        where, args = [], []
+        for column, value in (("model", model), ("split", split), ("tier", tier)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if name is not None:
+            where.append("instr(name, ?) > 0")
+            args.append(name)
+        for column, value in (("gpt2_tokens", gpt2_over), ("llama_tokens", llama_over)):
+            if value is not None:
+                where.append(f"{column} > ?")
+                args.append(value)
+        sql = f"SELECT {', '.join(PAIR_COLUMNS)} FROM pairs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY model, split, position"
+        with profiling.span("corpus_store.query"):
+            return [dict(zip(PAIR_COLUMNS, row)) for row in self.db.execute(sql, args)]
+
+    def pair_files(self) -> list[tuple[str, str]]:
+        """(model, split) for every pair file in the store."""
+        return list(self.db.execute("SELECT DISTINCT model, split FROM pairs ORDER BY model, split"))
+
+    def header(self, rel: str) -> str | None:
+        row = self.db.execute("SELECT header FROM sources WHERE path = ?", (rel,)).fetchone()
+        return row[0] if row else None
+
+    def prompts(self) -> dict[str, dict]:
+        """{slug: {tier, prompt}} in prompts.md order, as parse_prompts_file returns."""
+        return {slug: {"tier": tier, "prompt": prompt} for slug, tier, prompt in
+                self.db.execute("SELECT slug, tier, prompt FROM prompts ORDER BY position")}
+
+    def essay(self, slug: str) -> str | None:
+        row = self.db.execute("SELECT text FROM essays WHERE slug = ?", (slug,)).fetchone()
+        return row[0] if row else None
+
+    # ── export ───────────────────────────────────────────────────────────
+
+    def export(self, pairs_dir: Path | None = None) -> list[tuple[Path, bool]]:
+        """Write prompts.md and every pair file into pairs_dir; returns (path, written) per file.
+
+        pairs_dir defaults to the one the store mirrors.  Exporting to the
+        files the store was imported from records their new stat, so the next
+        sync doesn't import them again.
+        """
+        pairs_dir = pairs_dir or self.pairs_dir
+        results = []
+        for model, split in self.pair_files():
+            path = pairs_dir / f"{model}_{split}.md"
+            header = self.header(_rel(self.pairs_dir / path.name)) or ""
+            records = [{**p, "prompt": p["prompt"] or "", "response": p["response"] or ""}
+                       for p in self.pairs(model, split)]
+            results.append((path, write_pairs(path, header, records)["written"]))
+
+        prompts = self.prompts()
+        if prompts:
+            path = pairs_dir / PROMPTS_FILE.name
+            text = render_prompts(self.header(_rel(self.pairs_dir / PROMPTS_FILE.name)) or "", prompts)
+            written = not path.exists() or path.read_text(encoding="utf-8") != text
+            if written:
+                tmp = path.with_name(f".{path.name}.tmp")
+                tmp.write_text(text, encoding="utf-8")
+                os.replace(tmp, path)
+            results.append((path, written))
+
+        with self.db:
+            for path, _ in results:
+                st = path.stat()
+                self.db.execute("UPDATE sources SET size = ?, mtime_ns = ?, hash = ? WHERE path = ?",
+                                (st.st_size, st.st_mtime_ns, content_hash(path.read_bytes()), _rel(path)))
+        return results
+
+
+# ── main ─────────────────────────────────────────────────────────────────
+
+def print_pairs(rows: list[dict], show: bool) -> None:
+    print(f"  {'Pair':<40s}  {'File':<11s}  {'Tier':>4s}  {'GPT-2':>6s}  {'Llama':>6s}")
+    print(f"  {'-'*40}  {'-'*11}  {'-'*4}  {'-'*6}  {'-'*6}")
+    for r in rows:
+        tier = f"T{r['tier']}" if r["tier"] is not None else "T?"
+        print(f"  {r['name']:<40s}  {r['model'] + '_' + r['split']:<11s}  {tier:>4s}  "
+              f"{r['gpt2_tokens'] if r['gpt2_tokens'] is not None else '-':>6}  "
+              f"{r['llama_tokens'] if r['llama_tokens'] is not None else '-':>6}")
+        if show:
+            print(f"\n### prompt\n{r['prompt']}\n\n### response\n{r['response']}\n")
+
+
+def print_stats(store: CorpusStore) -> None:
+    db = store.db
+    print(f"Store: {store.path}")
+    for kind, files in db.execute("SELECT kind, COUNT(*) FROM sources GROUP BY kind ORDER BY kind"):
+        print(f"  {kind}: {files} file(s)")
+    essays, essay_tokens = db.execute("SELECT COUNT(*), SUM(gpt2_tokens) FROM essays").fetchone()
+    print(f"  essays: {essays} ({essay_tokens or 0} GPT-2 tokens)")
+    print(f"  prompts: {db.execute('SELECT COUNT(*) FROM prompts').fetchone()[0]}")
+    for model, split, n, over in db.execute(
+            "SELECT model, split, COUNT(*), SUM(gpt2_tokens > 1024) FROM pairs "
+            "GROUP BY model, split ORDER BY model, split"):
+        tiers = ", ".join(f"T{t if t is not None else '?'}: {c}" for t, c in db.execute(
+            "SELECT tier, COUNT(*) FROM pairs WHERE model = ? AND split = ? GROUP BY tier ORDER BY tier",
+            (model, split)))
+        print(f"  {model}_{split}: {n} pairs ({tiers}); {over or 0} over 1024 GPT-2 tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite store for essays, prompts and pairs")
+    parser.add_argument("--db", type=Path, default=DEFAULT_STORE,
+                        help=f"Store file (default: {DEFAULT_STORE.relative_to(REPO_ROOT)})")
+    profiling.add_argument(parser)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="Sync the store from the markdown files")
+    p.add_argument("--full", action="store_true", help="Drop everything and import from scratch")
+
+    p = sub.add_parser("export", help="Write prompts.md and the pair files from the store")
+    p.add_argument("--out", type=Path, default=PAIRS_DIR,
+                   help=f"Directory to write to (default: {PAIRS_DIR.relative_to(REPO_ROOT)})")
+
+    p = sub.add_parser("query", help="List pairs matching filters")
+    p.add_argument("--model", choices=["llama", "gpt2"])
+    p.add_argument("--split", choices=["train", "val"])
+    p.add_argument("--tier", type=int)
+    p.add_argument("--name", help="Pairs whose name contains this")
+    p.add_argument("--gpt2-over", type=int, metavar="N", help="More than N GPT-2 tokens")
+    p.add_argument("--llama-over", type=int, metavar="N", help="More than N Llama (cl100k_base) tokens")
+    p.add_argument("--show", action="store_true", help="Also print prompt and response")
+
+    sub.add_parser("stats", help="Counts by file and tier")
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    if args.command == "import" and not TIKTOKEN_AVAILABLE:
+        print("ERROR: tiktoken required.  pip install tiktoken")
+        sys.exit(1)
+    if args.command != "import" and not args.db.exists():
+        print(f"ERROR: no store at {args.db} — run: python corpus_store.py import")
+        sys.exit(1)
+
+    with CorpusStore(args.db) as store:
+        if args.command == "import":
+            start = time.perf_counter()
+            if args.full:
+                store.clear()
+            imported = store.sync()
+            elapsed = time.perf_counter() - start
+            print(f"Imported {len(imported)} changed file(s) into {args.db} ({elapsed:.2f}s)")
+            for name in imported[:20]:
+                print(f"  {name}")
+            if len(imported) > 20:
+                print(f"  ... and {len(imported) - 20} more")
+
+        elif args.command == "export":
+            args.out.mkdir(parents=True, exist_ok=True)
+            for path, written in store.export(args.out):
+                print(f"  {'✓ wrote' if written else 'unchanged'} {path}")
+
+        elif args.command == "query":
+            store.sync_pairs()
+            start = time.perf_counter()
+            rows = store.pairs(args.model, args.split, args.tier, args.name, args.gpt2_over, args.llama_over)
+            elapsed = time.perf_counter() - start
+            print_pairs(rows, args.show)
+            print(f"\n{len(rows)} pair(s) in {elapsed * 1000:.1f} ms")
+
+        else:
+            print_stats(store)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate and train/val leakage check over the JSONL training data.
+
+Val pairs must come from different essays than training pairs, and a
+cross-posted Note or essay shouldn't be trained on twice.  This check reads
+the JSONL files format_jsonl.py writes and, separately for each model, flags:
+
+    leakage    a val response, or any paragraph of one, that nearly matches
+               a train response or paragraph
+    duplicate  two train responses that nearly match each other
+
+"Nearly matches" means the Jaccard similarity of their word 5-gram sets is
+at least --threshold.  Comparing every pair of texts is quadratic, so each
+text gets a MinHash signature (one-permutation hashing, 128 bins) and
+locality-sensitive hashing over bands of the signature proposes the
+candidate pairs; only candidates are compared exactly.  Identical texts are
+merged before that, so a repeated paragraph costs one signature.  The
+band/row split is chosen for the threshold so that pairs above it are
+almost never missed.
+
+Signatures are cached by text hash in .cache/minhash.sqlite3, so a rerun
+only hashes the responses and paragraphs that changed.  The cache keeps
+exactly the texts seen in the latest run.
+
+Train-train matches between paragraphs aren't reported: tier 2 and tier 3
+pairs built from the same essay share most of their paragraphs by design.
+GPT-2 pairs are truncated Llama pairs, so the models aren't compared with
+each other.
+
+Usage:
+    python dedup.py                     # check every split, threshold 0.8
+    python dedup.py --threshold 0.6     # looser matches
+    python dedup.py --model gpt2        # one model
+    python dedup.py --warn-only         # report, but exit 0 on findings
+    python dedup.py --profile           # time signatures, banding and verification
+
+Output:
+    1_data/jsonl/dedup_report.json      findings, for tooling
+Exits 1 when anything is flagged (the pipeline's dedup stage then fails).
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+import time
+from array import array
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+JSONL_DIR = REPO_ROOT / "1_data" / "jsonl"
+REPORT_PATH = JSONL_DIR / "dedup_report.json"
+CACHE_PATH = REPO_ROOT / ".cache" / "minhash.sqlite3"
+
+GPT2_SEPARATOR = "\n\n---\n\n"  # format_jsonl.to_gpt2_format
+
+SHINGLE_WORDS = 5
+NUM_BINS = 128
+MIN_PARAGRAPH_WORDS = 12  # shorter paragraphs ("Thanks for reading.") match by accident
+DEFAULT_THRESHOLD = 0.8
+
+_BIN_BITS = NUM_BINS.bit_length() - 1
+_VALUE_MASK = (1 << (64 - _BIN_BITS)) - 1
+_EMPTY = 1 << 64
+_WORD_RE = re.compile(r"\w+")
+
+
+# ── signatures ───────────────────────────────────────────────────────────
+
+def words(text: str) -> list[str]:
+    """Lowercased runs of letters and digits (punctuation and quote styles don't count)."""
+    return _WORD_RE.findall(text.lower())
+
+
+def shingles(text: str) -> set[int]:
+    """64-bit hashes of the text's word 5-grams (the whole text if it's shorter)."""
+    w = words(text)
+    grams = {" ".join(w[i:i + SHINGLE_WORDS]) for i in range(max(1, len(w) - SHINGLE_WORDS + 1))}
+    return {int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little")
+            for g in grams}
+
+
+def signature(hashes: set[int]) -> list[int]:
+    """One-permutation MinHash: the smallest hash value per bin, empty bins densified.
+
+    Each shingle hash lands in one of NUM_BINS bins by its low bits, so the
+    signature takes one pass instead of one per permutation.  An empty bin
+    borrows the value of the next non-empty bin to its right, offset by the
+    distance, which keeps two texts' bins agreeing with probability equal to
+    their Jaccard similarity.
+    """
+    sig = [_EMPTY] * NUM_BINS
+    for h in hashes:
+        b = h & (NUM_BINS - 1)
+        v = h >> _BIN_BITS
+        if v < sig[b]:
+            sig[b] = v
+    if _EMPTY in sig:  # every text has at least one shingle, so some bin is filled
+        for b in range(NUM_BINS):
+            if sig[b] == _EMPTY:
+                t = 1
+                while sig[(b + t) % NUM_BINS] == _EMPTY or sig[(b + t) % NUM_BINS] > _VALUE_MASK:
+                    t += 1
+                sig[b] = sig[(b + t) % NUM_BINS] + (t << (64 - _BIN_BITS))
+    return sig
+
+
+def jaccard(a: set[int], b: set[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def lsh_params(threshold: float, num_bins: int = NUM_BINS) -> tuple[int, int]:
+    """(bands, rows per band) for a similarity threshold.
+
+    A pair with similarity s shares at least one band with probability
+    1 - (1 - s^rows)^bands.  Among splits using every bin, pick the one
+    minimizing the expected misses above the threshold, weighted 4:1 against
+    the extra candidates below it (candidates are cheap to reject; misses
+    are silent).
+    """
+    def area(f, lo: float, hi: float, steps: int = 200) -> float:
+        width = (hi - lo) / steps
+        return sum(f(lo + (k + 0.5) * width) for k in range(steps)) * width
+
+    best = None
+    for rows in range(1, num_bins + 1):
+        if num_bins % rows:
+            continue
+        bands = num_bins // rows
+        candidate = lambda s: 1 - (1 - s ** rows) ** bands
+        false_pos = area(candidate, 0.0, threshold)
+        false_neg = area(lambda s: 1 - candidate(s), threshold, 1.0)
+        cost = 0.2 * false_pos + 0.8 * false_neg
+        if best is None or cost < best[0]:
+            best = (cost, bands, rows)
+    return best[1], best[2]
+
+
+class SignatureCache:
+    """MinHash signatures keyed by a hash of the text, in a small SQLite file.
+
+    path None keeps nothing between runs.
+    """
+
+    def __init__(self, path: Path | None = CACHE_PATH):
+        self.hits = 0
+        self.misses = 0
+        self._new: dict[bytes, list[int]] = {}
+        self._used: set[bytes] = set()
+        self._db = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=30)
+            self._db.execute("CREATE TABLE IF NOT EXISTS signatures (key BLOB PRIMARY KEY, sig BLOB NOT NULL) "
+                             "WITHOUT ROWID")
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        params = f"{SHINGLE_WORDS}:{NUM_BINS}:".encode()
+        return hashlib.blake2b(params + text.encode("utf-8"), digest_size=16).digest()
+
+    def signature(self, text: str) -> list[int]:
+        k = self.key(text)
+        self._used.add(k)
+        row = self._db.execute("SELECT sig FROM signatures WHERE key = ?", (k,)).fetchone() if self._db else None
+        if row is not None:
+            self.hits += 1
+            profiling.count("minhash_cache.hits")
+            return array("Q", row[0]).tolist()
+        self.misses += 1
+        profiling.count("minhash_cache.misses")
+        sig = self._new[k] = signature(shingles(text))
+        return sig
+
+    def close(self) -> None:
+        """Store new signatures and drop those not used this run."""
+        if self._db is None:
+            return
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO signatures VALUES (?, ?)",
+                                 [(k, array("Q", sig).tobytes()) for k, sig in self._new.items()])
+            self._db.execute("CREATE TEMP TABLE used (key BLOB PRIMARY KEY)")
+            self._db.executemany("INSERT INTO used VALUES (?)", [(k,) for k in self._used])
+            self._db.execute("DELETE FROM signatures WHERE key NOT IN (SELECT key FROM used)")
+        self._db.close()
+        self._db = None
+
+    def summary(self) -> str:
+        return f"signature cache: {self.hits} hits, {self.misses} computed"
+
+
+# ── candidates ───────────────────────────────────────────────────────────
+
+def candidate_pairs(signatures: list[list[int]], bands: int, rows: int) -> set[tuple[int, int]]:
+    """Index pairs (i < j) whose signatures agree on every row of at least one band."""
+    pairs: set[tuple[int, int]] = set()
+    for b in range(bands):
+        buckets: dict[tuple, list[int]] = defaultdict(list)
+        lo = b * rows
+        for i, sig in enumerate(signatures):
+            buckets[tuple(sig[lo:lo + rows])].append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return pairs
+
+
+class Texts:
+    """Distinct texts with where each occurs: (split, label, example) per occurrence.
+
+    example is the index within its split, since labels can repeat.
+    """
+
+    def __init__(self):
+        self.texts: list[str] = []
+        self.occurrences: list[list[tuple[str, str, int]]] = []
+        self._index: dict[str, int] = {}
+
+    def add(self, text: str, split: str, label: str, example: int = 0) -> None:
+        i = self._index.get(text)
+        if i is None:
+            i = self._index[text] = len(self.texts)
+            self.texts.append(text)
+            self.occurrences.append([])
+        self.occurrences[i].append((split, label, example))
+
+
+def similar_texts(texts: Texts, threshold: float, cache: SignatureCache) -> list[tuple[int, int, float]]:
+    """(i, j, similarity) for distinct texts at or above the threshold, plus (i, i, 1.0)
+    for every text that occurs more than once."""
+    found = [(i, i, 1.0) for i, occ in enumerate(texts.occurrences) if len(occ) > 1]
+    if len(texts.texts) < 2:
+        return found
+    bands, rows = lsh_params(threshold)
+    with profiling.span("dedup.signatures"):
+        sigs = [cache.signature(t) for t in texts.texts]
+    with profiling.span("dedup.candidates"):
+        candidates = sorted(candidate_pairs(sigs, bands, rows))
+    profiling.count("lsh_candidates", len(candidates))
+    shingled: dict[int, set[int]] = {}
+
+    def shingle_set(i: int) -> set[int]:
+        if i not in shingled:
+            shingled[i] = shingles(texts.texts[i])
+        return shingled[i]
+
+    with profiling.span("dedup.verify"):
+        for i, j in candidates:
+            s = jaccard(shingle_set(i), shingle_set(j))
+            if s >= threshold:
+                found.append((i, j, s))
+    return found
+
+
+# ── checks ───────────────────────────────────────────────────────────────
+
+def load_split(model: str, split: str, jsonl_dir: Path = JSONL_DIR) -> list[tuple[str, str]] | None:
+    """(label, response) per example in {model}_{split}.jsonl, or None if it's missing.
+
+    Labels come from the .lengths.json manifest format_jsonl.py writes
+    alongside; without one, examples are numbered.
+    """
+    path = jsonl_dir / f"{model}_{split}.jsonl"
+    if not path.exists():
+        return None
+    profiling.count_file(path)
+    lengths = path.with_suffix(".lengths.json")
+    labels = []
+    if lengths.exists():
+        labels = [e["label"] for e in json.loads(lengths.read_text(encoding="utf-8"))["examples"]]
+
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "messages" in entry:
+                response = next((m["content"] for m in entry["messages"] if m["role"] == "assistant"), "")
+            else:
+                response = entry["text"].split(GPT2_SEPARATOR, 1)[-1]
+            examples.append((labels[i] if i < len(labels) else f"#{i + 1}", response))
+    return examples
+
+
+def paragraphs(text: str) -> list[str]:
+    return [p.strip() for p in text.split("\n\n") if len(words(p)) >= MIN_PARAGRAPH_WORDS]
+
+
+def check_model(splits: dict[str, list[tuple[str, str]]], threshold: float,
+                cache: SignatureCache) -> tuple[list[dict], list[dict]]:
+    """(leaks, duplicates) for one model's train and val examples.
+
+    Leak dicts:      {"val", "train", "similarity", "paragraphs", "excerpt"}
+                     similarity is for the whole responses (None if only
+                     paragraphs match); paragraphs counts matching val paragraphs
+    Duplicate dicts: {"a", "b", "similarity"}
+                     a pair that shares a label gets its example numbers
+    """
+    responses, paras = Texts(), Texts()
+    for split, examples in splits.items():
+        for example, (label, response) in enumerate(examples):
+            responses.add(response.strip(), split, label, example)
+            if "val" in splits:  # paragraphs only matter for leakage
+                for p in paragraphs(response):
+                    paras.add(p, split, label, example)
+
+    leaks: dict[tuple[str, str], dict] = {}
+    duplicates: dict[tuple[tuple[str, int], tuple[str, int]], float] = {}
+
+    def leak(val: str, train: str) -> dict:
+        return leaks.setdefault((val, train), {"val": val, "train": train, "similarity": None,
+                                               "paragraphs": set(), "excerpt": None})
+
+    def occurrence_pairs(texts: Texts, i: int, j: int):
+        occ_i, occ_j = texts.occurrences[i], texts.occurrences[j]
+        for x, a in enumerate(occ_i):
+            for y, b in enumerate(occ_j):
+                if i == j and y <= x:
+                    continue
+                yield a, b
+
+    for kind, texts in (("response", responses), ("paragraph", paras)):
+        for i, j, s in similar_texts(texts, threshold, cache):
+            for (split_a, a, ex_a), (split_b, b, ex_b) in occurrence_pairs(texts, i, j):
+                if {split_a, split_b} == {"train", "val"}:
+                    val, train = (a, b) if split_a == "val" else (b, a)
+                    entry = leak(val, train)
+                    if kind == "response":
+                        entry["similarity"] = max(entry["similarity"] or 0.0, s)
+                    else:
+                        val_text = i if split_a == "val" else j
+                        entry["paragraphs"].add(val_text)
+                        if entry["excerpt"] is None:
+                            entry["excerpt"] = texts.texts[val_text][:80]
+                elif kind == "response" and split_a == split_b == "train" and (a, ex_a) != (b, ex_b):
+                    key = tuple(sorted(((a, ex_a), (b, ex_b))))
+                    duplicates[key] = max(duplicates.get(key, 0.0), s)
+
+    leak_list = [{**e, "paragraphs": len(e["paragraphs"])} for e in leaks.values()]
+    leak_list.sort(key=lambda e: (-(e["similarity"] or 0), -e["paragraphs"], e["val"], e["train"]))
+    def name(label: str, example: int, other: str) -> str:
+        return f"{label} (#{example + 1})" if label == other else label
+
+    dup_list = [{"a": name(a, ex_a, b), "b": name(b, ex_b, a), "similarity": s}
+                for ((a, ex_a), (b, ex_b)), s in duplicates.items()]
+    dup_list.sort(key=lambda d: (-d["similarity"], d["a"], d["b"]))
+    return leak_list, dup_list
+
+
+# ── main ─────────────────────────────────────────────────────────────────
+
+def print_findings(model: str, leaks: list[dict], duplicates: list[dict], limit: int) -> None:
+    print(f"\n  [{model}] {len(leaks)} train/val leak(s), {len(duplicates)} duplicate training pair(s)")
+    for e in leaks[:limit]:
+        what = f"response {e['similarity']:.2f}" if e["similarity"] is not None else "responses differ"
+        if e["paragraphs"]:
+            what += f", {e['paragraphs']} paragraph(s) shared"
+        print(f"    LEAK  val {e['val']}  ↔  train {e['train']}  ({what})")
+        if e["excerpt"] and e["similarity"] is None:
+            print(f"          “{e['excerpt']}…”")
+    for d in duplicates[:limit]:
+        print(f"    DUP   train {d['a']}  ↔  train {d['b']}  ({d['similarity']:.2f})")
+    hidden = max(0, len(leaks) - limit) + max(0, len(duplicates) - limit)
+    if hidden:
+        print(f"    ... {hidden} more in {REPORT_PATH.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag near-duplicate training examples and train/val leakage")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Jaccard similarity of word {SHINGLE_WORDS}-grams to flag "
+                             f"(default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--model", choices=["llama", "gpt2"], action="append",
+                        help="Check only this model's splits (repeatable; default: both)")
+    parser.add_argument("--limit", type=int, default=20, help="Findings to print per kind (default: 20)")
+    parser.add_argument("--warn-only", action="store_true", help="Exit 0 even when something is flagged")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write cached signatures")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    if not 0 < args.threshold <= 1:
+        print("ERROR: --threshold must be in (0, 1]")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    cache = SignatureCache(None if args.no_cache else CACHE_PATH)
+    bands, rows = lsh_params(args.threshold)
+    print(f"Near-duplicate check: threshold {args.threshold}, {bands} bands × {rows} rows")
+
+    report = {"threshold": args.threshold, "models": {}}
+    flagged = 0
+    for model in args.model or ["llama", "gpt2"]:
+        splits = {}
+        for split in ("train", "val"):
+            examples = load_split(model, split)
+            if examples is not None:
+                splits[split] = examples
+        if "train" not in splits:
+            print(f"\n  [{model}] skipped (no {model}_train.jsonl — run format_jsonl.py)")
+            continue
+        with profiling.span("dedup.check_model", model=model):
+            leaks, duplicates = check_model(splits, args.threshold, cache)
+        print_findings(model, leaks, duplicates, args.limit)
+        report["models"][model] = {"examples": {s: len(e) for s, e in splits.items()},
+                                   "leaks": leaks, "duplicates": duplicates}
+        flagged += len(leaks) + len(duplicates)
+
+    cache.close()
+    REPORT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    REPORT_PATH.write_text(json.dumps(report, indent=1, ensure_ascii=False) + "\n", encoding="utf-8")
+    print(f"\n{cache.summary()}  ({time.perf_counter() - start:.1f}s)  →  {REPORT_PATH}")
+
+    if flagged and not args.warn_only:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
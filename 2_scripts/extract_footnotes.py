@@ -2,13 +2,18 @@
 """
 Extract footnotes from raw Substack essays into separate files.
 
-Finds the footnote section (after the final horizontal rule, starting at the
-first [N](url#footnote-anchor-...) marker) and saves cleaned footnotes.
+Finds the footnote section (from the first [N](url#footnote-anchor-...)
+marker, the same split preprocess.py uses to cut the essay's endmatter) and
+saves cleaned footnotes. `python preprocess.py --footnotes` writes the same
+files while cleaning, from a single read of each essay.
 
 Usage:
     python extract_footnotes.py                          # process all in 1_data/sources/essays/
     python extract_footnotes.py path/to/essay.md         # process a single file
     python extract_footnotes.py --dry-run                # show what would be extracted
+    python extract_footnotes.py --incremental            # only redo essays changed since last run
+    python extract_footnotes.py --jobs 8                 # extract across 8 processes (0 = all CPUs)
+    python extract_footnotes.py --profile                # time each phase (see profiling.py)
 
 Output goes to 1_data/sources/footnotes/ as {stem}_footnotes.md
 """
@@ -23,43 +28,15 @@ REPO_ROOT = Path(__file__).resolve().parent.parent
 ESSAYS_DIR = REPO_ROOT / "1_data" / "sources" / "essays"
 FOOTNOTES_DIR = REPO_ROOT / "1_data" / "sources" / "footnotes"
 
-# Horizontal rules (various formats): * * *, ***, ---, ___, etc.
-HORIZONTAL_RULE_RE = re.compile(r"^\s*[-*_]\s*[-*_]\s*[-*_][\s*_-]*$", re.MULTILINE)
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import preprocess
+import profiling
+from manifest import MANIFEST_NAME, Manifest
+from parallel import map_in_order
+from preprocess import clean_footnotes, split_endmatter, strip_header
 
-# Substack footnote definition anchor: [N](url#footnote-anchor-N-...)
-FOOTNOTE_ANCHOR_RE = re.compile(
-    r"^\[\d+\]\([^)]*#footnote-anchor-\d+-[^)]*\)$", re.MULTILINE
-)
-
-# Convert footnote anchors to clean [N] markers
-FOOTNOTE_ANCHOR_CLEAN_RE = re.compile(
-    r"^\[(\d+)\]\([^)]*#footnote-anchor-\d+-[^)]*\)$", re.MULTILINE
-)
-
-# --- Cleaning patterns (same as preprocess.py) ---
-
-# Linked images: [![alt](inner)](outer) with optional caption
-LINKED_IMAGE_RE = re.compile(
-    r"^\[!\[[^\]]*\]\([^)]*\)\]\([^)]*\).*$", re.MULTILINE
-)
-
-# Image markdown: ![alt](url)
-IMAGE_MD_RE = re.compile(r"!\[[^\]]*\]\([^)]+\)")
-
-# Markdown links: [text](url) -> text
-MARKDOWN_LINK_RE = re.compile(r"\[([^\]]+)\]\([^)]+\)")
-
-# Empty markdown links: [](url)
-EMPTY_LINK_RE = re.compile(r"\[\]\([^)]+\)")
-
-# Bare URLs on their own line
-BARE_URL_LINE_RE = re.compile(r"^https?://\S+\s*$", re.MULTILINE)
-
-# Inline bare URLs
-INLINE_BARE_URL_RE = re.compile(r"(?<!\()(https?://\S+)")
-
-# Multiple blank lines -> max two
-MULTI_BLANK_RE = re.compile(r"\n{3,}")
+# The footnote rules live in preprocess.py, shared with its --footnotes mode
+RULES_VERSION = preprocess.RULES_VERSION
 
 
 def extract_footnotes(text: str) -> Optional[str]:
@@ -67,79 +44,70 @@ def extract_footnotes(text: str) -> Optional[str]:
 
     Returns cleaned footnote text, or None if no footnotes found.
     """
-    # Find the last horizontal rule
-    last_rule = None
-    for m in HORIZONTAL_RULE_RE.finditer(text):
-        last_rule = m
-
-    if last_rule is None:
-        return None
-
-    after_rule = text[last_rule.end():]
+    text = strip_header(text)
+    with profiling.span("preprocess.endmatter"):
+        _, section = split_endmatter(text)
+    with profiling.span("preprocess.footnotes"):
+        return clean_footnotes(section) if section is not None else None
 
-    # Find the first footnote anchor after the last horizontal rule
-    m = FOOTNOTE_ANCHOR_RE.search(after_rule)
-    if m is None:
-        return None
 
-    footnotes = after_rule[m.start():]
+def read_footnotes(input_path: Path) -> Optional[str]:
+    """Read one essay and extract its footnotes; runs in --jobs workers."""
+    with profiling.span("extract_footnotes.file", file=input_path.name):
+        profiling.count_file(input_path)
+        return extract_footnotes(input_path.read_text(encoding="utf-8"))
 
-    # Clean the footnotes
-    # Convert [N](url#footnote-anchor-...) -> [N]
-    footnotes = FOOTNOTE_ANCHOR_CLEAN_RE.sub(r"[\1]", footnotes)
 
-    # Strip linked images
-    footnotes = LINKED_IMAGE_RE.sub("", footnotes)
+def process_file(input_path: Path, output_path: Path, dry_run: bool = False,
+                 manifest: Optional[Manifest] = None) -> Optional[int]:
+    """Extract footnotes from a single file. Returns the footnote count, or None if none were found."""
+    return write_result(input_path, output_path, read_footnotes(input_path), dry_run, manifest)
 
-    # Strip regular images
-    footnotes = IMAGE_MD_RE.sub("", footnotes)
 
-    # Strip markdown links, keep text
-    footnotes = MARKDOWN_LINK_RE.sub(r"\1", footnotes)
-
-    # Strip empty links
-    footnotes = EMPTY_LINK_RE.sub("", footnotes)
-
-    # Strip bare URL lines
-    footnotes = BARE_URL_LINE_RE.sub("", footnotes)
-
-    # Strip inline URLs
-    footnotes = INLINE_BARE_URL_RE.sub("", footnotes)
-
-    # Collapse blank lines
-    footnotes = MULTI_BLANK_RE.sub("\n\n", footnotes)
-
-    footnotes = footnotes.strip() + "\n"
-
-    return footnotes
-
-
-def process_file(input_path: Path, output_path: Path, dry_run: bool = False) -> bool:
-    """Extract footnotes from a single file. Returns True if footnotes were found."""
-    raw = input_path.read_text(encoding="utf-8")
-    footnotes = extract_footnotes(raw)
+def write_result(input_path: Path, output_path: Path, footnotes: Optional[str], dry_run: bool = False,
+                 manifest: Optional[Manifest] = None) -> Optional[int]:
+    """Write a read_footnotes() result (e.g. from a worker process) for input_path.
 
+    Returns the footnote count, or None if none were found.
+    """
     if footnotes is None:
         print(f"  {input_path.name}: no footnotes found")
-        return False
+        if manifest is not None and not dry_run:
+            if output_path.exists():
+                output_path.unlink()  # footnotes were removed from the essay
+            manifest.record(input_path, None, None)
+        return None
 
     count = len(re.findall(r"^\[\d+\]$", footnotes, re.MULTILINE))
 
     if dry_run:
         print(f"  {input_path.name}: {count} footnotes, {len(footnotes)} chars")
-        return True
+        return count
+
+    if manifest is not None and manifest.output_unchanged(input_path, output_path, footnotes):
+        manifest.record(input_path, output_path, footnotes)
+        print(f"  {input_path.name}: {count} footnotes, output unchanged")
+        return count
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
     output_path.write_text(footnotes, encoding="utf-8")
+    if manifest is not None:
+        manifest.record(input_path, output_path, footnotes)
     print(f"  {input_path.name}: {count} footnotes -> {output_path}")
-    return True
+    return count
 
 
 def main():
     parser = argparse.ArgumentParser(description="Extract footnotes from Substack essays")
     parser.add_argument("files", nargs="*", help="Specific files (default: all in sources/essays/)")
     parser.add_argument("--dry-run", action="store_true", help="Show what would be extracted")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Skip essays unchanged since the last run (tracked in footnotes/{MANIFEST_NAME})")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Worker processes for extraction (default: 1, 0 = one per CPU)")
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.setup(args)
 
     if args.files:
         paths = [Path(f) for f in args.files]
@@ -153,12 +121,40 @@ def main():
         print(f"No .md files found in {ESSAYS_DIR}")
         sys.exit(1)
 
+    manifest = Manifest(FOOTNOTES_DIR / MANIFEST_NAME, RULES_VERSION) if args.incremental else None
+
     print(f"Processing {len(paths)} file(s)...")
     found = 0
+    todo = []
     for p in paths:
         out = FOOTNOTES_DIR / (p.stem + "_footnotes.md")
-        if process_file(p, out, dry_run=args.dry_run):
-            found += 1
+        if manifest is not None and manifest.is_fresh(p, out):
+            found += manifest.entries[p.name]["output"] is not None
+        else:
+            todo.append((p, out))
+    unchanged = len(paths) - len(todo)
+
+    # Workers only extract; writes, manifest updates and logging stay here, in input order
+    with_notes = notes_total = 0
+    results = map_in_order(read_footnotes, [p for p, _ in todo], jobs=args.jobs)
+    for (p, out), footnotes in zip(todo, results):
+        count = write_result(p, out, footnotes, dry_run=args.dry_run, manifest=manifest)
+        if count is not None:
+            with_notes += 1
+            notes_total += count
+    found += with_notes
+
+    if args.dry_run and todo:
+        print(f"\nTotal: {with_notes} of {len(todo)} essay(s) have footnotes, {notes_total} footnotes")
+
+    if manifest is not None:
+        # Only a full sweep knows which essays are gone
+        removed = [] if args.files else manifest.prune(FOOTNOTES_DIR, paths, dry_run=args.dry_run)
+        for out in removed:
+            print(f"  {'would remove' if args.dry_run else 'removed'} {out.name} (essay gone)")
+        print(f"\n{len(paths) - unchanged} rebuilt | {unchanged} unchanged | {len(removed)} removed")
+        if not args.dry_run:
+            manifest.save()
 
     if not args.dry_run:
         print(f"\n{found} footnote file(s) written to {FOOTNOTES_DIR}/")
@@ -6,16 +6,21 @@ Usage:
     python format_canary.py <json_file> [<json_file2> ...]
     python format_canary.py 4_experiments/experiment\ logs/2_15-pairs/2_gpt2_finetuned.json
     python format_canary.py *_baselines.json *_finetuned.json
+    python format_canary.py --profile *_finetuned.json
 
 Output:
     Writes a .md file next to each input JSON with the same name.
     e.g. 2_gpt2_finetuned.json → 2_gpt2_finetuned.md
 """
 
+import argparse
 import json
 import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
 CANARY_PROMPTS = {
     "A": "Write a personal Substack Note/Tweet about class in America, told from the perspective of a Chinese first generation immigrant whose family is lower-middle class.",
     "B": "Write a personal Substack Note/Tweet about Eileen Gu and Alyssa Liu, both winter Olympic gold medalists. Both grew up in the Bay Area, are half-asian and half-white, conceived via anonymous egg donor, and raised by a single parent. Eileen competed for China in skiing and is maximizing her influencer career while studying at Stanford. Meanwhile, Alyssa competed for the United States, took breaks from skating, and is inactive on social media.",
@@ -30,6 +35,7 @@ CANARY_LABELS = {
 
 
 def format_json(path: Path) -> str:
+    profiling.count_file(path)
     with open(path) as f:
         data = json.load(f)
 
@@ -56,11 +62,13 @@ def format_json(path: Path) -> str:
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python format_canary.py <json_file> [<json_file2> ...]")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Convert canary output JSON files into readable markdown")
+    parser.add_argument("files", nargs="+", help="Canary output .json files")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
 
-    for arg in sys.argv[1:]:
+    for arg in args.files:
         path = Path(arg)
         if not path.exists():
             print(f"  SKIP: {path} not found")
@@ -69,7 +77,8 @@ def main():
             print(f"  SKIP: {path} is not a .json file")
             continue
 
-        md = format_json(path)
+        with profiling.span("format_canary.file", file=path.name):
+            md = format_json(path)
         out_path = path.with_suffix(".md")
         out_path.write_text(md, encoding="utf-8")
         print(f"  {path.name} → {out_path.name}")
@@ -13,23 +13,39 @@ Usage:
     python format_jsonl.py                    # process all files, write JSONL
     python format_jsonl.py --validate-only    # check format + token counts without writing
     python format_jsonl.py --stats            # print tier/split distribution
+    python format_jsonl.py --only gpt2_train  # just these splits (model_split, repeatable)
+    python format_jsonl.py --tokens           # also write pre-tokenized .bin/.idx datasets
+    python format_jsonl.py --tokens --llama-tokenizer path/to/Llama-3.1-8B-Instruct/
+    python format_jsonl.py --pack             # also pack GPT-2 pairs into 1024-token windows
+    python format_jsonl.py --store            # read pairs from the corpus store (corpus_store.py)
+    python format_jsonl.py --profile          # time parsing, token counting and writing (profiling.py)
 
 Output:
     1_data/jsonl/llama_train.jsonl
     1_data/jsonl/llama_val.jsonl
     1_data/jsonl/gpt2_train.jsonl
     1_data/jsonl/gpt2_val.jsonl
+    1_data/jsonl/{model}_{split}.lengths.json      (token counts per example; see length_batching.py)
+    1_data/tokens/{model}_{split}.bin/.idx/.json   (--tokens; see token_dataset.py)
+    1_data/jsonl/gpt2_{split}_packed.jsonl         (--pack; see pack_gpt2)
 """
 
 import argparse
 import json
-import re
 import sys
+from bisect import bisect_left, insort
 from pathlib import Path
+from typing import Iterable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from pairs_file import iter_pairs
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 PAIRS_DIR = REPO_ROOT / "1_data" / "pairs"
 OUTPUT_DIR = REPO_ROOT / "1_data" / "jsonl"
+TOKENS_DIR = REPO_ROOT / "1_data" / "tokens"
+DEFAULT_STORE = REPO_ROOT / "1_data" / "corpus.sqlite3"  # corpus_store.py
 
 GPT2_MAX_TOKENS = 1024
 LLAMA_MAX_TOKENS = 8192
@@ -46,14 +62,15 @@ INPUT_FILES = {
 try:
     import tiktoken
 
-    _gpt2_enc = tiktoken.get_encoding("gpt2")
-    _llama_enc = tiktoken.get_encoding("cl100k_base")  # proxy for Llama (~10-15% off)
+    # Counts go through the shared on-disk cache (token_cache.py, same
+    # directory), so unchanged pairs aren't re-tokenized on every run
+    from token_cache import count_tokens, shared_cache
 
     def count_tokens_gpt2(text: str) -> int:
-        return len(_gpt2_enc.encode(text))
+        return count_tokens(text, "gpt2")
 
     def count_tokens_llama(text: str) -> int:
-        return len(_llama_enc.encode(text))
+        return count_tokens(text, "cl100k_base")  # proxy for Llama (~10-15% off)
 
     TIKTOKEN_AVAILABLE = True
 except ImportError:
@@ -66,59 +83,31 @@ except ImportError:
         return len(text) // 4
 
 
-def parse_pairs_file(path: Path) -> list[dict]:
-    """Parse a pairs markdown file into a list of pair dicts.
+def collect_pairs(blocks: Iterable[dict]) -> tuple[list[dict], list[str]]:
+    """Check pairs_file.py records; returns (valid pair dicts, error messages).
 
-    Returns list of:
+    Pair dicts:
         {"label": str, "tier": int, "prompt": str, "response": str}
     """
-    text = path.read_text(encoding="utf-8")
-
-    # Split on ## pair: headings. First chunk is the file header, skip it.
-    raw_blocks = re.split(r"\n(?=## pair:)", text)
-
     pairs = []
     errors = []
 
-    for i, block in enumerate(raw_blocks):
-        block = block.strip()
-        if not block.startswith("## pair:"):
-            continue  # skip header / non-pair content
-
-        # Parse label from heading
-        heading_match = re.match(r"## pair:\s*(.+)", block)
-        if not heading_match:
+    for i, block in enumerate(blocks, 1):
+        label = block["name"]
+        if not label:
             errors.append(f"Block {i}: could not parse ## pair: heading")
             continue
-        label = heading_match.group(1).strip()
-
-        # Parse tier (default: 0 = unspecified)
-        tier_match = re.search(r"^tier:\s*(\d+)", block, re.MULTILINE)
-        tier = int(tier_match.group(1)) if tier_match else 0
 
-        # Parse prompt and response sections
-        prompt_match = re.search(r"### prompt\s*\n", block)
-        response_match = re.search(r"### response\s*\n", block)
+        # Tier default: 0 = unspecified
+        tier = block["tier"] if block["tier"] is not None else 0
+        prompt, response = block["prompt"], block["response"]
 
-        if not prompt_match:
+        if prompt is None:
             errors.append(f"'{label}': missing ### prompt section")
             continue
-        if not response_match:
+        if response is None:
             errors.append(f"'{label}': missing ### response section")
             continue
-
-        # Prompt = everything between ### prompt and ### response
-        prompt_start = prompt_match.end()
-        response_header_start = response_match.start()
-        prompt = block[prompt_start:response_header_start].strip()
-
-        # Response = everything after ### response (until end of block)
-        response_start = response_match.end()
-        response = block[response_start:].strip()
-
-        # Strip trailing horizontal rule if present (visual separator between pairs)
-        response = re.sub(r"\n---\s*$", "", response).strip()
-
         if not prompt:
             errors.append(f"'{label}': empty prompt")
             continue
@@ -133,6 +122,20 @@ def parse_pairs_file(path: Path) -> list[dict]:
             "response": response,
         })
 
+    return pairs, errors
+
+
+def parse_pairs_file(path: Path) -> list[dict]:
+    """Parse a pairs markdown file into a list of pair dicts (see collect_pairs)."""
+    # Blocks are streamed from pairs_file.py; the file header is skipped there
+    with profiling.span("format_jsonl.parse_pairs_file", file=path.name):
+        return check_pairs(iter_pairs(path))
+
+
+def check_pairs(blocks: Iterable[dict]) -> list[dict]:
+    """collect_pairs(), printing any errors."""
+    pairs, errors = collect_pairs(blocks)
+
     if errors:
         print("ERRORS:")
         for e in errors:
@@ -142,6 +145,28 @@ def parse_pairs_file(path: Path) -> list[dict]:
     return pairs
 
 
+def load_from_store(db: Path, only: list[str] | None) -> dict:
+    """(model, split) → pair dicts, from the corpus store instead of the markdown."""
+    from corpus_store import CorpusStore
+
+    all_pairs = {}
+    with CorpusStore(db) as store:
+        synced = store.sync_pairs()
+        if synced:
+            print(f"Synced {', '.join(synced)} into {db.name}")
+        stored = set(store.pair_files())
+        for model, split in INPUT_FILES:
+            if only and f"{model}_{split}" not in only:
+                continue
+            if (model, split) not in stored:
+                print(f"WARNING: no {model}_{split} pairs in {db.name} — skipping {model} {split}")
+                continue
+            pairs = check_pairs(store.pairs(model, split))
+            all_pairs[(model, split)] = pairs
+            print(f"Read {len(pairs)} pair(s) for {model}_{split} from {db.name}")
+    return all_pairs
+
+
 def to_llama_format(prompt: str, response: str) -> dict:
     """Chat-style JSONL for Llama fine-tuning."""
     return {
@@ -206,11 +231,183 @@ def write_jsonl(path: Path, entries: list[dict]) -> None:
             f.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
 
+_tokenizers: dict = {}
+
+
+def write_length_manifest(path: Path, pairs: list[dict], model: str, split: str) -> None:
+    """Token count per example, in JSONL order, for length-grouped batching."""
+    if model == "llama":
+        # Chat template overhead isn't counted; cl100k_base stands in for the Llama tokenizer
+        counts = [count_tokens_llama(p["prompt"] + p["response"]) for p in pairs]
+        counter = "cl100k_base (Llama proxy)" if TIKTOKEN_AVAILABLE else "len/4"
+    else:
+        counts = [count_tokens_gpt2(to_gpt2_format(p["prompt"], p["response"])["text"]) for p in pairs]
+        counter = "gpt2" if TIKTOKEN_AVAILABLE else "len/4"
+    manifest = {
+        "model": model,
+        "split": split,
+        "counter": counter,
+        "max_tokens": GPT2_MAX_TOKENS if model == "gpt2" else LLAMA_MAX_TOKENS,
+        "examples": [
+            {"label": p["label"], "tier": p["tier"], "tokens": n} for p, n in zip(pairs, counts)
+        ],
+    }
+    path.write_text(json.dumps(manifest, indent=1, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def load_tokenizer_or_exit(model: str, spec: str):
+    """token_dataset.load_tokenizer, once per spec; a bad --*-tokenizer is fatal."""
+    from token_dataset import load_tokenizer
+
+    if spec not in _tokenizers:
+        try:
+            _tokenizers[spec] = load_tokenizer(spec)
+        except (ImportError, OSError, ValueError) as e:
+            print(f"ERROR: {model} tokenizer {spec}: {e}")
+            sys.exit(1)
+    return _tokenizers[spec]
+
+
+def write_token_datasets(all_pairs: dict, tokenizer_specs: dict) -> None:
+    """Tokenize every split once, for loaders that read token IDs instead of JSONL."""
+    from token_dataset import write_token_dataset
+
+    print(f"\n--- Tokens ---")
+    for (model, split), pairs in all_pairs.items():
+        spec = tokenizer_specs[model]
+        if spec is None:
+            print(f"{model:6s} {split:5s}: skipped (pass --{model}-tokenizer)")
+            continue
+        tok = load_tokenizer_or_exit(model, spec)
+
+        to_format = to_llama_format if model == "llama" else to_gpt2_format
+        entries = (to_format(p["prompt"], p["response"]) for p in pairs)
+        stem = TOKENS_DIR / f"{model}_{split}"
+        header = write_token_dataset(stem, entries, tok)
+        print(f"{model:6s} {split:5s}: {header['examples']} pairs, {header['tokens']} tokens "
+              f"({header['dtype']})  →  {stem}.bin")
+        if header["boundary_inexact"]:
+            print(f"    WARNING: {header['boundary_inexact']} pair(s) with an approximate prompt/response boundary")
+
+
+# ── packing ──────────────────────────────────────────────────────────────
+
+def pack_windows(lengths: list[int], window: int) -> list[list[int]]:
+    """Bin-pack items into windows of `window` tokens, best-fit decreasing.
+
+    Longest item first; each goes into the open window with the least room
+    that still fits it (earliest window on ties), else opens a new one.
+    Returns item indices per window, in placement order.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    windows: list[list[int]] = []
+    room: list[tuple[int, int]] = []  # (tokens left, window number), sorted
+    for i in order:
+        k = bisect_left(room, (lengths[i], -1))
+        if k < len(room):
+            left, w = room.pop(k)
+        else:
+            left, w = window, len(windows)
+            windows.append([])
+        windows[w].append(i)
+        if left - lengths[i] > 0:
+            insort(room, (left - lengths[i], w))
+    return windows
+
+
+def pack_gpt2(pairs: list[dict], tok, window: int = GPT2_MAX_TOKENS) -> tuple[list[dict], dict]:
+    """Pack GPT-2 pairs into `window`-token training rows. Returns (rows, report).
+
+    Each pair is tokenized as to_gpt2_format() text, cut to window - 1 tokens
+    (the notebook truncates at MAX_SEQ_LEN too) and followed by EOS as the
+    document separator.  Rows are JSONL-ready:
+        input_ids     the packed tokens (no padding; at most `window`)
+        position_ids  restart at 0 for every document
+        labels        input_ids, with -100 on each document's first token so no
+                      document is trained to follow the previous one's EOS
+        documents     [start, length, prompt_len] per document, for building a
+                      block-diagonal attention mask (or masking prompts)
+        pairs         pair labels, in document order
+    """
+    from token_dataset import tokenize_example
+
+    docs = []
+    truncated = 0
+    for p in pairs:
+        ids, prompt_len, _ = tokenize_example(to_gpt2_format(p["prompt"], p["response"]), tok)
+        truncated += len(ids) > window - 1
+        ids = ids[:window - 1]
+        docs.append((p["label"], ids + [tok.eos_id], min(prompt_len, len(ids))))
+
+    rows = []
+    for members in pack_windows([len(ids) for _, ids, _ in docs], window):
+        row = {"input_ids": [], "position_ids": [], "labels": [], "documents": [], "pairs": []}
+        for i in members:
+            label, ids, prompt_len = docs[i]
+            row["documents"].append([len(row["input_ids"]), len(ids), prompt_len])
+            row["pairs"].append(label)
+            row["input_ids"] += ids
+            row["position_ids"] += range(len(ids))
+            row["labels"] += [-100] + ids[1:]
+        rows.append(row)
+
+    # Unpacked, every pair (without separator) is padded out to a full window
+    unpacked = sum(min(len(ids) - 1, window) for _, ids, _ in docs)
+    packed = sum(len(ids) for _, ids, _ in docs)
+    report = {
+        "pairs": len(docs),
+        "windows": len(rows),
+        "truncated": truncated,
+        "padding_before": 1 - unpacked / (len(docs) * window) if docs else 0.0,
+        "padding_after": 1 - packed / (len(rows) * window) if rows else 0.0,
+    }
+    return rows, report
+
+
+def write_packed(all_pairs: dict, tokenizer_spec: str) -> None:
+    """Pack every GPT-2 split into gpt2_{split}_packed.jsonl and report padding."""
+    tok = load_tokenizer_or_exit("gpt2", tokenizer_spec)
+    if tok.eos_id is None:
+        print(f"ERROR: gpt2 tokenizer {tokenizer_spec} has no EOS token to separate documents")
+        sys.exit(1)
+
+    print(f"\n--- Packed ({GPT2_MAX_TOKENS}-token windows) ---")
+    for (model, split), pairs in all_pairs.items():
+        if model != "gpt2":
+            continue
+        rows, r = pack_gpt2(pairs, tok)
+        path = OUTPUT_DIR / f"gpt2_{split}_packed.jsonl"
+        write_jsonl(path, rows)
+        fewer = r["pairs"] / r["windows"] if r["windows"] else 1.0
+        print(f"gpt2   {split:5s}: {r['pairs']} pairs → {r['windows']} windows "
+              f"({fewer:.1f}× fewer steps at batch size 1)  →  {path}")
+        print(f"    padding {r['padding_before']:.1%} → {r['padding_after']:.1%}")
+        if r["truncated"]:
+            print(f"    WARNING: {r['truncated']} pair(s) longer than one window were truncated")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Format training pairs as JSONL")
     parser.add_argument("--validate-only", action="store_true", help="Check format + tokens without writing")
     parser.add_argument("--stats", action="store_true", help="Print tier/split distribution")
+    parser.add_argument("--only", nargs="+", metavar="MODEL_SPLIT",
+                        choices=[f"{m}_{s}" for m, s in INPUT_FILES],
+                        help="Process only these splits, e.g. llama_train gpt2_val (default: all)")
+    parser.add_argument("--tokens", action="store_true",
+                        help=f"Also write memory-mapped token datasets to {TOKENS_DIR.relative_to(REPO_ROOT)}/")
+    parser.add_argument("--gpt2-tokenizer", default="gpt2",
+                        help="tiktoken encoding name or tokenizer.json for GPT-2 (default: gpt2)")
+    parser.add_argument("--llama-tokenizer", default=None,
+                        help="tokenizer.json (or its model folder) for Llama; --tokens skips Llama without it")
+    parser.add_argument("--pack", action="store_true",
+                        help=f"Also write GPT-2 splits packed into {GPT2_MAX_TOKENS}-token windows "
+                             f"(gpt2_*_packed.jsonl)")
+    parser.add_argument("--store", type=Path, nargs="?", const=DEFAULT_STORE, metavar="DB",
+                        help="Read pairs from the corpus store, synced from the pair files first "
+                             "(default DB: 1_data/corpus.sqlite3)")
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.setup(args)
 
     if not TIKTOKEN_AVAILABLE:
         print("NOTE: tiktoken not installed. Token counts are approximate (len÷4).")
@@ -218,13 +415,18 @@ def main():
 
     # Parse all input files
     all_pairs = {}
-    for (model, split), path in INPUT_FILES.items():
-        if not path.exists():
-            print(f"WARNING: {path.name} not found — skipping {model} {split}")
-            continue
-        pairs = parse_pairs_file(path)
-        all_pairs[(model, split)] = pairs
-        print(f"Parsed {len(pairs)} pair(s) from {path.name}")
+    if args.store:
+        all_pairs = load_from_store(args.store, args.only)
+    else:
+        for (model, split), path in INPUT_FILES.items():
+            if args.only and f"{model}_{split}" not in args.only:
+                continue
+            if not path.exists():
+                print(f"WARNING: {path.name} not found — skipping {model} {split}")
+                continue
+            pairs = parse_pairs_file(path)
+            all_pairs[(model, split)] = pairs
+            print(f"Parsed {len(pairs)} pair(s) from {path.name}")
 
     if not all_pairs:
         print("No valid pair files found.")
@@ -232,10 +434,13 @@ def main():
 
     # Validate and report
     for (model, split), pairs in all_pairs.items():
-        validate_and_report(pairs, model, split)
+        with profiling.span("format_jsonl.validate", split=f"{model}_{split}"):
+            validate_and_report(pairs, model, split)
 
     token_note = "" if TIKTOKEN_AVAILABLE else " (approximate — install tiktoken for accurate counts)"
     print(f"\nToken counts{token_note}")
+    if TIKTOKEN_AVAILABLE:
+        print(shared_cache().summary())
 
     if args.stats:
         print_stats(all_pairs)
@@ -252,12 +457,21 @@ def main():
             entries = [to_gpt2_format(p["prompt"], p["response"]) for p in pairs]
 
         path = OUTPUT_DIR / f"{model}_{split}.jsonl"
-        write_jsonl(path, entries)
+        with profiling.span("format_jsonl.write", file=path.name):
+            write_jsonl(path, entries)
+            write_length_manifest(path.with_suffix(".lengths.json"), pairs, model, split)
         output_paths[(model, split)] = (len(entries), path)
 
     print(f"\n--- Output ---")
     for (model, split), (count, path) in output_paths.items():
         print(f"{model:6s} {split:5s}: {count} pairs  →  {path}")
+    print(f"Token counts per example: {OUTPUT_DIR}/*.lengths.json (python length_batching.py <file>)")
+
+    if args.tokens:
+        write_token_datasets(all_pairs, {"gpt2": args.gpt2_tokenizer, "llama": args.llama_tokenizer})
+
+    if args.pack:
+        write_packed(all_pairs, args.gpt2_tokenizer)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Length-grouped batching under a per-batch token budget.
+
+Padding a batch to its longest member wastes most of a step when Tier 1
+essays and Tier 4 Notes land in the same batch.  LengthBucketSampler shuffles
+the examples (seeded), sorts each bucket of them by length, cuts batches so
+that batch size × longest member stays within the token budget, and shuffles
+the batch order.  Every epoch is reproducible from (seed, epoch).
+
+Lengths come from the manifests format_jsonl.py writes next to each JSONL
+file ({model}_{split}.lengths.json) or from a --tokens dataset (.idx).
+
+Training-loop use (the sampler yields lists of indices; it needs no torch):
+    sys.path.insert(0, f"{REPO_DIR}/2_scripts")
+    from length_batching import LengthBucketSampler, load_lengths
+    sampler = LengthBucketSampler(load_lengths(path), max_tokens=4096, seed=42, max_len=MAX_SEQ_LEN)
+    loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn)
+    for epoch in range(EPOCHS):
+        sampler.set_epoch(epoch)
+        ...
+
+Usage:
+    python length_batching.py 1_data/jsonl/llama_train.lengths.json --budget 4096
+    python length_batching.py 1_data/tokens/gpt2_train --budget 2048 4096 8192 --max-len 1024
+    python length_batching.py 1_data/jsonl/llama_train.lengths.json --profile
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
+
+def load_lengths(path: Path) -> list[int]:
+    """Per-example token counts from a .lengths.json manifest or a token dataset stem."""
+    path = Path(path)
+    if path.name.endswith(".lengths.json"):
+        profiling.count_file(path)
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+        return [example["tokens"] for example in manifest["examples"]]
+
+    from token_dataset import TokenDataset
+
+    with TokenDataset(path.with_suffix("") if path.suffix in (".bin", ".idx", ".json") else path) as ds:
+        return ds.lengths()
+
+
+def padding_efficiency(batches: list[list[int]], lengths: list[int]) -> float:
+    """Real tokens / tokens computed when every batch is padded to its longest member."""
+    padded = sum(len(b) * max(lengths[i] for i in b) for b in batches)
+    return sum(lengths[i] for b in batches for i in b) / padded if padded else 1.0
+
+
+class LengthBucketSampler:
+    """Batches of example indices with similar lengths, each within max_tokens.
+
+    max_tokens bounds batch size × longest member, i.e. the padded batch.  An
+    example longer than the budget gets a batch to itself.  max_len clips
+    lengths to the loader's truncation length before batching.  bucket_size
+    is how many shuffled examples are sorted together: larger buckets pad
+    less, smaller ones keep batches more random.
+
+    Works as a torch DataLoader batch_sampler: iterating gives lists of
+    indices, len() gives the number of batches this epoch.
+    """
+
+    def __init__(self, lengths: list[int], max_tokens: int, seed: int = 0, shuffle: bool = True,
+                 bucket_size: int = 1000, max_len: int | None = None):
+        if max_tokens <= 0:
+            raise ValueError(f"max_tokens must be positive, got {max_tokens}")
+        self.lengths = [min(n, max_len) if max_len else n for n in lengths]
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.shuffle = shuffle
+        self.bucket_size = max(1, bucket_size)
+        self.epoch = 0
+        self._batches: list[list[int]] | None = None
+
+    def set_epoch(self, epoch: int) -> None:
+        """Select the epoch whose shuffle the next iteration uses."""
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self._batches = None
+
+    def batches(self) -> list[list[int]]:
+        """This epoch's batches (computed once per epoch)."""
+        if self._batches is not None:
+            return self._batches
+
+        rng = random.Random(self.seed * 1_000_003 + self.epoch)
+        order = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(order)
+
+        batches: list[list[int]] = []
+        for b in range(0, len(order), self.bucket_size):
+            # Longest first, so a batch's first member sets its padded length;
+            # the sort is stable, so equal lengths keep their shuffled order
+            bucket = sorted(order[b:b + self.bucket_size], key=lambda i: -self.lengths[i])
+            batch: list[int] = []
+            for i in bucket:
+                if batch and self.lengths[batch[0]] * (len(batch) + 1) > self.max_tokens:
+                    batches.append(batch)
+                    batch = []
+                batch.append(i)
+            if batch:
+                batches.append(batch)
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        self._batches = batches
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self) -> int:
+        return len(self.batches())
+
+
+def fixed_size_batches(n: int, batch_size: int, seed: int = 0) -> list[list[int]]:
+    """Shuffled batches of a fixed size: what a plain DataLoader(batch_size=...) makes."""
+    order = list(range(n))
+    random.Random(seed).shuffle(order)
+    return [order[i:i + batch_size] for i in range(0, n, batch_size)]
+
+
+def report(lengths: list[int], budget: int, seed: int = 0, bucket_size: int = 1000) -> dict:
+    """Padding efficiency of bucketed batches under one budget vs random batches.
+
+    The random batches have the bucketed mean size, so both take about the
+    same number of steps per epoch and only the padding differs.
+    """
+    sampler = LengthBucketSampler(lengths, budget, seed=seed, bucket_size=bucket_size)
+    bucketed = sampler.batches()
+    fixed_size = max(1, round(len(lengths) / len(bucketed)))
+    fixed = fixed_size_batches(len(lengths), fixed_size, seed)
+    return {
+        "budget": budget,
+        "bucketed_batches": len(bucketed),
+        "bucketed_mean_size": len(lengths) / len(bucketed),
+        "bucketed_efficiency": padding_efficiency(bucketed, lengths),
+        "fixed_size": fixed_size,
+        "fixed_batches": len(fixed),
+        "fixed_efficiency": padding_efficiency(fixed, lengths),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report padding efficiency of length-bucketed batches")
+    parser.add_argument("source", type=Path,
+                        help="A {model}_{split}.lengths.json manifest or a token dataset stem")
+    parser.add_argument("--budget", type=int, nargs="+", default=[4096],
+                        help="Batch token budgets (batch size × longest member) to report (default: 4096)")
+    parser.add_argument("--max-len", type=int, default=None,
+                        help="Clip lengths to the loader's truncation length (e.g. 1024 for GPT-2)")
+    parser.add_argument("--seed", type=int, default=0, help="Shuffle seed (default: 0)")
+    parser.add_argument("--bucket-size", type=int, default=1000,
+                        help="Examples sorted together per bucket (default: 1000)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    lengths = load_lengths(args.source)
+    if args.max_len:
+        lengths = [min(n, args.max_len) for n in lengths]
+    if not lengths:
+        print(f"No examples in {args.source}")
+        sys.exit(1)
+
+    print(f"{args.source}: {len(lengths)} examples, "
+          f"length min/mean/max {min(lengths)} / {sum(lengths) / len(lengths):.0f} / {max(lengths)}")
+    print(f"\n  {'Budget':>7}  {'Bucketed':>8}  {'Size':>5}  {'Eff':>6}  {'Random':>6}  {'Size':>5}  {'Eff':>6}")
+    print(f"  {'-'*7}  {'-'*8}  {'-'*5}  {'-'*6}  {'-'*6}  {'-'*5}  {'-'*6}")
+    for budget in args.budget:
+        with profiling.span("length_batching.report", budget=budget):
+            r = report(lengths, budget, seed=args.seed, bucket_size=args.bucket_size)
+        print(f"  {budget:7d}  {r['bucketed_batches']:8d}  {r['bucketed_mean_size']:5.1f}  "
+              f"{r['bucketed_efficiency']:6.1%}  {r['fixed_batches']:6d}  {r['fixed_size']:5d}  "
+              f"{r['fixed_efficiency']:6.1%}")
+    print("  (batches = steps per epoch; Eff = real tokens / padded tokens; "
+          "random = shuffled batches of the same mean size)")
+
+
+if __name__ == "__main__":
+    main()
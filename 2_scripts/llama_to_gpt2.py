@@ -14,6 +14,8 @@ Usage:
     python llama_to_gpt2.py 1_data/pairs/llama_val.md             # → gpt2_val.md
     python llama_to_gpt2.py 1_data/pairs/llama_train.md --dry-run # stats only
     python llama_to_gpt2.py 1_data/pairs/llama_train.md -o out.md # custom output path
+    python llama_to_gpt2.py 1_data/pairs/llama_train.md --store   # read pairs from the corpus store
+    python llama_to_gpt2.py 1_data/pairs/llama_train.md --profile # time parsing and truncation
 
 Skips tier 1 pairs (Llama-only: rough draft → finished essay).
 """
@@ -21,7 +23,6 @@ Skips tier 1 pairs (Llama-only: rough draft → finished essay).
 from __future__ import annotations
 
 import argparse
-import re
 import sys
 from pathlib import Path
 
@@ -33,49 +34,61 @@ except ImportError:
     sys.exit(1)
 
 GPT2_MAX = 1024
+DEFAULT_STORE = Path(__file__).resolve().parent.parent / "1_data" / "corpus.sqlite3"  # corpus_store.py
 SEPARATOR = "\n\n---\n\n"
 SEP_TOKENS = len(enc.encode(SEPARATOR))
 
+# Import shared truncation engine from token_budget.py (same directory)
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import pairs_file
+import profiling
+from token_budget import ParagraphTokens
+from token_cache import count_tokens, shared_cache
+
 
 # ── parsing ──────────────────────────────────────────────────────────────
 
 def parse_pairs(text: str) -> list[dict]:
     """Parse a pairs .md file into list of {name, tier, prompt, response}."""
-    pairs: list[dict] = []
-    blocks = re.split(r"\n(?=## pair:)", text)
-
-    for block in blocks:
-        if not block.strip().startswith("## pair:"):
-            continue
-
-        name_m = re.match(r"## pair:\s*(.+)", block)
-        if not name_m:
-            continue
-        name = name_m.group(1).strip()
-
-        tier_m = re.search(r"^tier:\s*(\d+)", block, re.MULTILINE)
-        tier = int(tier_m.group(1)) if tier_m else None
-
-        prompt_m = re.search(r"### prompt\n(.*?)(?=\n### response)", block, re.DOTALL)
-        prompt = prompt_m.group(1).strip() if prompt_m else ""
+    # Response runs until a line that is just dashes (--- or --) or EOF (pairs_file.py)
+    return [
+        {"name": p["name"], "tier": p["tier"],
+         "prompt": p["prompt"] or "", "response": p["response"] or ""}
+        for p in pairs_file.iter_pairs_text(text) if p["name"]
+    ]
 
-        # Response runs until a line that is just dashes (--- or --) or EOF
-        resp_m = re.search(r"### response\n(.*?)(?=\n-{2,3}\s*$|\Z)", block, re.DOTALL)
-        response = resp_m.group(1).strip() if resp_m else ""
 
-        pairs.append({"name": name, "tier": tier, "prompt": prompt, "response": response})
+def load_from_store(db: Path, input_path: Path) -> list[dict]:
+    """parse_pairs() for the input file's rows in the corpus store (synced first)."""
+    from corpus_store import PAIR_FILE_RE, CorpusStore
 
-    return pairs
+    m = PAIR_FILE_RE.fullmatch(input_path.stem)
+    if not m:
+        print(f"ERROR: {input_path.name} is not a {{model}}_{{split}}.md pair file", file=sys.stderr)
+        sys.exit(1)
+    with CorpusStore(db) as store:
+        if not store.covers(input_path):
+            print(f"ERROR: the corpus store mirrors {store.pairs_dir}; {input_path} is not in it",
+                  file=sys.stderr)
+            sys.exit(1)
+        store.sync_pairs()
+        return [
+            {"name": p["name"], "tier": p["tier"],
+             "prompt": p["prompt"] or "", "response": p["response"] or ""}
+            for p in store.pairs(m[1], m[2]) if p["name"]
+        ]
 
 
 # ── truncation ───────────────────────────────────────────────────────────
 
+@profiling.timed("llama_to_gpt2.truncate_response")
 def truncate_response(response: str, prompt_tokens: int) -> tuple[str, int, int]:
     """Truncate response at paragraph boundary to fit GPT-2 budget.
 
     Returns (truncated_text, truncated_tokens, original_tokens).
     """
-    orig_tokens = len(enc.encode(response)) if response else 0
+    layout = ParagraphTokens(response)
+    orig_tokens = layout.total
     budget = GPT2_MAX - prompt_tokens - SEP_TOKENS
 
     if budget <= 0:
@@ -83,30 +96,15 @@ def truncate_response(response: str, prompt_tokens: int) -> tuple[str, int, int]
     if not response or orig_tokens <= budget:
         return response, orig_tokens, orig_tokens
 
-    paragraphs = response.split("\n\n")
-    running = 0
-    cut_idx = len(paragraphs)
-
-    for i, para in enumerate(paragraphs):
-        if i > 0:
-            running += len(enc.encode("\n\n"))
-        running += len(enc.encode(para))
-        if running > budget:
-            cut_idx = i
-            break
-
-    # BPE boundary effects can make joined text slightly longer than the
-    # sum-of-parts estimate.  Verify and trim until it actually fits.
-    while cut_idx > 0:
-        truncated = "\n\n".join(paragraphs[:cut_idx])
-        trunc_tokens = len(enc.encode(truncated))
-        if trunc_tokens <= budget:
-            break
-        cut_idx -= 1
-    else:
+    cut_idx = layout.find_cut_index(budget)
+    if cut_idx is None:
+        cut_idx = len(layout.paragraphs)
+
+    keep, trunc_tokens = layout.fit(budget, cut_idx)
+    if keep == 0:
         return "", 0, orig_tokens
 
-    return truncated, trunc_tokens, orig_tokens
+    return "\n\n".join(layout.paragraphs[:keep]), trunc_tokens, orig_tokens
 
 
 # ── output ───────────────────────────────────────────────────────────────
@@ -129,31 +127,19 @@ Val pairs must come from different essays than training pairs."""
 
 def format_pair(name: str, tier: int, prompt: str, response: str) -> str:
     """Format a single pair block."""
-    lines = [
-        f"## pair: {name}",
-        f"tier: {tier}",
-        "",
-        "### prompt",
-        prompt,
-        "",
-        "### response",
-        response,
-    ]
-    return "\n".join(lines)
+    return pairs_file.format_pair({"name": name, "tier": tier, "prompt": prompt, "response": response})
 
 
-def build_output(results: list[dict], is_val: bool) -> str:
-    """Assemble the full GPT-2 pairs .md file."""
-    header = GPT2_HEADER_VAL if is_val else GPT2_HEADER_TRAIN
-    blocks = [header, "---"]
+def gpt2_pairs(results: list[dict]) -> list[dict]:
+    """Pair dicts for the GPT-2 file: each result with its truncated response."""
+    return [{"name": r["name"], "tier": r["tier"], "prompt": r["prompt"], "response": r["truncated_response"]}
+            for r in results]
 
-    for r in results:
-        blocks.append(format_pair(
-            r["name"], r["tier"], r["prompt"], r["truncated_response"]
-        ))
-        blocks.append("---")
 
-    return "\n\n".join(blocks) + "\n"
+def build_output(results: list[dict], is_val: bool) -> str:
+    """Assemble the full GPT-2 pairs .md file (main writes it with write_pairs)."""
+    header = GPT2_HEADER_VAL if is_val else GPT2_HEADER_TRAIN
+    return pairs_file.render_pairs(header, gpt2_pairs(results))
 
 
 # ── main ─────────────────────────────────────────────────────────────────
@@ -167,10 +153,15 @@ def main():
                         help="Output path (default: replace 'llama' with 'gpt2' in filename)")
     parser.add_argument("--dry-run", action="store_true",
                         help="Print truncation stats without writing")
+    parser.add_argument("--store", type=Path, nargs="?", const=DEFAULT_STORE, metavar="DB",
+                        help="Read the input's pairs from the corpus store and import the output "
+                             "into it (default DB: 1_data/corpus.sqlite3)")
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.setup(args)
 
     input_path = Path(args.input)
-    if not input_path.exists():
+    if not input_path.exists() and not args.store:
         print(f"ERROR: {input_path} not found", file=sys.stderr)
         sys.exit(1)
 
@@ -184,8 +175,12 @@ def main():
             sys.exit(1)
         output_path = input_path.with_name(new_name)
 
-    text = input_path.read_text(encoding="utf-8")
-    pairs = parse_pairs(text)
+    if args.store:
+        pairs = load_from_store(args.store, input_path)
+    else:
+        with profiling.span("llama_to_gpt2.parse_pairs", file=input_path.name):
+            profiling.count_file(input_path)
+            pairs = parse_pairs(input_path.read_text(encoding="utf-8"))
 
     if not pairs:
         print("ERROR: no pairs found in input file.", file=sys.stderr)
@@ -200,7 +195,7 @@ def main():
             skipped.append(pair["name"])
             continue
 
-        prompt_tokens = len(enc.encode(pair["prompt"]))
+        prompt_tokens = count_tokens(pair["prompt"], enc.name)
         truncated, trunc_tok, orig_tok = truncate_response(pair["response"], prompt_tokens)
         budget = GPT2_MAX - prompt_tokens - SEP_TOKENS
 
@@ -239,15 +234,29 @@ def main():
     truncated_count = sum(1 for r in results if r["was_truncated"])
     print(f"\n  {len(results)} pairs | {truncated_count} truncated | output: {output_path}",
           file=sys.stderr)
+    print(f"  {shared_cache().summary()}", file=sys.stderr)
 
     if args.dry_run:
         return
 
     # Write output
-    is_val = "val" in input_path.name
-    output_text = build_output(results, is_val)
-    output_path.write_text(output_text, encoding="utf-8")
-    print(f"  ✓ wrote {output_path}", file=sys.stderr)
+    # Only pairs whose truncation changed are rewritten (pairs_file.write_pairs)
+    header = GPT2_HEADER_VAL if "val" in input_path.name else GPT2_HEADER_TRAIN
+    result = pairs_file.write_pairs(output_path, header, gpt2_pairs(results))
+    if result["written"]:
+        print(f"  ✓ wrote {output_path} ({result['formatted']} pair(s) rewritten, {result['kept']} kept)",
+              file=sys.stderr)
+    else:
+        print(f"  {output_path} unchanged", file=sys.stderr)
+    if args.store:
+        from corpus_store import CorpusStore
+
+        with CorpusStore(args.store) as store:
+            if store.covers(output_path):
+                store.sync_pairs()
+            else:
+                print(f"  {output_path} not imported: the corpus store mirrors {store.pairs_dir}",
+                      file=sys.stderr)
 
 
 if __name__ == "__main__":
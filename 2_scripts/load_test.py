@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Load-test the micro-batching request queue (batch_queue.py).
+
+Simulated clients share one MicroBatcher in front of a model: each sends
+--requests prompts (canary prompts, a random variant each), thinking for an
+exponentially distributed --think seconds between them, and a --cancel
+fraction gives up on a request partway through, as a closed browser tab
+would.  The report has latency p50/p99 over completed requests, throughput,
+batch sizes and queue depth.  --compare runs the same load with
+--max-batch 1 first, which is the notebooks' one-generate-per-click serving.
+
+The variants all point at the same loaded model: what the test exercises is
+the per-variant queues and the batching, not different weights.
+
+Usage:
+    python load_test.py tiny-gpt2 --clients 16 --requests 4 --max-new-tokens 64 --compare
+    python load_test.py tiny-llama --clients 32 --max-batch 16 --max-wait 50 --cancel 0.1
+    python load_test.py path/to/gpt2-voice-v1 --variants 2 --clients 8 --json /tmp/load.json
+    python load_test.py tiny-gpt2 --clients 8 --profile
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from batch_queue import GenerateRunner, MicroBatcher
+from format_canary import CANARY_PROMPTS
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """Nearest-rank percentile (p in 0–100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * p // 100) - 1))]
+
+
+async def run_load(runner: GenerateRunner, variants: list[str], clients: int, requests: int,
+                   max_new_tokens: int, max_batch: int, max_wait: float, think: float,
+                   cancel: float, seed: int) -> dict:
+    """Drive one MicroBatcher with simulated clients; returns the report dict."""
+    batcher = MicroBatcher(runner, max_batch=max_batch, max_wait=max_wait)
+    prompts = list(CANARY_PROMPTS.values())
+    latencies: list[float] = []
+    tokens_before = runner.tokens
+
+    async def client(number: int) -> None:
+        rng = random.Random(seed * 1000 + number)
+        for _ in range(requests):
+            await asyncio.sleep(rng.expovariate(1 / think) if think else 0)
+            request = batcher.submit(rng.choice(variants), (rng.choice(prompts), max_new_tokens))
+            start = time.perf_counter()
+            if rng.random() < cancel:
+                # Give up somewhere between queueing and an unbatched request's finish
+                try:
+                    await asyncio.wait_for(request, rng.uniform(0, max_wait * 2 + 0.05))
+                except asyncio.TimeoutError:
+                    continue
+            else:
+                await request
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with profiling.span("load_test.run", max_batch=max_batch, clients=clients):
+        await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    await batcher.close()
+
+    tokens = runner.tokens - tokens_before
+    return {
+        "max_batch": max_batch,
+        "max_wait_ms": round(max_wait * 1000, 1),
+        "clients": clients,
+        "completed": len(latencies),
+        "seconds": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "tokens_per_s": round(tokens / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        **batcher.stats.summary(),
+    }
+
+
+def print_report(r: dict) -> None:
+    print(f"  max batch {r['max_batch']:>2}, wait {r['max_wait_ms']:g} ms: {r['completed']} requests "
+          f"in {r['seconds']:.2f}s — {r['requests_per_s']:.2f} req/s, {r['tokens_per_s']:,.0f} tokens/s")
+    if r["completed"]:
+        print(f"    latency p50 {r['latency_p50_ms']:,.0f} ms, p99 {r['latency_p99_ms']:,.0f} ms; "
+              f"queue wait p50 {r['wait_p50_ms']:,.0f} ms")
+    print(f"    {r['batches']} batches, mean size {r['mean_batch_size']}, sizes {r['batch_sizes']}; "
+          f"queue depth max {r['max_queue_depth']}, mean {r['mean_queue_depth']}; "
+          f"{r['cancelled']} cancelled, {r['failed']} failed")
+
+
+def main():
+    from canary import TINY_MODELS, load_model
+
+    parser = argparse.ArgumentParser(description="Load-test the micro-batching request queue")
+    parser.add_argument("model", help=f"Model path or Hub id, or {' / '.join(TINY_MODELS)} (random, offline)")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent simulated clients (default: 16)")
+    parser.add_argument("--requests", type=int, default=4, help="Requests per client (default: 4)")
+    parser.add_argument("--variants", type=int, default=2, help="Model variants (separate queues; default: 2)")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="Tokens per request (default: 64)")
+    parser.add_argument("--max-batch", type=int, default=8, help="Largest batch (default: 8)")
+    parser.add_argument("--max-wait", type=float, default=20, help="Batching window in ms (default: 20)")
+    parser.add_argument("--think", type=float, default=50,
+                        help="Mean client pause between requests in ms (default: 50)")
+    parser.add_argument("--cancel", type=float, default=0.0,
+                        help="Fraction of requests the client abandons (default: 0)")
+    parser.add_argument("--compare", action="store_true", help="Run with --max-batch 1 first, for a baseline")
+    parser.add_argument("--seed", type=int, default=0, help="Client behaviour and sampling seed (default: 0)")
+    parser.add_argument("--json", type=Path, default=None, help="Also write the reports to this JSON file")
+    parser.add_argument("--device", default=None, help="Device (default: cuda if available, else cpu)")
+    parser.add_argument("--dtype", choices=["auto", "float32", "float16", "bfloat16"], default="auto",
+                        help="Weights dtype (default: float16 on cuda, float32 on cpu)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    if not 0 <= args.cancel <= 1:
+        print("ERROR: --cancel is a fraction between 0 and 1")
+        sys.exit(1)
+    if args.max_batch < 1 or args.variants < 1 or args.clients < 1:
+        print("ERROR: --max-batch, --variants and --clients must be at least 1")
+        sys.exit(1)
+
+    import torch
+
+    model, tokenizer = load_model(args.model, device=args.device, dtype=args.dtype)
+    variants = [f"v{i + 1}" for i in range(args.variants)]
+    runner = GenerateRunner({v: (model, tokenizer) for v in variants})
+    print(f"{args.model} on {model.device}: {args.clients} clients × {args.requests} requests, "
+          f"{args.variants} variant(s), {args.max_new_tokens} new tokens each")
+
+    reports = []
+    for max_batch in ([1] if args.compare else []) + [args.max_batch]:
+        torch.manual_seed(args.seed)
+        report = asyncio.run(run_load(runner, variants, args.clients, args.requests, args.max_new_tokens,
+                                      max_batch, args.max_wait / 1000, args.think / 1000, args.cancel,
+                                      args.seed))
+        print_report(report)
+        reports.append(report)
+    if len(reports) == 2 and reports[0]["requests_per_s"]:
+        base, batched = reports
+        print(f"\n  batching: {batched['requests_per_s'] / base['requests_per_s']:.1f}× throughput, "
+              f"p50 latency {base['latency_p50_ms']:,.0f} → {batched['latency_p50_ms']:,.0f} ms, "
+              f"p99 {base['latency_p99_ms']:,.0f} → {batched['latency_p99_ms']:,.0f} ms")
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps({"model": args.model, "runs": reports}, indent=2) + "\n",
+                             encoding="utf-8")
+        print(f"→ {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Build manifest for incremental file-to-file stages.
+
+Records, per input file, the content hash of the input and of the output it
+produced, plus a fingerprint of the rules that produced it.  A rerun can then
+skip inputs whose content, output and rules are all unchanged.  Size + mtime
+are kept alongside each hash so unchanged files are recognized from a stat()
+alone; a file is only re-hashed when its stat changes.
+
+Used by preprocess.py and extract_footnotes.py (--incremental).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import profiling
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def rules_version(*sources: str | Path) -> str:
+    """Fingerprint of the source files that define a stage's rules.
+
+    Any edit to a cleaning script invalidates every output it built.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    for src in sources:
+        h.update(Path(src).read_bytes())
+    return h.hexdigest()
+
+
+def _stat_key(path: Path) -> list[int] | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class Manifest:
+    """Input → output records for one output directory, stored as JSON.
+
+    Entries are keyed by input filename.  Loading a manifest written under a
+    different rules version drops all entries, so everything rebuilds.
+    """
+
+    def __init__(self, path: Path, version: str):
+        self.path = path
+        self.version = version
+        self.entries: dict[str, dict] = {}
+        self._input_hashes: dict[str, str] = {}  # hashed this run, reused by record()
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if data.get("rules_version") == version:
+                self.entries = data.get("files", {})
+
+    def _input_hash(self, input_path: Path) -> str:
+        key = str(input_path)
+        if key not in self._input_hashes:
+            data = input_path.read_bytes()
+            profiling.count("bytes_read", len(data))
+            self._input_hashes[key] = content_hash(data)
+        return self._input_hashes[key]
+
+    def is_fresh(self, input_path: Path, output_path: Path) -> bool:
+        """True if input, output and rules all match the last recorded build.
+
+        If the last build produced no output (e.g. an essay without footnotes),
+        it only stays fresh while nothing exists at output_path.
+        """
+        entry = self.entries.get(input_path.name)
+        if entry is None:
+            return False
+
+        stat = _stat_key(input_path)
+        if stat is None:
+            return False
+        if stat != entry["input_stat"]:
+            if self._input_hash(input_path) != entry["input_hash"]:
+                return False
+            entry["input_stat"] = stat  # touched but unchanged
+
+        if entry["output"] is None:
+            return not output_path.exists()
+        if entry["output"] != output_path.name:
+            return False
+        return _stat_key(output_path) == entry["output_stat"]
+
+    def record(self, input_path: Path, output_path: Path | None, output_text: str | None) -> None:
+        """Remember a build of input_path (after output_path has been written)."""
+        self.entries[input_path.name] = {
+            "input_hash": self._input_hash(input_path),
+            "input_stat": _stat_key(input_path),
+            "output": output_path.name if output_path is not None else None,
+            "output_hash": content_hash(output_text.encode("utf-8")) if output_text is not None else None,
+            "output_stat": _stat_key(output_path) if output_path is not None else None,
+        }
+
+    def output_unchanged(self, input_path: Path, output_path: Path, output_text: str) -> bool:
+        """True if output_path already holds exactly output_text (so the write can be skipped)."""
+        entry = self.entries.get(input_path.name)
+        return (
+            entry is not None
+            and entry["output"] == output_path.name
+            and entry["output_hash"] == content_hash(output_text.encode("utf-8"))
+            and _stat_key(output_path) == entry["output_stat"]
+        )
+
+    def prune(self, output_dir: Path, current_inputs: list[Path], dry_run: bool = False) -> list[Path]:
+        """Drop entries (and delete outputs) for inputs that no longer exist."""
+        current = {p.name for p in current_inputs}
+        removed = []
+        for name in sorted(set(self.entries) - current):
+            entry = self.entries.pop(name)
+            if entry["output"] is not None:
+                out = output_dir / entry["output"]
+                if out.exists():
+                    if not dry_run:
+                        out.unlink()
+                    removed.append(out)
+        return removed
+
+    def save(self) -> None:
+        """Write atomically, so an interrupted run can't leave a corrupt manifest."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(
+            json.dumps({"rules_version": self.version, "files": self.entries}, indent=1, sort_keys=True),
+            encoding="utf-8",
+        )
+        os.replace(tmp, self.path)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+A memory-budgeted pool of models for multi-model inference.
+
+inference.ipynb loads base and fine-tuned GPT-2-XL eagerly and Llama on
+demand into globals, and never unloads anything, so one more variant (LLaDA,
+a second adapter version) runs the runtime out of memory.  ModelPool loads a
+variant the first time it is asked for and keeps the resident variants'
+weights within a byte budget: to make room it evicts the least recently used
+variant, either dropping it or, with park=True, moving it to CPU RAM so the
+next request for it is a device copy instead of a load from disk.  Parked
+models get their own optional budget, past which the oldest are dropped.
+
+Sizes are parameter + buffer bytes, measured after each load; the budget is
+for weights, so leave headroom for the KV cache and activations.  A loader
+that places its model on the GPU itself (4-bit, device_map="auto") should be
+added with a size hint, so room is made before it runs.  Every load, restore,
+park and drop is timed (pool.events, summary(), --profile spans).
+
+Variants may share one model, like the base and fine-tuned Llama over one
+PeftModel in batch_queue's variants (loaders returning the same model
+object): the shared weights count once, and the variants sharing them are
+parked, restored and dropped together, so switching between them is free.
+
+Variants in use can be pinned (with pool.use(name): ...) so a concurrent
+request can't evict them mid-generate.  pool[name] is pool.get(name), so a
+pool can stand in for the variants dict of batch_queue.GenerateRunner, which
+calls it on its one generation thread.
+
+Notebook use:
+    sys.path.insert(0, f"{REPO_DIR}/2_scripts")
+    from model_pool import ModelPool
+    pool = ModelPool(budget=10 * 2**30, device="cuda", park=True, cpu_budget=24 * 2**30)
+    pool.add("Base GPT-2", lambda: load_gpt2("openai-community/gpt2-xl"))
+    pool.add("Fine-tuned GPT-2", lambda: load_gpt2(GPT2_MODEL_PATH))
+    pool.add("LLaDA", load_llada, size=16 * 2**30)
+    model, tokenizer = pool.get("Fine-tuned GPT-2")
+
+Usage:
+    python model_pool.py a=tiny-gpt2 b=tiny-gpt2 c=tiny-llama --budget 1.5 --requests 30
+    python model_pool.py a=tiny-gpt2 b=tiny-gpt2 c=tiny-llama --budget 1.5 --park --cpu-budget 1
+    python model_pool.py base=openai-community/gpt2-xl ft=path/to/gpt2-voice-v1 --budget 4000 --park
+    python model_pool.py a=tiny-gpt2 b=tiny-llama --budget 1 --order a b a b --generate 16 --profile
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
+MB = 2**20
+
+
+def model_bytes(model) -> int:
+    """Parameter and buffer bytes (4-bit weights count at their packed size)."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _device_of(model) -> str:
+    return str(next(model.parameters()).device)
+
+
+def _distinct_bytes(entries) -> int:
+    """Bytes of the models behind entries, counting a model shared by several variants once."""
+    return sum({id(e.value[0]): e.bytes for e in entries}.values())
+
+
+class _Entry:
+    __slots__ = ("value", "bytes")
+
+    def __init__(self, value: tuple, nbytes: int):
+        self.value = value  # what the loader returned; value[0] is the model
+        self.bytes = nbytes
+
+
+class ModelPool:
+    """Lazily loaded variants under a device-memory budget, evicted least recently used first."""
+
+    def __init__(self, budget: int, device: str | None = None, park: bool = False,
+                 cpu_budget: int | None = None):
+        if device is None:
+            import torch
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.budget = budget
+        self.device = device
+        self.park = park
+        self.cpu_budget = cpu_budget
+        self.loaders: dict[str, Callable[[], tuple]] = {}
+        self.sizes: dict[str, int] = {}  # hint, then the measured size
+        self.resident: OrderedDict[str, _Entry] = OrderedDict()  # least recently used first
+        self.parked: OrderedDict[str, _Entry] = OrderedDict()
+        self.pins: Counter = Counter()
+        self.hits: Counter = Counter()
+        self.events: list[dict] = []
+        self.lock = threading.RLock()
+
+    def add(self, name: str, loader: Callable[[], tuple], size: int | None = None) -> None:
+        """Register a variant; loader() returns (model, tokenizer, ...) and runs on first use."""
+        self.loaders[name] = loader
+        if size is not None:
+            self.sizes[name] = size
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.loaders
+
+    def __getitem__(self, name: str) -> tuple:
+        return self.get(name)
+
+    def resident_bytes(self) -> int:
+        return _distinct_bytes(self.resident.values())
+
+    def parked_bytes(self) -> int:
+        return _distinct_bytes(self.parked.values())
+
+    @staticmethod
+    def _sharing(table: OrderedDict[str, _Entry], model) -> list[str]:
+        """Variants in table whose model is this one."""
+        return [name for name, e in table.items() if e.value[0] is model]
+
+    # ── requests ──
+
+    def get(self, name: str) -> tuple:
+        """The variant's (model, tokenizer, ...), loaded or restored onto the device if need be."""
+        with self.lock:
+            if name in self.resident:
+                self.resident.move_to_end(name)
+                self.hits[name] += 1
+                return self.resident[name].value
+            if name not in self.loaders:
+                raise KeyError(f"no variant {name!r} in the pool (have: {', '.join(self.loaders)})")
+
+            if name in self.parked:
+                entry = self.parked[name]
+                self._restore(name, self._take_parked(entry.value[0]))
+            else:
+                if name in self.sizes:
+                    self._make_room(name, self.sizes[name])
+                start = time.perf_counter()
+                with profiling.span("model_pool.load", variant=name):
+                    value = self.loaders[name]()
+                    if not isinstance(value, tuple):
+                        value = (value,)
+                    entry = _Entry(value, model_bytes(value[0]))
+                    self.sizes[name] = entry.bytes
+                    if not self._sharing(self.resident, value[0]):  # else its weights are already here
+                        # Another variant may have parked the same model
+                        sharing = self._take_parked(value[0])
+                        # Room is made once the size is known, before the weights reach the device
+                        try:
+                            self._make_room(name, entry.bytes)
+                        except MemoryError:
+                            self.parked.update(sharing)
+                            self._drop(name, entry)
+                            raise
+                        if _device_of(value[0]) != self.device:
+                            value[0].to(self.device)
+                        self.resident.update(sharing)
+                self._record(name, "load", start, entry.bytes)
+            self.resident[name] = entry
+            return entry.value
+
+    def _take_parked(self, model) -> dict[str, _Entry]:
+        """Remove and return the parked variants whose model is this one."""
+        return {n: self.parked.pop(n) for n in self._sharing(self.parked, model)}
+
+    def _restore(self, name: str, entries: dict[str, _Entry]) -> None:
+        """Move parked variants sharing one model back onto the device, name last (most recent)."""
+        entry = entries[name]
+        try:
+            self._make_room(name, entry.bytes)
+        except MemoryError:
+            self.parked.update(entries)
+            raise
+        start = time.perf_counter()
+        with profiling.span("model_pool.restore", variant=name):
+            entry.value[0].to(self.device)
+        for n, e in entries.items():
+            if n != name:
+                self.resident[n] = e
+        self._record(name, "restore", start, entry.bytes)
+
+    @contextmanager
+    def use(self, name: str):
+        """get(name), pinned against eviction until the block ends."""
+        with self.lock:
+            value = self.get(name)
+            self.pins[name] += 1
+        try:
+            yield value
+        finally:
+            with self.lock:
+                self.pins[name] -= 1
+
+    # ── eviction ──
+
+    def _make_room(self, name: str, nbytes: int) -> None:
+        """Evict least recently used, unpinned variants until nbytes more fit the budget."""
+        if nbytes > self.budget:
+            raise MemoryError(f"{name} is {nbytes / MB:,.1f} MB, over the whole {self.budget / MB:,.1f} MB budget")
+        for victim in list(self.resident):
+            if self.resident_bytes() + nbytes <= self.budget:
+                return
+            if victim in self.resident and not self._pinned(victim):
+                self.evict(victim)
+        if self.resident_bytes() + nbytes > self.budget:
+            in_use = ", ".join(v for v in self.resident if self.pins[v])
+            raise MemoryError(f"no room for {name} ({nbytes / MB:,.1f} MB): {in_use} in use")
+
+    def _pinned(self, name: str) -> bool:
+        """Whether name, or a resident variant sharing its model, is in use."""
+        return any(self.pins[n] for n in self._sharing(self.resident, self.resident[name].value[0]))
+
+    def evict(self, name: str) -> None:
+        """Take a resident variant off the device: parked in CPU RAM with park=True, else dropped.
+
+        Resident variants sharing its model go with it.
+        """
+        with self.lock:
+            model = self.resident[name].value[0]
+            entries = {n: self.resident.pop(n) for n in self._sharing(self.resident, model)}
+            if not self.park:
+                for n, e in entries.items():
+                    self._drop(n, e)
+                return
+            start = time.perf_counter()
+            with profiling.span("model_pool.park", variant=name):
+                model.to("cpu")
+            for n, e in entries.items():
+                self.parked[n] = e
+                self._record(n, "park", start, e.bytes)
+                start = time.perf_counter()  # the weights moved once, for the first
+            while self.cpu_budget is not None and self.parked_bytes() > self.cpu_budget:
+                for n, e in self._take_parked(next(iter(self.parked.values())).value[0]).items():
+                    self._drop(n, e)
+
+    def _drop(self, name: str, entry: _Entry) -> None:
+        start = time.perf_counter()
+        with profiling.span("model_pool.drop", variant=name):
+            on_cuda = _device_of(entry.value[0]).startswith("cuda")
+            entry.value = ()
+            gc.collect()
+            if on_cuda:
+                import torch
+                torch.cuda.empty_cache()
+        self._record(name, "drop", start, entry.bytes)
+
+    def _record(self, name: str, event: str, start: float, nbytes: int) -> None:
+        self.events.append({
+            "variant": name, "event": event, "seconds": time.perf_counter() - start, "bytes": nbytes,
+            "resident_bytes": self.resident_bytes(), "parked_bytes": self.parked_bytes(),
+        })
+        profiling.count(f"model_pool.{event}s")
+
+    # ── reporting ──
+
+    def summary(self) -> dict:
+        """Per variant: hits, loads, restores, parks, drops and the seconds each took."""
+        variants = {}
+        for name in self.loaders:
+            row = {"hits": self.hits[name], "bytes": self.sizes.get(name),
+                   "state": "resident" if name in self.resident else "parked" if name in self.parked else "-"}
+            for kind in ("load", "restore", "park", "drop"):
+                times = [e["seconds"] for e in self.events if e["variant"] == name and e["event"] == kind]
+                row[f"{kind}s"] = len(times)
+                row[f"{kind}_seconds"] = round(sum(times), 4)
+            variants[name] = row
+        return {"budget": self.budget, "cpu_budget": self.cpu_budget, "park": self.park,
+                "resident_bytes": self.resident_bytes(), "parked_bytes": self.parked_bytes(),
+                "variants": variants}
+
+
+def main():
+    from canary import TINY_MODELS, build_tiny_model, format_prompt, generate_rows, load_model, prompt_style
+    from format_canary import CANARY_PROMPTS
+
+    parser = argparse.ArgumentParser(description="Exercise an LRU model pool under a memory budget")
+    parser.add_argument("variants", nargs="+", metavar="NAME=MODEL",
+                        help=f"Variants: a name and a model path, Hub id or {' / '.join(TINY_MODELS)}")
+    parser.add_argument("--budget", type=float, required=True, help="Device budget for weights, in MB")
+    parser.add_argument("--park", action="store_true", help="Park evicted variants in CPU RAM instead of dropping")
+    parser.add_argument("--cpu-budget", type=float, default=None, help="With --park: CPU RAM budget in MB")
+    parser.add_argument("--requests", type=int, default=20, help="Random requests to send (default: 20)")
+    parser.add_argument("--order", nargs="+", default=None, metavar="NAME", help="Request these variants in order")
+    parser.add_argument("--generate", type=int, default=0,
+                        help="Generate this many tokens per request, to show each model works (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Request order seed (default: 0)")
+    parser.add_argument("--device", default=None, help="Device (default: cuda if available, else cpu)")
+    parser.add_argument("--dtype", choices=["auto", "float32", "float16", "bfloat16"], default="auto",
+                        help="Weights dtype (default: float16 on cuda, float32 on cpu)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    specs = {}
+    for arg in args.variants:
+        name, sep, spec = arg.partition("=")
+        if not sep or not name or not spec:
+            print(f"ERROR: variants are NAME=MODEL, got {arg!r}")
+            sys.exit(1)
+        specs[name] = spec
+    if args.order and set(args.order) - set(specs):
+        print(f"ERROR: --order names a variant that wasn't given: {sorted(set(args.order) - set(specs))}")
+        sys.exit(1)
+
+    pool = ModelPool(int(args.budget * MB), device=args.device, park=args.park,
+                     cpu_budget=int(args.cpu_budget * MB) if args.cpu_budget is not None else None)
+    for seed, (name, spec) in enumerate(specs.items()):
+        if spec in TINY_MODELS:
+            # Same-shaped tiny variants get different weights, like base vs fine-tuned
+            pool.add(name, lambda spec=spec, seed=seed: build_tiny_model(spec, seed=seed))
+        else:
+            pool.add(name, lambda spec=spec: load_model(spec, device="cpu", dtype=args.dtype))
+
+    rng = random.Random(args.seed)
+    order = args.order or [rng.choice(list(specs)) for _ in range(args.requests)]
+    print(f"{len(specs)} variants, budget {args.budget:g} MB on {pool.device}"
+          f"{f', parking in CPU RAM' if args.park else ''}"
+          f"{f' (≤ {args.cpu_budget:g} MB)' if args.park and args.cpu_budget is not None else ''}; "
+          f"{len(order)} requests")
+
+    for number, name in enumerate(order, 1):
+        seen = len(pool.events)
+        start = time.perf_counter()
+        try:
+            with pool.use(name) as (model, tokenizer, *_):
+                ready = time.perf_counter() - start
+                if args.generate:
+                    if tokenizer.pad_token is None:
+                        tokenizer.pad_token = tokenizer.eos_token
+                    style = prompt_style(tokenizer)
+                    ids = tokenizer(format_prompt(tokenizer, CANARY_PROMPTS["A"], style),
+                                    add_special_tokens=False)["input_ids"]
+                    generate_rows(model, tokenizer, [ids], args.generate, {"do_sample": False})
+        except MemoryError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+        events = ", ".join(f"{e['event']} {e['variant']} {e['seconds'] * 1000:.1f} ms" for e in pool.events[seen:])
+        print(f"  {number:3d}  {name:<12s} ready in {ready * 1000:8.1f} ms  "
+              f"resident {pool.resident_bytes() / MB:7.2f} MB  parked {pool.parked_bytes() / MB:7.2f} MB  "
+              f"{events or 'hit'}")
+
+    s = pool.summary()
+    print(f"\n  {'Variant':<12s} {'MB':>8s} {'Hits':>5s} {'Loads':>6s} {'Restores':>9s} {'Parks':>6s} "
+          f"{'Drops':>6s} {'Load s':>8s} {'Restore s':>10s}  State")
+    for name, row in s["variants"].items():
+        size = f"{row['bytes'] / MB:.2f}" if row["bytes"] else "-"
+        print(f"  {name:<12s} {size:>8s} {row['hits']:5d} {row['loads']:6d} {row['restores']:9d} "
+              f"{row['parks']:6d} {row['drops']:6d} {row['load_seconds']:8.3f} {row['restore_seconds']:10.3f}  "
+              f"{row['state']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""
+Streaming parser for pair markdown files (llama_train.md, gpt2_val.md, ...).
+
+    ## pair: <label>
+    tier: <N>
+
+    ### prompt
+    <prompt text>
+
+    ### response
+    <response text>
+
+    ---
+
+Files are read line by line in binary mode; iter_pairs() yields one record per
+"## pair:" block as soon as the block ends, with the block's byte offset and
+length in the file.  PairIndex maps labels to those offsets (reading only the
+heading lines), so a single pair can be fetched with one seek instead of a
+full reparse.
+
+write_pairs() goes the other way: it makes a file hold a given header and
+list of pairs, copying every block whose content is unchanged byte for byte
+from the current file and formatting only new or changed ones.  The result
+goes to a temp file that replaces the original in one rename, and an
+unchanged file is not rewritten at all.
+
+Record dicts:
+    {"name": str, "tier": int | None, "prompt": str | None, "response": str | None,
+     "offset": int, "length": int}
+prompt/response are None when the block has no "### prompt"/"### response"
+section; tier is None when there is no "tier:" line before the first section.
+
+Used by format_jsonl.py, llama_to_gpt2.py, prompts_to_llama.py, watch.py and corpus_store.py.
+"""
+
+from __future__ import annotations
+
+import io
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+import profiling
+
+PAIR_HEADING = b"## pair:"
+
+_TIER_RE = re.compile(r"tier:\s*(\d+)")
+_TRAILING_RULE_RE = re.compile(r"\n-{2,3}\s*$")  # separator line (--- or --) after the response
+_HEADER_RULE_RE = re.compile(r"(?:^|\n)---$")
+
+RULE = "\n\n---\n"  # after every block: blank line, rule; blank line before the next block
+
+
+def _iter_blocks(lines: Iterable[bytes]) -> Iterator[tuple[int, list[bytes]]]:
+    """Group lines into (byte offset, lines) per "## pair:" block; the header is skipped."""
+    offset = 0
+    start = None
+    block: list[bytes] = []
+    for line in lines:
+        if line.startswith(PAIR_HEADING):
+            if start is not None:
+                yield start, block
+            start, block = offset, [line]
+        elif start is not None:
+            block.append(line)
+        offset += len(line)
+    if start is not None:
+        yield start, block
+
+
+def _heading_name(line: bytes) -> str:
+    return line[len(PAIR_HEADING):].decode("utf-8").strip()
+
+
+def block_spans(data: bytes) -> tuple[int, list[tuple[str, int, int]]]:
+    """(header length, [(label, offset, length)]) for a whole file's bytes or mmap.
+
+    The same blocks _iter_blocks finds, located by searching for heading
+    lines instead of looping over every line.
+    """
+    starts = [0] if data[:len(PAIR_HEADING)] == PAIR_HEADING else []
+    pos = 0
+    while True:
+        i = data.find(b"\n" + PAIR_HEADING, pos)
+        if i < 0:
+            break
+        starts.append(i + 1)
+        pos = i + 1
+    spans = []
+    for k, start in enumerate(starts):
+        end = starts[k + 1] if k + 1 < len(starts) else len(data)
+        eol = data.find(b"\n", start, end)
+        spans.append((_heading_name(data[start:eol if eol >= 0 else end]), start, end - start))
+    return (starts[0] if starts else len(data)), spans
+
+
+def parse_block(data: bytes, offset: int = 0) -> dict:
+    """Parse one "## pair:" block (its raw bytes) into a record."""
+    lines = data.decode("utf-8").split("\n")
+    tier = None
+    prompt_at = response_at = None
+    for i in range(1, len(lines)):
+        head = lines[i].rstrip()
+        if head == "### prompt" and prompt_at is None:
+            prompt_at = i
+        elif head == "### response":
+            response_at = i
+            break
+        elif prompt_at is None and tier is None:
+            m = _TIER_RE.match(head)
+            if m:
+                tier = int(m.group(1))
+
+    prompt = None
+    if prompt_at is not None:
+        prompt = "\n".join(lines[prompt_at + 1:response_at]).strip()
+
+    response = None
+    if response_at is not None:
+        response = "\n".join(lines[response_at + 1:])
+        response = _TRAILING_RULE_RE.sub("", response, count=1).strip()
+
+    return {
+        "name": lines[0][len(PAIR_HEADING):].strip(),
+        "tier": tier,
+        "prompt": prompt,
+        "response": response,
+        "offset": offset,
+        "length": len(data),
+    }
+
+
+def iter_pairs_stream(f: BinaryIO) -> Iterator[dict]:
+    """Yield a record per pair block from a binary file object, lazily."""
+    for offset, lines in _iter_blocks(f):
+        yield parse_block(b"".join(lines), offset)
+
+
+def iter_pairs(path: Path) -> Iterator[dict]:
+    """Yield a record per pair block in a pairs file, reading it line by line."""
+    profiling.count_file(path)
+    with open(path, "rb") as f:
+        yield from iter_pairs_stream(f)
+
+
+def iter_pairs_text(text: str) -> Iterator[dict]:
+    """iter_pairs() for a file already in memory (offsets are into its UTF-8 encoding)."""
+    return iter_pairs_stream(io.BytesIO(text.encode("utf-8")))
+
+
+def split_header(text: str) -> str:
+    """The file header: everything before the first "## pair:" line."""
+    data = text.encode("utf-8")
+    for offset, _ in _iter_blocks(io.BytesIO(data)):
+        return data[:offset].decode("utf-8")
+    return text
+
+
+class PairIndex:
+    """Label → (byte offset, length) for every block in a pairs file.
+
+    Building the index only looks for "## pair:" heading lines. get() seeks to
+    one block and parses just that.  Labels that appear more than once keep
+    their first block (the one the scripts would use); the rest are listed in
+    `duplicates`.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.offsets: dict[str, tuple[int, int]] = {}
+        self.duplicates: list[str] = []
+        with open(path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _, spans = block_spans(data)
+        for name, offset, length in spans:
+            if name in self.offsets:
+                self.duplicates.append(name)
+                continue
+            self.offsets[name] = (offset, length)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def labels(self) -> list[str]:
+        return list(self.offsets)
+
+    def get(self, name: str) -> dict | None:
+        """The record for one label, read with a single seek (None if absent)."""
+        if name not in self.offsets:
+            return None
+        offset, length = self.offsets[name]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return parse_block(f.read(length), offset)
+
+
+# ── writing ──────────────────────────────────────────────────────────────
+
+def format_pair(pair: dict) -> str:
+    """Format a pair dict as a markdown block (without the rule after it)."""
+    return "\n".join([
+        f"## pair: {pair['name']}",
+        f"tier: {pair['tier']}",
+        "",
+        "### prompt",
+        pair["prompt"],
+        "",
+        "### response",
+        pair["response"],
+    ])
+
+
+def format_header(header: str) -> str:
+    """The file text before the first pair: header, then a rule unless it already ends with one."""
+    header = header.rstrip()
+    if not _HEADER_RULE_RE.search(header):
+        header += "\n\n---"
+    return header + "\n\n"
+
+
+def render_pairs(header: str, pairs: list[dict]) -> str:
+    """The whole pairs file, formatted from scratch."""
+    blocks = [format_pair(p) + RULE for p in pairs]
+    return format_header(header) + "\n".join(blocks) if blocks else format_header(header).rstrip() + "\n"
+
+
+def _content(record: dict) -> tuple:
+    return (record["name"], record["tier"], record["prompt"] or "", record["response"] or "")
+
+
+def _add(segments: list, seg: tuple[int, int] | bytes) -> None:
+    """Append a segment, merging ranges that continue the previous one."""
+    if segments and not isinstance(seg, bytes) and not isinstance(segments[-1], bytes) \
+            and segments[-1][1] == seg[0]:
+        segments[-1] = (segments[-1][0], seg[1])
+    else:
+        segments.append(seg)
+
+
+def _splice_plan(data, size: int, header: str, pairs: list[dict],
+                 changed: set[str] | None) -> tuple[list, int, int]:
+    """Segments of the new file: (start, end) ranges of the old file or new bytes."""
+    first, spans = block_spans(data)
+    old: dict[str, list[tuple[int, int]]] = {}  # a repeated label's blocks, in file order
+    for name, offset, length in spans:
+        old.setdefault(name, []).append((offset, offset + length))
+    repeated = {name for name, blocks in old.items() if len(blocks) > 1}  # never trusted by name
+
+    segments: list[tuple[int, int] | bytes] = []
+    formatted_header = format_header(header).encode("utf-8")
+    own = data[:first]
+    if own in (header.encode("utf-8"), formatted_header, formatted_header[:-1]):  # last: a file with no pairs
+        # As for a block, only the blank line after the header depends on what follows
+        if pairs and own and not own.endswith(b"\n\n"):
+            segments += [(0, first), b"\n" if own.endswith(b"\n") else b"\n\n"]
+        elif not pairs and own.endswith(b"\n\n"):
+            segments.append((0, first - 1))
+        else:
+            segments.append((0, first))
+    else:
+        segments.append(formatted_header if pairs else formatted_header[:-1])  # as render_pairs
+
+    kept = formatted = 0
+    for i, pair in enumerate(pairs):
+        last = i == len(pairs) - 1
+        blocks = old.get(pair["name"])
+        block = blocks.pop(0) if blocks else None
+        if block is not None and changed is not None and pair["name"] not in changed \
+                and pair["name"] not in repeated and (block[1] == size) == last:
+            _add(segments, block)
+            kept += 1
+            continue
+
+        text = (format_pair(pair) + RULE + ("" if last else "\n")).encode("utf-8")
+        if block is not None:
+            start, end = block
+            current = data[start:end]
+            if current == text or _content(parse_block(current)) == _content(parse_block(text)):
+                # Only the blank line after the rule depends on the position
+                was_last = end == size
+                reuse = None
+                if was_last == last:
+                    reuse = [(start, end)]
+                elif was_last and current.endswith(b"\n---\n"):
+                    reuse = [(start, end), b"\n"]
+                elif not was_last and current.endswith(b"\n---\n\n"):
+                    reuse = [(start, end - 1)]
+                if reuse:
+                    for seg in reuse:
+                        _add(segments, seg)
+                    kept += 1
+                    continue
+        _add(segments, text)
+        formatted += 1
+    return segments, kept, formatted
+
+
+def write_pairs(path: Path, header: str, pairs: list[dict], changed: set[str] | None = None) -> dict:
+    """Make the file hold header + pairs, rewriting only blocks that changed.
+
+    A block is copied byte for byte from the current file (hand formatting
+    included) when the file has a pair of that name that parses to the same
+    tier, prompt and response.  A repeated label is matched to the file's
+    blocks of that label in order.  Everything else is formatted with format_pair.  header is kept
+    as-is when it is the file's own (split_header), otherwise formatted.
+
+    changed, if given, names the pairs that may differ from the file; the
+    rest are taken to be the file's own blocks (e.g. from parsing it) and
+    are copied without formatting or comparing them, so the work in Python
+    is proportional to the changed pairs rather than the file.
+
+    The new file is written to a temporary file next to the old one, given
+    its mode and renamed over it, so a crash leaves either the old file or
+    the new one.  Nothing is written
+    when the content would be identical.
+
+    Returns {"written": bool, "kept": blocks copied, "formatted": blocks formatted}.
+    """
+    with profiling.span("pairs_file.write_pairs", file=Path(path).name):
+        path = Path(path)
+        size = path.stat().st_size if path.exists() else 0
+        tmp = None
+        try:
+            with open(path, "rb") if size else io.BytesIO() as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+                try:
+                    segments, kept, formatted = _splice_plan(data, size, header, pairs, changed)
+
+                    # Unchanged: the copied ranges tile the old file exactly, in order
+                    position = 0
+                    for seg in segments:
+                        if isinstance(seg, bytes) or seg[0] != position:
+                            break
+                        position = seg[1]
+                    else:
+                        if position == size and path.exists():
+                            return {"written": False, "kept": kept, "formatted": formatted}
+
+                    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+                    with os.fdopen(fd, "wb") as out, memoryview(data) as view:
+                        for seg in segments:
+                            out.write(seg if isinstance(seg, bytes) else view[seg[0]:seg[1]])
+                        out.flush()
+                        os.fsync(out.fileno())
+                finally:
+                    if size:
+                        data.close()
+            # mkstemp makes the file 0o600; give it the old file's mode, or a new file's
+            if path.exists():
+                shutil.copymode(path, tmp)
+            else:
+                os.chmod(tmp, 0o666 & ~_umask())
+            os.replace(tmp, path)
+        except BaseException:
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return {"written": True, "kept": kept, "formatted": formatted}
+
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
@@ -0,0 +1,59 @@
+"""
+Process-pool fan-out for the per-file cleaning scripts.
+
+map_in_order() runs a picklable, module-level function over a list of inputs,
+either inline or across worker processes, and yields results in input order
+so output and logs are identical whatever --jobs is.  Progress goes to stderr.
+Under --profile, each worker call is profiled and its spans are merged into
+the parent's trace as results arrive.
+
+Used by preprocess.py and extract_footnotes.py (--jobs N).
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import profiling
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def resolve_jobs(jobs: int) -> int:
+    """--jobs value → worker count (0 means one per CPU)."""
+    return jobs if jobs > 0 else (os.cpu_count() or 1)
+
+
+def map_in_order(fn: Callable[[T], R], items: Iterable[T], jobs: int = 1,
+                 label: str = "files") -> Iterator[R]:
+    """Yield fn(item) for each item, in order, using up to `jobs` processes."""
+    items = list(items)
+    jobs = resolve_jobs(jobs)
+    if jobs <= 1 or len(items) <= 1:
+        yield from map(fn, items)
+        return
+
+    total = len(items)
+    step = max(1, total // 10)
+    start = time.perf_counter()
+    # Several chunks per worker keeps the pool busy when file sizes vary
+    chunksize = max(1, total // (jobs * 8))
+    profiled = profiling.active()
+    if profiled:
+        fn = functools.partial(profiling.call_profiled, fn)
+
+    with ProcessPoolExecutor(max_workers=min(jobs, total)) as pool:
+        for done, result in enumerate(pool.map(fn, items, chunksize=chunksize), 1):
+            if profiled:
+                result, profile = result
+                profiling.merge(profile)
+            if done % step == 0 or done == total:
+                rate = done / max(time.perf_counter() - start, 1e-9)
+                print(f"  [{done}/{total} {label}, {rate:.0f}/s, {jobs} jobs]", file=sys.stderr)
+            yield result
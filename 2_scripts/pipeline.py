@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Run the data-prep stages in dependency order, rerunning only what is stale.
+
+    1_data/raw/*.md ──clean──▶ cleaned/*_clean.md ──pairs (+ prompts.md)──▶ pairs/llama_train.md
+    pairs/llama_{split}.md ──gpt2-{split}──▶ pairs/gpt2_{split}.md
+    pairs/{model}_{split}.md ──jsonl-{model}-{split}──▶ jsonl/{model}_{split}.jsonl
+    jsonl/*.jsonl ──dedup──▶ jsonl/dedup_report.json   (fails on train/val leakage or duplicates)
+
+Each stage declares its input and output files (globs, relative to the repo);
+its code is the script plus every 2_scripts module it imports, directly or
+not, read off the import statements.  Edges come from matching one stage's
+outputs to another's inputs.  After a stage succeeds, the content hashes of
+its inputs, outputs and code are recorded in 1_data/.pipeline.json.  A stage
+is stale when any of those hashes changed — so editing prompts.md reruns
+`pairs`, then only the train-side stages whose input actually changed, and
+leaves the val stages and the cleaned corpus alone.  Files are re-hashed only
+when their size or mtime changes.
+
+Stages whose dependencies are done run concurrently (--jobs), each as a
+subprocess of the script you would otherwise run by hand.
+
+Usage:
+    python pipeline.py                    # run stale stages
+    python pipeline.py --dry-run          # show which stages are stale and why
+    python pipeline.py gpt2-val           # just this stage (and stale stages it depends on)
+    python pipeline.py --force jsonl-gpt2-train  # rerun a stage even if fresh
+    python pipeline.py --jobs 1           # one stage at a time
+    python pipeline.py --profile          # profile every stage, one merged trace (profiling.py)
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+from functools import cache
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from manifest import content_hash, rules_version
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+REPO_ROOT = SCRIPTS_DIR.parent
+STATE_FILE = REPO_ROOT / "1_data" / ".pipeline.json"
+
+
+@cache
+def local_imports(script: str) -> frozenset[str]:
+    """Modules in 2_scripts/ that a script imports anywhere in its body (lazy imports too)."""
+    found = set()
+    for node in ast.walk(ast.parse((SCRIPTS_DIR / script).read_text(encoding="utf-8"))):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            names = [node.module]
+        else:
+            continue
+        found.update(f"{name}.py" for name in names if (SCRIPTS_DIR / f"{name}.py").is_file())
+    return frozenset(found)
+
+
+def code_files(script: str) -> list[str]:
+    """The script and every 2_scripts/ module it imports, transitively."""
+    seen = {script}
+    todo = [script]
+    while todo:
+        for module in local_imports(todo.pop()) - seen:
+            seen.add(module)
+            todo.append(module)
+    return sorted(seen)
+
+
+class Stage:
+    """One script invocation with declared inputs and outputs; its code comes from its imports."""
+
+    def __init__(self, name: str, args: list[str], inputs: list[str], outputs: list[str]):
+        self.name = name
+        self.args = args          # script name, then its arguments
+        self.inputs = inputs      # repo-relative paths or globs
+        self.outputs = outputs
+        self.code = code_files(args[0])  # scripts in 2_scripts/ whose edits invalidate the stage
+
+    def command(self) -> list[str]:
+        return [sys.executable, str(SCRIPTS_DIR / self.args[0]), *self.args[1:]]
+
+
+def _stages() -> list[Stage]:
+    stages = [
+        Stage("clean", ["preprocess.py", "--incremental"],
+              inputs=["1_data/raw/*.md"], outputs=["1_data/cleaned/*_clean.md"]),
+        # prompts_to_llama.py appends every prompt to its target, so only the
+        # train file is built from prompts.md; llama_val.md is curated by hand
+        Stage("pairs", ["prompts_to_llama.py", "--regenerate"],
+              inputs=["1_data/pairs/prompts.md", "1_data/cleaned/*_clean.md", "1_data/pairs/llama_train.md"],
+              outputs=["1_data/pairs/llama_train.md"]),
+    ]
+    for split in ("train", "val"):
+        stages.append(Stage(
+            f"gpt2-{split}", ["llama_to_gpt2.py", f"1_data/pairs/llama_{split}.md"],
+            inputs=[f"1_data/pairs/llama_{split}.md"], outputs=[f"1_data/pairs/gpt2_{split}.md"]))
+    for model in ("llama", "gpt2"):
+        for split in ("train", "val"):
+            stages.append(Stage(
+                f"jsonl-{model}-{split}", ["format_jsonl.py", "--only", f"{model}_{split}"],
+                inputs=[f"1_data/pairs/{model}_{split}.md"],
+                outputs=[f"1_data/jsonl/{model}_{split}.jsonl", f"1_data/jsonl/{model}_{split}.lengths.json"]))
+    # A check, not a build step: it fails while anything is flagged, so it
+    # stays stale (and reruns) until the pairs are fixed
+    stages.append(Stage(
+        "dedup", ["dedup.py"],
+        inputs=["1_data/jsonl/*.jsonl", "1_data/jsonl/*.lengths.json"],
+        outputs=["1_data/jsonl/dedup_report.json"]))
+    return stages
+
+
+STAGES = _stages()
+
+
+def _overlaps(a: str, b: str) -> bool:
+    return a == b or fnmatch(a, b) or fnmatch(b, a)
+
+
+def dependencies(stages: list[Stage]) -> dict[str, list[str]]:
+    """Stage name → names of the stages that produce any of its inputs."""
+    return {
+        s.name: [u.name for u in stages
+                 if u is not s and any(_overlaps(o, i) for o in u.outputs for i in s.inputs)]
+        for s in stages
+    }
+
+
+# ── state ────────────────────────────────────────────────────────────────
+
+class PipelineState:
+    """Per-stage fingerprints from the last successful run, plus a stat → hash cache."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        data = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        self.stages: dict[str, dict] = data.get("stages", {})
+        self._files: dict[str, list] = data.get("files", {})  # rel path → [size, mtime_ns, hash]
+
+    def file_hash(self, rel: str) -> str:
+        st = (REPO_ROOT / rel).stat()
+        cached = self._files.get(rel)
+        if cached and cached[:2] == [st.st_size, st.st_mtime_ns]:
+            return cached[2]
+        h = content_hash((REPO_ROOT / rel).read_bytes())
+        self._files[rel] = [st.st_size, st.st_mtime_ns, h]
+        return h
+
+    def fingerprint(self, patterns: list[str]) -> dict[str, str | None]:
+        """rel path → content hash for every file matching the patterns (None: missing file)."""
+        found: dict[str, str | None] = {}
+        for pattern in patterns:
+            if any(c in pattern for c in "*?["):
+                for p in sorted(REPO_ROOT.glob(pattern)):
+                    rel = p.relative_to(REPO_ROOT).as_posix()
+                    found[rel] = self.file_hash(rel)
+            else:
+                found[pattern] = self.file_hash(pattern) if (REPO_ROOT / pattern).exists() else None
+        return found
+
+    def code_version(self, stage: Stage) -> str:
+        return rules_version(*(SCRIPTS_DIR / c for c in stage.code))
+
+    def stale_reason(self, stage: Stage) -> str | None:
+        """Why the stage must run, or None if its last run is still valid."""
+        record = self.stages.get(stage.name)
+        if record is None:
+            return "never run"
+        if record["code"] != self.code_version(stage):
+            return "code changed"
+        for kind, patterns in (("input", stage.inputs), ("output", stage.outputs)):
+            changed = _diff(record[kind + "s"], self.fingerprint(patterns))
+            if changed:
+                more = f" (+{len(changed) - 1} more)" if len(changed) > 1 else ""
+                return f"{kind} changed: {changed[0]}{more}"
+        return None
+
+    def record(self, stage: Stage, inputs: dict) -> None:
+        # Outputs that are also inputs (pairs rewrites llama_train.md) are
+        # recorded as written, so the stage's own write doesn't make it stale
+        outputs = self.fingerprint(stage.outputs)
+        inputs = {**inputs, **{k: v for k, v in outputs.items() if k in inputs}}
+        self.stages[stage.name] = {"code": self.code_version(stage), "inputs": inputs, "outputs": outputs}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"stages": self.stages, "files": self._files}, indent=1, sort_keys=True),
+                       encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def _diff(old: dict, new: dict) -> list[str]:
+    return sorted(k for k in old.keys() | new.keys() if old.get(k) != new.get(k))
+
+
+def missing_inputs(stage: Stage) -> list[str]:
+    """Declared inputs with nothing on disk (a glob matching no files counts)."""
+    return [p for p in stage.inputs if not any(REPO_ROOT.glob(p))]
+
+
+# ── running ──────────────────────────────────────────────────────────────
+
+def run_stage(stage: Stage) -> tuple[int, str, float]:
+    """Run one stage's script; returns (exit code, combined output, seconds).
+
+    Under --profile the stage profiles itself and its trace is merged into ours.
+    """
+    command = stage.command()
+    trace = None
+    if profiling.active():
+        trace = profiling.PROFILE_DIR / "stages" / f"{stage.name}.trace.json"
+        trace.unlink(missing_ok=True)
+        command += ["--profile", "--trace", str(trace)]
+    start = time.perf_counter()
+    with profiling.span(f"pipeline.{stage.name}"):
+        proc = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+    if trace is not None:
+        profiling.merge_trace(trace)
+    return proc.returncode, proc.stdout + proc.stderr, time.perf_counter() - start
+
+
+def select(targets: list[str], deps: dict[str, list[str]]) -> set[str]:
+    """The target stages plus everything upstream of them."""
+    chosen: set[str] = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in chosen:
+            chosen.add(name)
+            todo.extend(deps[name])
+    return chosen
+
+
+def run_pipeline(stages: list[Stage], state: PipelineState, jobs: int = 4,
+                 force: set[str] = frozenset(), dry_run: bool = False) -> dict[str, str]:
+    """Run stale stages as their dependencies finish. Returns stage name → outcome."""
+    deps = dependencies(stages)
+    names = {s.name for s in stages}
+    outcome: dict[str, str] = {}
+    running: dict = {}  # future → (stage, input fingerprint taken before the run)
+
+    def schedule(pool) -> None:
+        for s in stages:
+            if s.name in outcome or any(s is st for st, _ in running.values()):
+                continue
+            upstream = [d for d in deps[s.name] if d in names]
+            if any(d not in outcome for d in upstream):
+                continue
+            if any(outcome[d] in ("failed", "blocked") for d in upstream):
+                outcome[s.name] = "blocked"
+                print(f"  – {s.name:<18s} blocked (upstream failed)")
+                continue
+            if dry_run and any(outcome[d] in ("stale", "pending") for d in upstream):
+                outcome[s.name] = "pending"
+                print(f"  ? {s.name:<18s} after upstream (stale if its inputs change)")
+                continue
+            missing = missing_inputs(s)
+            if missing:
+                outcome[s.name] = "skipped"
+                print(f"  – {s.name:<18s} skipped (no {missing[0]})")
+                continue
+            reason = "forced" if s.name in force else state.stale_reason(s)
+            if reason is None:
+                outcome[s.name] = "fresh"
+                print(f"  ✓ {s.name:<18s} fresh")
+                continue
+            if dry_run:
+                outcome[s.name] = "stale"
+                print(f"  ▶ {s.name:<18s} would run ({reason})")
+                continue
+            print(f"  ▶ {s.name:<18s} running ({reason})")
+            running[pool.submit(run_stage, s)] = (s, state.fingerprint(s.inputs))
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        schedule(pool)
+        while running:
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, inputs = running.pop(future)
+                code, output, seconds = future.result()
+                print(f"\n── {stage.name} ({seconds:.1f}s{'' if code == 0 else f', exit {code}'}) ──")
+                print(output.rstrip() or "  (no output)")
+                if code == 0:
+                    state.record(stage, inputs)
+                    state.save()  # keep finished stages even if a later one is interrupted
+                    outcome[stage.name] = "ran"
+                else:
+                    outcome[stage.name] = "failed"
+            print()
+            schedule(pool)
+    return outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stale data-prep stages in dependency order")
+    parser.add_argument("stages", nargs="*", metavar="STAGE",
+                        help=f"Stages to bring up to date, with their upstream "
+                             f"(default: all): {', '.join(s.name for s in STAGES)}")
+    parser.add_argument("--dry-run", action="store_true", help="Show stale stages without running them")
+    parser.add_argument("--force", nargs="*", metavar="STAGE",
+                        help="Rerun these stages even if fresh (no names: all selected stages)")
+    parser.add_argument("--jobs", "-j", type=int, default=4,
+                        help="Stages to run at once (default: 4)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    names = [s.name for s in STAGES]
+    unknown = [n for n in args.stages + (args.force or []) if n not in names]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    chosen = select(args.stages, dependencies(STAGES)) if args.stages else set(names)
+    stages = [s for s in STAGES if s.name in chosen]
+    force = set(args.force) if args.force else (chosen if args.force is not None else set())
+
+    state = PipelineState(STATE_FILE)
+    print(f"Pipeline: {len(stages)} stage(s){' (dry run)' if args.dry_run else ''}")
+    start = time.perf_counter()
+    outcome = run_pipeline(stages, state, jobs=args.jobs, force=force, dry_run=args.dry_run)
+    if not args.dry_run:
+        state.save()
+
+    counts = {k: sum(v == k for v in outcome.values()) for k in ("ran", "fresh", "skipped", "failed", "blocked")}
+    if args.dry_run:
+        print(f"\n{sum(v == 'stale' for v in outcome.values())} stale | "
+              f"{sum(v == 'pending' for v in outcome.values())} after upstream | "
+              f"{counts['fresh']} fresh | {counts['skipped']} skipped")
+    else:
+        print(f"{counts['ran']} ran | {counts['fresh']} fresh | {counts['skipped']} skipped | "
+              f"{counts['failed']} failed | {counts['blocked']} blocked  ({time.perf_counter() - start:.1f}s)")
+    if counts["failed"] or counts["blocked"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
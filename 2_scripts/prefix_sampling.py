@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Many continuations of one prompt from a single prefill.
+
+Sampling n continuations with model.generate runs the prompt's prefill n times
+(or once per row of a padded batch).  sample_continuations() runs it once,
+forks the KV cache across the rows, and decodes them in lockstep, dropping
+rows from the cache as they hit EOS.  Every row carries its own
+SamplingParams — temperature, top_p, top_k, repetition penalty and seed — so
+the 5 samples of a canary and a temperature sweep over it share one prefill
+and one decode loop.
+
+Sampling is done per row with the row's own torch.Generator, in the order
+generate()'s processors use (repetition penalty, temperature, top-k, top-p),
+so a row's tokens depend only on the prompt and its own params: the same
+SamplingParams give the same sample whether it runs alone or in a batch of
+twenty (--check runs both and compares).
+
+The win grows with prompt length × samples: Canary C and Tier 1 draft
+prompts.  For many short prompts, canary.py's padded batch across prompts
+does more per decode step.
+
+Library use:
+    from prefix_sampling import SamplingParams, sample_continuations
+    params = [SamplingParams(temperature=t, seed=i) for i, t in enumerate([0.6, 0.8, 1.0, 1.2])]
+    samples = sample_continuations(model, prompt_ids, params, max_new_tokens=1024,
+                                   eos_ids=eos_token_ids(model, tokenizer))
+
+Usage:
+    python prefix_sampling.py tiny-llama --canary C --samples 8 --max-new-tokens 128 --check
+    python prefix_sampling.py tiny-gpt2 --canary A --temperatures 0.5 0.8 1.2 --samples 2
+    python prefix_sampling.py path/to/gpt2-voice-v1 --canary B --check --profile
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
+
+def _import_torch():
+    try:
+        import torch
+    except ImportError:
+        raise ImportError("prefix sampling needs torch: pip install torch") from None
+    return torch
+
+
+class SamplingParams:
+    """One row's sampling settings; the defaults are the notebooks' GEN_KWARGS.
+
+    temperature 0 is greedy decoding.  seed None draws one from torch's
+    global generator, so torch.manual_seed() still makes a run repeatable.
+    """
+
+    def __init__(self, temperature: float = 0.8, top_p: float = 0.9, top_k: int = 50,
+                 repetition_penalty: float = 1.1, seed: int | None = None):
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.repetition_penalty = repetition_penalty
+        self.seed = seed
+
+    @classmethod
+    def from_kwargs(cls, gen_kwargs: dict, seed: int | None = None) -> "SamplingParams":
+        """From generate()-style kwargs (GEN_KWARGS); do_sample=False means greedy."""
+        temperature = gen_kwargs.get("temperature", 1.0) if gen_kwargs.get("do_sample", True) else 0.0
+        return cls(temperature=temperature, top_p=gen_kwargs.get("top_p", 1.0),
+                   top_k=gen_kwargs.get("top_k", 0), seed=seed,
+                   repetition_penalty=gen_kwargs.get("repetition_penalty", 1.0))
+
+    def __repr__(self) -> str:
+        return (f"SamplingParams(temperature={self.temperature}, top_p={self.top_p}, top_k={self.top_k}, "
+                f"repetition_penalty={self.repetition_penalty}, seed={self.seed})")
+
+
+def eos_token_ids(model, tokenizer) -> set[int]:
+    """Token IDs that end a sample: the generation config's (Llama 3 lists several) and the tokenizer's."""
+    ids = getattr(getattr(model, "generation_config", None), "eos_token_id", None)
+    ids = set(ids if isinstance(ids, (list, tuple)) else [ids] if ids is not None else [])
+    if tokenizer.eos_token_id is not None:
+        ids.add(tokenizer.eos_token_id)
+    return ids
+
+
+# ── sampling ─────────────────────────────────────────────────────────────
+
+def _generator(seed: int | None, device):
+    torch = _import_torch()
+    if seed is None:
+        seed = int(torch.randint(0, 2**62, (1,)))
+    return torch.Generator(device=device).manual_seed(seed)
+
+
+def sample_token(logits, params: SamplingParams, generator, history) -> int:
+    """Next token for one row from its last-position logits (float32, [vocab]).
+
+    history is every token so far, prompt included, which is what generate()'s
+    repetition penalty looks at.
+    """
+    torch = _import_torch()
+    if params.repetition_penalty != 1.0:
+        score = logits.gather(0, history)
+        score = torch.where(score < 0, score * params.repetition_penalty, score / params.repetition_penalty)
+        logits = logits.scatter(0, history, score)
+    if params.temperature == 0:
+        return int(logits.argmax())
+    logits = logits / params.temperature
+    if params.top_k:
+        kth = torch.topk(logits, min(params.top_k, logits.size(0))).values[-1]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    if params.top_p < 1.0:
+        sorted_logits, order = torch.sort(logits)
+        cumulative = sorted_logits.softmax(-1).cumsum(-1)
+        remove = cumulative <= 1 - params.top_p
+        remove[-1] = False  # always keep the most likely token
+        logits = logits.masked_fill(remove.scatter(0, order, remove), float("-inf"))
+    return int(torch.multinomial(logits.softmax(-1), 1, generator=generator))
+
+
+def sample_continuations(model, prompt_ids: list[int], params: list[SamplingParams],
+                         max_new_tokens: int, eos_ids: set[int]) -> list[list[int]]:
+    """One continuation (token IDs, EOS excluded) per SamplingParams, from one prefill.
+
+    prompt_ids is the formatted, tokenized prompt with nothing padded; a row
+    stops at an EOS token or after max_new_tokens.
+    """
+    torch = _import_torch()
+    device = model.device
+    n = len(params)
+    generators = [_generator(p.seed, device) for p in params]
+    outputs: list[list[int]] = [[] for _ in params]
+    if not n or max_new_tokens <= 0:
+        return outputs
+
+    with torch.no_grad():
+        with profiling.span("prefix_sampling.prefill", tokens=len(prompt_ids), rows=n):
+            out = model(input_ids=torch.tensor([prompt_ids], device=device), use_cache=True)
+        profiling.count("prefill_tokens", len(prompt_ids))
+        profiling.count("prefill_tokens_reused", len(prompt_ids) * (n - 1))
+        cache = out.past_key_values
+        cache.batch_repeat_interleave(n)
+        logits = out.logits[:, -1, :].float().expand(n, -1)
+        history = torch.tensor(prompt_ids, device=device).repeat(n, 1)
+        active = list(range(n))  # params index of each cache row
+
+        with profiling.span("prefix_sampling.decode", rows=n):
+            for step in range(max_new_tokens):
+                tokens = [sample_token(logits[j], params[r], generators[r], history[j])
+                          for j, r in enumerate(active)]
+                keep = [j for j, token in enumerate(tokens) if token not in eos_ids]
+                for j in keep:
+                    outputs[active[j]].append(tokens[j])
+                profiling.count("tokens_generated", len(tokens))
+                if not keep or step == max_new_tokens - 1:
+                    break
+                if len(keep) < len(active):
+                    index = torch.tensor(keep, device=device)
+                    cache.batch_select_indices(index)
+                    history = history[index]
+                    active = [active[j] for j in keep]
+                    tokens = [tokens[j] for j in keep]
+                step_ids = torch.tensor(tokens, device=device).unsqueeze(1)
+                history = torch.cat([history, step_ids], dim=1)
+                out = model(input_ids=step_ids, past_key_values=cache, use_cache=True)
+                cache = out.past_key_values
+                logits = out.logits[:, -1, :].float()
+    return outputs
+
+
+def check_independent(model, prompt_ids: list[int], params: list[SamplingParams],
+                      max_new_tokens: int, eos_ids: set[int],
+                      batched: list[list[int]] | None = None) -> list[int]:
+    """Indices of the rows whose batched sample differs from running that row alone.
+
+    Pass the batched samples if you already have them, to skip sampling the batch again.
+    """
+    if batched is None:
+        batched = sample_continuations(model, prompt_ids, params, max_new_tokens, eos_ids)
+    return [i for i, p in enumerate(params)
+            if sample_continuations(model, prompt_ids, [p], max_new_tokens, eos_ids)[0] != batched[i]]
+
+
+def main():
+    from canary import GEN_KWARGS, MODEL_CANARIES, TINY_MODELS, format_prompt, load_model, prompt_style
+    from format_canary import CANARY_PROMPTS
+
+    parser = argparse.ArgumentParser(description="Sample many continuations of one canary from a single prefill")
+    parser.add_argument("model", help=f"Model path or Hub id, or {' / '.join(TINY_MODELS)} (random, offline)")
+    parser.add_argument("--canary", choices=sorted(CANARY_PROMPTS), default="A", help="Prompt (default: A)")
+    parser.add_argument("--samples", type=int, default=5, help="Samples per temperature (default: 5)")
+    parser.add_argument("--temperatures", type=float, nargs="+", default=[GEN_KWARGS["temperature"]],
+                        help=f"Temperatures to sample at (default: {GEN_KWARGS['temperature']})")
+    parser.add_argument("--max-new-tokens", type=int, default=128, help="Tokens per sample (default: 128)")
+    parser.add_argument("--seed", type=int, default=0, help="Row i samples with seed + i (default: 0)")
+    parser.add_argument("--check", action="store_true",
+                        help="Also run every row alone and confirm the samples match")
+    parser.add_argument("--device", default=None, help="Device (default: cuda if available, else cpu)")
+    parser.add_argument("--dtype", choices=["auto", "float32", "float16", "bfloat16"], default="auto",
+                        help="Weights dtype (default: float16 on cuda, float32 on cpu)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    model, tokenizer = load_model(args.model, device=args.device, dtype=args.dtype)
+    style = prompt_style(tokenizer)
+    if args.canary not in MODEL_CANARIES[style]:
+        print(f"  (canary {args.canary} isn't in the {style} set {MODEL_CANARIES[style]}; running it anyway)")
+    prompt_ids = tokenizer(format_prompt(tokenizer, CANARY_PROMPTS[args.canary], style),
+                           add_special_tokens=False)["input_ids"]
+    params = [SamplingParams.from_kwargs({**GEN_KWARGS, "temperature": t}, seed=args.seed + i)
+              for i, t in enumerate(t for t in args.temperatures for _ in range(args.samples))]
+    eos_ids = eos_token_ids(model, tokenizer)
+
+    print(f"{args.model}: canary {args.canary}, {len(prompt_ids)} prompt tokens, {len(params)} rows "
+          f"(temperatures {' '.join(f'{t:g}' for t in args.temperatures)})")
+    start = time.perf_counter()
+    samples = sample_continuations(model, prompt_ids, params, args.max_new_tokens, eos_ids)
+    elapsed = time.perf_counter() - start
+    generated = sum(map(len, samples))
+    print(f"  one prefill: {len(params)} samples, {generated:,} tokens in {elapsed:.2f}s — "
+          f"{len(params) / elapsed:.2f} samples/s ({len(prompt_ids) * (len(params) - 1):,} prefill tokens reused)")
+    for p, ids in zip(params, samples):
+        text = tokenizer.decode(ids, skip_special_tokens=True).strip().replace("\n", " ")
+        print(f"    t={p.temperature:<4g} seed={p.seed:<3d} {len(ids):5d} tok  {text[:70]!r}")
+
+    if args.check:
+        start = time.perf_counter()
+        differ = check_independent(model, prompt_ids, params, args.max_new_tokens, eos_ids, batched=samples)
+        elapsed = time.perf_counter() - start
+        print(f"  each row alone: {elapsed:.2f}s — {len(params) / elapsed:.2f} samples/s")
+        if differ:
+            print(f"ERROR: {len(differ)} row(s) differ from their independent run: {differ}")
+            sys.exit(1)
+        print(f"  ✓ all {len(params)} samples match their independent runs token for token")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,23 @@ Usage:
     python preprocess.py                          # process all files in 1_data/raw/
     python preprocess.py path/to/essay.md         # process a single file
     python preprocess.py --dry-run                # show what would change without writing
-
-Output goes to 1_data/cleaned/ with the same filename.
+    python preprocess.py --incremental            # only rebuild files changed since last run
+    python preprocess.py --jobs 8                 # clean files across 8 processes (0 = all CPUs)
+    python preprocess.py --engine fused           # single-loop cleaning engine (same output)
+    python preprocess.py --footnotes              # also write footnotes (one read per essay)
+    python preprocess.py export.zip               # clean posts straight from a Substack export
+    python preprocess.py --profile                # time each cleaning phase (see profiling.py)
+
+Output goes to 1_data/cleaned/ with the same filename (posts from an export
+archive are named by slug). With --footnotes, each
+essay's footnotes also go to 1_data/sources/footnotes/ as {stem}_footnotes.md
+(same output as extract_footnotes.py).
 """
 
+from __future__ import annotations
+
 import argparse
+import functools
 import re
 import sys
 from pathlib import Path
@@ -19,6 +31,19 @@ REPO_ROOT = Path(__file__).resolve().parent.parent
 RAW_DIR = REPO_ROOT / "1_data" / "raw"
 CLEANED_DIR = REPO_ROOT / "1_data" / "cleaned"
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from manifest import MANIFEST_NAME, Manifest, rules_version
+from parallel import map_in_order
+from substack_export import iter_posts
+
+# Any edit to this file's cleaning rules invalidates --incremental outputs
+RULES_VERSION = rules_version(__file__)
+
+# --footnotes --incremental tracks its footnote files apart from extract_footnotes.py,
+# whose inputs come from a different directory (a shared manifest would prune them)
+FOOTNOTE_MANIFEST_NAME = ".manifest.preprocess.json"
+
 # --- Substack-specific patterns (must be processed BEFORE generic markdown) ---
 
 # YAML/Hugo frontmatter: ---\nkey: value\n---
@@ -41,6 +66,11 @@ SUBSTACK_FOOTNOTE_DEF_RE = re.compile(
     r"^\[\d+\]\([^)]*#footnote-anchor-\d+-[^)]*\)", re.MULTILINE
 )
 
+# Footnote anchors on their own line -> clean [N] markers (in the footnotes file)
+FOOTNOTE_ANCHOR_CLEAN_RE = re.compile(
+    r"^\[(\d+)\]\([^)]*#footnote-anchor-\d+-[^)]*\)$", re.MULTILINE
+)
+
 # Acknowledgments section: "_Thanks to ..." near the end of an essay
 ACKNOWLEDGMENTS_RE = re.compile(r"^\s*_\s*Thanks to ", re.MULTILINE)
 
@@ -92,8 +122,8 @@ INLINE_BARE_URL_RE = re.compile(r"(?<!\()(https?://\S+)")
 # Avoids collision with --- used as delimiters in the training pipeline
 HORIZONTAL_RULE_RE = re.compile(r"^\s*[-*_]\s*[-*_]\s*[-*_][\s*_-]*$", re.MULTILINE)
 
-# Multiple blank lines -> max two
-MULTI_BLANK_RE = re.compile(r"\n{3,}")
+# Multiple blank lines -> max two (spelled out so the search can skip ahead on "\n\n\n")
+MULTI_BLANK_RE = re.compile(r"\n\n\n+")
 
 # Substack date metadata (e.g., "Feb 23, 2024")
 _DATE_LINE_RE = re.compile(r"^[A-Z][a-z]+ \d{1,2}, \d{4}$")
@@ -106,26 +136,40 @@ def strip_header_dates(text: str) -> str:
     Stripping them globally would eat dates used inside essays as
     structural elements (e.g., a date in a personal narrative).
     """
-    lines = text.split("\n")
+    lines = text.split("\n", 5)  # only the first 5 lines can change
     for i in range(min(5, len(lines))):
         if _DATE_LINE_RE.match(lines[i].strip()):
             lines[i] = ""
     return "\n".join(lines)
 
 
-def strip_endmatter(text: str) -> str:
-    """Remove footnote definitions and acknowledgments from the end of the essay.
+def strip_header(text: str) -> str:
+    """Remove the YAML frontmatter and header dates (the top of a Substack export)."""
+    with profiling.span("preprocess.header"):
+        profiling.count("regex_passes")
+        # Strip YAML frontmatter (must be first, before --- gets normalized to ***)
+        text = FRONTMATTER_RE.sub("", text)
 
-    Substack essays often end with an acknowledgments section ("Thanks to...")
-    followed by numbered footnote definitions. Both should be stripped for
-    fine-tuning since they're not part of the essay voice.
+        # Strip metadata dates from the header area only
+        return strip_header_dates(text)
+
+
+def split_endmatter(text: str) -> tuple[str, str | None]:
+    """Split an essay into its body and its raw footnote section.
+
+    The body ends at the first footnote definition anchor or at the
+    acknowledgments, whichever comes first (see strip_endmatter). The footnote
+    section runs from the first anchor to the end of the text, or is None if
+    the essay has no footnote definitions.
     """
     cut_point = len(text)
+    footnote_start = None
+    profiling.count("regex_passes", 2)
 
     # Find first footnote definition anchor: [N](url#footnote-anchor-N-...)
     m = SUBSTACK_FOOTNOTE_DEF_RE.search(text)
     if m:
-        cut_point = min(cut_point, m.start())
+        cut_point = footnote_start = m.start()
 
     # Find acknowledgments section. If we already found footnotes, look anywhere
     # before them for acknowledgments (footnote-heavy essays push acknowledgments
@@ -136,27 +180,105 @@ def strip_endmatter(text: str) -> str:
         if m.start() > min_pos:
             cut_point = min(cut_point, m.start())
 
-    if cut_point < len(text):
-        text = text[:cut_point]
+    footnotes = text[footnote_start:] if footnote_start is not None else None
+    return text[:cut_point], footnotes
 
-    return text
 
+def strip_endmatter(text: str) -> str:
+    """Remove footnote definitions and acknowledgments from the end of the essay.
+
+    Substack essays often end with an acknowledgments section ("Thanks to...")
+    followed by numbered footnote definitions. Both should be stripped for
+    fine-tuning since they're not part of the essay voice.
+    """
+    return split_endmatter(text)[0]
 
-def preprocess(text: str) -> str:
-    """Clean a raw Substack essay. Keeps paragraph breaks, emphasis, headers, block quotes."""
 
-    # --- Phase 1: Substack-specific stripping (before any generic markdown processing) ---
+def clean_footnotes(section: str) -> str:
+    """Clean a raw footnote section (from split_endmatter) for the footnotes file."""
+    profiling.count("regex_passes", 8)
+    # Convert [N](url#footnote-anchor-...) -> [N]
+    footnotes = FOOTNOTE_ANCHOR_CLEAN_RE.sub(r"[\1]", section)
+
+    # Strip linked images
+    footnotes = LINKED_IMAGE_RE.sub("", footnotes)
+
+    # Strip regular images
+    footnotes = IMAGE_MD_RE.sub("", footnotes)
+
+    # Strip markdown links, keep text
+    footnotes = MARKDOWN_LINK_RE.sub(r"\1", footnotes)
+
+    # Strip empty links
+    footnotes = EMPTY_LINK_RE.sub("", footnotes)
+
+    # Strip bare URL lines
+    footnotes = BARE_URL_LINE_RE.sub("", footnotes)
+
+    # Strip inline URLs
+    footnotes = INLINE_BARE_URL_RE.sub("", footnotes)
+
+    # Collapse blank lines
+    footnotes = MULTI_BLANK_RE.sub("\n\n", footnotes)
+
+    return footnotes.strip() + "\n"
 
-    # Strip YAML frontmatter (must be first, before --- gets normalized to ***)
-    text = FRONTMATTER_RE.sub("", text)
 
-    # Strip metadata dates from the header area only
-    text = strip_header_dates(text)
+ENGINES = ("passes", "fused")
+
+
+def preprocess(text: str, engine: str = "passes") -> str:
+    """Clean a raw Substack essay. Keeps paragraph breaks, emphasis, headers, block quotes.
+
+    engine="fused" applies the line-local rules in a single loop over lines
+    (see _preprocess_fused); its output is byte-identical to the default
+    one-pass-per-rule engine.
+    """
+    # --- Phase 1: Substack-specific stripping (before any generic markdown processing) ---
+
+    text = strip_header(text)
 
     # Strip endmatter: acknowledgments + footnote definitions at the bottom.
     # Must happen before link processing, which would destroy the anchor patterns
     # we use to detect where footnotes start.
-    text = strip_endmatter(text)
+    with profiling.span("preprocess.endmatter"):
+        text = strip_endmatter(text)
+
+    return clean_body(text, engine)
+
+
+def clean_essay(text: str, engine: str = "passes") -> tuple[str, str | None]:
+    """Clean a raw Substack essay and extract its footnotes from one split.
+
+    Returns (cleaned essay, cleaned footnotes or None). The essay is exactly
+    preprocess(text); the footnotes are the endmatter it cut, from the first
+    footnote anchor on, so the two files always agree.
+    """
+    text = strip_header(text)
+    with profiling.span("preprocess.endmatter"):
+        body, section = split_endmatter(text)
+    with profiling.span("preprocess.footnotes"):
+        footnotes = clean_footnotes(section) if section is not None else None
+    return clean_body(body, engine), footnotes
+
+
+def clean_body(text: str, engine: str = "passes") -> str:
+    """Clean an essay body (header and endmatter already stripped) with the given engine."""
+    if engine == "fused":
+        with profiling.span("preprocess.body.fused"):
+            cleaned = _preprocess_fused(text)
+        if cleaned is not None:
+            return cleaned
+        profiling.count("fused_fallbacks")
+    elif engine != "passes":
+        raise ValueError(f"Unknown engine {engine!r} (expected one of {', '.join(ENGINES)})")
+    with profiling.span("preprocess.body.passes"):
+        return _preprocess_passes(text)
+
+
+def _preprocess_passes(text: str) -> str:
+    """Body cleaning, one regex pass per rule."""
+    profiling.count("regex_passes", 10)
 
     # Remove Substack footnote reference links: [N](url#footnote-N-...)
     # Must happen before generic markdown link stripping, which would convert
@@ -193,46 +315,221 @@ def preprocess(text: str) -> str:
     # Remove boilerplate lines
     text = BOILERPLATE_RE.sub("", text)
 
-    # Normalize horizontal rules to *** (avoid --- collision with pipeline delimiters)
-    text = HORIZONTAL_RULE_RE.sub("***", text)
+    return _finish(text)
+
+
+def _finish(text: str) -> str:
+    """Whole-document rules shared by both engines: rules, trailing endmatter, blank lines."""
+    with profiling.span("preprocess.finish"):
+        profiling.count("regex_passes", 2)
+        # Normalize horizontal rules to *** (avoid --- collision with pipeline delimiters)
+        text = HORIZONTAL_RULE_RE.sub("***", text)
+
+        # Strip everything after the final *** (acknowledgments, cross-promos, embeds).
+        # Internal *** are section breaks within the essay; the last one marks where
+        # the essay ends and Substack endmatter begins.
+        last_rule = text.rfind("\n***\n")
+        if last_rule != -1:
+            # Keep the *** as the essay's closing mark
+            text = text[: last_rule + len("\n***")]
+
+        # Collapse multiple blank lines to max two (one empty line between paragraphs)
+        text = MULTI_BLANK_RE.sub("\n\n", text)
+
+        # Strip leading/trailing whitespace
+        text = text.strip() + "\n"
+
+        return text
+
+
+# --- Fused engine ---
+#
+# Every rule in _preprocess_passes() before the horizontal-rule pass matches
+# within a single line, with two exceptions:
+#   - the bracket rules' [^\]] / [^)] classes can run past a line end from an
+#     unclosed [ or ]( — if any line could do that, _preprocess_fused() gives up
+#     and preprocess() falls back to the pass engine;
+#   - BARE_URL_LINE_RE's trailing \s* swallows the whitespace-only lines after a
+#     URL line, which the line loop reproduces by merging them into one empty line.
+# So the rules can be applied line by line, in the same order, and lines without
+# a "[" or "http" (most prose) skip all but the boilerplate check.  Boilerplate
+# patterns are all anchored ^...$, so a match always blanks the whole line.
+
+# Applied in this order, as in _preprocess_passes(); each needs a "[" to match
+_BRACKET_RULES = (
+    (SUBSTACK_FOOTNOTE_REF_RE, ""),
+    (LINKED_IMAGE_RE, ""),
+    (IMAGE_MD_RE, ""),
+    (MARKDOWN_LINK_RE, r"\1"),
+    (EMPTY_LINK_RE, ""),
+)
+
+# BOILERPLATE_RE split for per-line matching: the prefix patterns fail within a
+# line's first few characters, while the reader-supported pattern (which can
+# match anywhere) is only searched for on lines containing "upported" — its
+# letters have no non-ASCII case-insensitive equivalents, so lower() is safe.
+_BOILERPLATE_PREFIX_RE = re.compile(
+    "|".join(f"(?:{p})" for p in BOILERPLATE_PATTERNS if not p.startswith("^.*")),
+    re.IGNORECASE,
+)
+_READER_SUPPORTED_RE = re.compile(r"is a reader-supported publication", re.IGNORECASE)
 
-    # Strip everything after the final *** (acknowledgments, cross-promos, embeds).
-    # Internal *** are section breaks within the essay; the last one marks where
-    # the essay ends and Substack endmatter begins.
-    last_rule = text.rfind("\n***\n")
-    if last_rule != -1:
-        # Keep the *** as the essay's closing mark
-        text = text[: last_rule + len("\n***")]
+# BARE_URL_LINE_RE restricted to one line
+_URL_LINE_RE = re.compile(r"https?://\S+\s*")
 
-    # Collapse multiple blank lines to max two (one empty line between paragraphs)
-    text = MULTI_BLANK_RE.sub("\n\n", text)
 
-    # Strip leading/trailing whitespace
-    text = text.strip() + "\n"
+def _open_bracket(line: str) -> bool:
+    """True if a bracket rule matching in line could continue onto the next line."""
+    return line.rfind("[") > line.rfind("]") or line.rfind("](") > line.rfind(")")
 
-    return text
 
+def _preprocess_fused(text: str) -> str | None:
+    """_preprocess_passes() with the line-local rules fused into one loop over lines.
 
-def process_file(input_path: Path, output_path: Path, dry_run: bool = False) -> None:
-    raw = input_path.read_text(encoding="utf-8")
-    cleaned = preprocess(raw)
+    Returns None if an unclosed bracket could make a rule span lines.
+    """
+    profiling.count("regex_passes")  # the line loop, counted as one pass
+    out = []
+    after_url_line = False  # swallowing whitespace-only lines after a bare URL line
+    for line in text.split("\n"):
+        if "[" in line:
+            for pattern, repl in _BRACKET_RULES:
+                if "[" not in line:
+                    break
+                if _open_bracket(line):
+                    return None
+                line = pattern.sub(repl, line)
+
+        if after_url_line:
+            if not line or line.isspace():
+                continue
+            after_url_line = False
+
+        if "http" in line:
+            if _URL_LINE_RE.fullmatch(line):
+                out.append("")
+                after_url_line = True
+                continue
+            line = INLINE_BARE_URL_RE.sub("", line)
+
+        if "[" in line:
+            line = FOOTNOTE_DEF_RE.sub("", line)
+            line = FOOTNOTE_REF_RE.sub("", line)
+
+        if line and (_BOILERPLATE_PREFIX_RE.match(line)
+                     or ("upported" in line.lower() and _READER_SUPPORTED_RE.search(line))):
+            line = ""
+
+        out.append(line)
+
+    return _finish("\n".join(out))
+
+
+def clean_file(input_path: Path, engine: str = "passes",
+               footnotes: bool = False) -> tuple[int, str, str | None]:
+    """Read and clean one file; runs in --jobs workers.
+
+    Returns (raw chars, cleaned text, footnotes). Footnotes are only extracted
+    (from the same read and split) when footnotes=True, and are None otherwise.
+    """
+    with profiling.span("preprocess.file", file=input_path.name):
+        profiling.count_file(input_path)
+        raw = input_path.read_text(encoding="utf-8")
+        if footnotes:
+            return (len(raw), *clean_essay(raw, engine=engine))
+        return len(raw), preprocess(raw, engine=engine), None
+
+
+def process_file(input_path: Path, output_path: Path, dry_run: bool = False,
+                 manifest: Manifest | None = None,
+                 result: tuple[int, str, str | None] | None = None) -> tuple[int, int]:
+    """Write the cleaned file (or report it in dry-run). Returns (raw chars, cleaned chars).
+
+    `result` is a precomputed clean_file() result, e.g. from a worker process.
+    """
+    raw_chars, cleaned, _ = result if result is not None else clean_file(input_path)
 
     if dry_run:
-        removed = len(raw) - len(cleaned)
-        pct = (removed / len(raw) * 100) if raw else 0
-        print(f"  {input_path.name}: {len(raw)} -> {len(cleaned)} chars ({removed} removed, {pct:.0f}%)")
-        return
+        removed = raw_chars - len(cleaned)
+        pct = (removed / raw_chars * 100) if raw_chars else 0
+        print(f"  {input_path.name}: {raw_chars} -> {len(cleaned)} chars ({removed} removed, {pct:.0f}%)")
+        return raw_chars, len(cleaned)
+
+    if manifest is not None and manifest.output_unchanged(input_path, output_path, cleaned):
+        manifest.record(input_path, output_path, cleaned)
+        print(f"  {input_path.name}: output unchanged")
+        return raw_chars, len(cleaned)
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
     output_path.write_text(cleaned, encoding="utf-8")
+    if manifest is not None:
+        manifest.record(input_path, output_path, cleaned)
     print(f"  {input_path.name} -> {output_path}")
+    return raw_chars, len(cleaned)
+
+
+def ingest_archives(archives: list[Path], args: argparse.Namespace) -> None:
+    """Clean every post in Substack export archives, streaming one post at a time.
+
+    Archives are read serially (--jobs does not apply), so memory stays bounded
+    by the largest post.
+    """
+    if args.footnotes:
+        import extract_footnotes  # its per-file writer; imports this module, so not at the top
+
+    posts = raw_total = clean_total = with_notes = 0
+    for archive in archives:
+        print(f"Processing {archive}...")
+        for member, slug, markdown in iter_posts(archive, include_drafts=args.include_drafts):
+            label = Path(member)
+            result = (len(markdown), *clean_essay(markdown, engine=args.engine)) if args.footnotes \
+                else (len(markdown), preprocess(markdown, engine=args.engine), None)
+            raw_chars, clean_chars = process_file(label, CLEANED_DIR / f"{slug}_clean.md",
+                                                  dry_run=args.dry_run, result=result)
+            posts += 1
+            raw_total += raw_chars
+            clean_total += clean_chars
+            if args.footnotes:
+                out = extract_footnotes.FOOTNOTES_DIR / f"{slug}_footnotes.md"
+                count = extract_footnotes.write_result(label, out, result[2], dry_run=args.dry_run)
+                with_notes += count is not None
+
+    removed_chars = raw_total - clean_total
+    pct = (removed_chars / raw_total * 100) if raw_total else 0
+    print(f"\n{posts} post(s), {raw_total} -> {clean_total} chars ({removed_chars} removed, {pct:.0f}%)")
+    if not args.dry_run:
+        print(f"\nCleaned files written to {CLEANED_DIR}/")
+        if args.footnotes:
+            print(f"{with_notes} footnote file(s) written to {extract_footnotes.FOOTNOTES_DIR}/")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Preprocess raw Substack essays")
-    parser.add_argument("files", nargs="*", help="Specific files to process (default: all in 1_data/raw/)")
+    parser.add_argument("files", nargs="*",
+                        help="Specific files or Substack export .zip archives (default: all in 1_data/raw/)")
     parser.add_argument("--dry-run", action="store_true", help="Show changes without writing files")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Skip files unchanged since the last run (tracked in cleaned/{MANIFEST_NAME})")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Worker processes for cleaning (default: 1, 0 = one per CPU)")
+    parser.add_argument("--engine", choices=ENGINES, default="passes",
+                        help="Cleaning engine: one regex pass per rule, or fused line loop (identical output)")
+    parser.add_argument("--footnotes", action="store_true",
+                        help="Also extract footnotes from the same read (as extract_footnotes.py does)")
+    parser.add_argument("--include-drafts", action="store_true",
+                        help="With an export archive, also clean unpublished drafts")
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.setup(args)
+
+    archives = [Path(f) for f in args.files if f.endswith(".zip")]
+    if archives:
+        if len(archives) != len(args.files):
+            parser.error("pass either export archives or .md files, not both")
+        if args.incremental:
+            parser.error("--incremental tracks files in 1_data/raw/; it does not apply to archives")
+        ingest_archives(archives, args)
+        return
 
     if args.files:
         paths = [Path(f) for f in args.files]
@@ -247,13 +544,66 @@ def main():
         print(f"No .md files found in {RAW_DIR}")
         sys.exit(1)
 
+    manifest = Manifest(CLEANED_DIR / MANIFEST_NAME, RULES_VERSION) if args.incremental else None
+    footnote_manifest = None
+    if args.footnotes:
+        import extract_footnotes  # its per-file writer; imports this module, so not at the top
+        if args.incremental:
+            footnote_manifest = Manifest(extract_footnotes.FOOTNOTES_DIR / FOOTNOTE_MANIFEST_NAME, RULES_VERSION)
+
+    def footnote_path(p: Path) -> Path:
+        return extract_footnotes.FOOTNOTES_DIR / (p.stem + "_footnotes.md")
+
     print(f"Processing {len(paths)} file(s)...")
+    todo = []
     for p in paths:
         out = CLEANED_DIR / (p.stem + "_clean.md")
-        process_file(p, out, dry_run=args.dry_run)
+        fresh = manifest is not None and manifest.is_fresh(p, out)
+        if fresh and footnote_manifest is not None:
+            fresh = footnote_manifest.is_fresh(p, footnote_path(p))
+        if not fresh:
+            todo.append((p, out))
+    unchanged = len(paths) - len(todo)
+
+    # Workers only clean; writes, manifest updates and logging stay here, in input order
+    raw_total = clean_total = 0
+    with_notes = 0
+    clean = functools.partial(clean_file, engine=args.engine, footnotes=args.footnotes)
+    results = map_in_order(clean, [p for p, _ in todo], jobs=args.jobs)
+    for (p, out), result in zip(todo, results):
+        raw_chars, clean_chars = process_file(p, out, dry_run=args.dry_run, manifest=manifest, result=result)
+        raw_total += raw_chars
+        clean_total += clean_chars
+        if args.footnotes:
+            count = extract_footnotes.write_result(p, footnote_path(p), result[2], dry_run=args.dry_run,
+                                                   manifest=footnote_manifest)
+            with_notes += count is not None
+
+    if args.dry_run and todo:
+        removed_chars = raw_total - clean_total
+        pct = (removed_chars / raw_total * 100) if raw_total else 0
+        print(f"\nTotal: {len(todo)} file(s), {raw_total} -> {clean_total} chars "
+              f"({removed_chars} removed, {pct:.0f}%)")
+        if args.footnotes:
+            print(f"       {with_notes} with footnotes")
+
+    if manifest is not None:
+        # Only a full sweep knows which raw files are gone
+        removed = [] if args.files else manifest.prune(CLEANED_DIR, paths, dry_run=args.dry_run)
+        if footnote_manifest is not None and not args.files:
+            removed += footnote_manifest.prune(extract_footnotes.FOOTNOTES_DIR, paths, dry_run=args.dry_run)
+        for out in removed:
+            print(f"  {'would remove' if args.dry_run else 'removed'} {out.name} (raw file gone)")
+        print(f"\n{len(paths) - unchanged} rebuilt | {unchanged} unchanged | {len(removed)} removed")
+        if not args.dry_run:
+            manifest.save()
+            if footnote_manifest is not None:
+                footnote_manifest.save()
 
     if not args.dry_run:
         print(f"\nCleaned files written to {CLEANED_DIR}/")
+        if args.footnotes:
+            print(f"{with_notes} footnote file(s) written to {extract_footnotes.FOOTNOTES_DIR}/")
 
 
 if __name__ == "__main__":
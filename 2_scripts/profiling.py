@@ -0,0 +1,278 @@
+"""
+Per-stage timings and counters for the data-prep scripts (--profile).
+
+Every script takes --profile.  With it, the library code's spans
+(preprocess phases, cut_essay, parse_pairs_file, tokenization, ...) and
+counters (bytes read, tokens encoded, regex passes, token-cache hits) are
+recorded, a summary table goes to stderr at exit, and the spans are written
+as a Chrome trace — open it in https://ui.perfetto.dev or chrome://tracing.
+The trace goes to .cache/profile/{script}.trace.json, or to --trace PATH.
+
+Library use:
+    import profiling
+    with profiling.span("preprocess.header"):
+        ...
+    profiling.count("regex_passes", 10)
+    profiling.count_file(path)          # bytes_read += file size
+
+    @profiling.timed("token_budget.cut_essay")      # a span around every call
+    def cut_essay(...): ...
+
+    # in main()
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+Without --profile nothing is recorded: span() hands back one shared no-op
+context manager, count() returns at once and a timed() function calls
+straight through, so instrumented code pays a function call per span and
+nothing else.  Spans in --jobs workers
+(parallel.py) and in pipeline.py's stage subprocesses are merged into the
+parent's trace.
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+PROFILE_DIR = REPO_ROOT / ".cache" / "profile"
+
+# Past this many trace events, spans still count in the summary but are not
+# written (a 100k-essay run would otherwise keep millions in memory)
+MAX_EVENTS = 500_000
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+    """Span events and counters for one process."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pid = os.getpid()
+        self.events: list[dict] = []
+        self.dropped = 0
+        self.counters: dict[str, int] = {}
+        self.totals: dict[str, list] = {}  # span name → [calls, total µs, max µs]
+        self.files: list[tuple[float, str, str]] = []  # (µs, span, file) for spans with a file
+        self.processes = {self.pid: name}
+
+    def add(self, event: dict) -> None:
+        """Record a finished span ("ph": "X" event, times in µs)."""
+        name, dur = event["name"], event["dur"]
+        total = self.totals.get(name)
+        if total is None:
+            self.totals[name] = [1, dur, dur]
+        else:
+            total[0] += 1
+            total[1] += dur
+            total[2] = max(total[2], dur)
+        file = event.get("args", {}).get("file")
+        if file is not None:
+            self.files.append((dur, name, file))
+        if len(self.events) < MAX_EVENTS:
+            self.events.append(event)
+        else:
+            self.dropped += 1
+
+    def merge(self, data: dict) -> None:
+        """Fold in another process's export() (a --jobs worker or a pipeline stage)."""
+        for event in data["traceEvents"]:
+            if event["ph"] == "X":
+                self.add(event)
+        for k, v in data["counters"].items():
+            self.counters[k] = self.counters.get(k, 0) + v
+        for pid, name in data["processes"].items():
+            self.processes.setdefault(int(pid), name)
+        self.dropped += data.get("dropped", 0)
+
+    def export(self) -> dict:
+        """Chrome trace JSON: span events, process names and final counter values."""
+        end = time.perf_counter_ns() / 1000
+        meta = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": name}}
+                for pid, name in sorted(self.processes.items())]
+        counters = [{"name": k, "ph": "C", "ts": end, "pid": self.pid, "tid": 0, "args": {k: v}}
+                    for k, v in sorted(self.counters.items())]
+        return {
+            "traceEvents": meta + self.events + counters,
+            "displayTimeUnit": "ms",
+            "counters": dict(sorted(self.counters.items())),
+            "processes": {str(pid): name for pid, name in self.processes.items()},
+            "dropped": self.dropped,
+        }
+
+    def summary(self, top: int = 5) -> str:
+        """Per-span totals, slowest files, and counters, as a text table."""
+        lines = [f"Profile: {self.name} (a span's total includes the spans nested in it)"]
+        wall = self.totals.get(self.name, [0, 0, 0])[1]
+        lines.append(f"  {'Span':<34s} {'Calls':>8s} {'Total':>10s} {'Mean':>10s} {'Max':>10s} {'Wall':>6s}")
+        for name, (calls, total, peak) in sorted(self.totals.items(), key=lambda kv: -kv[1][1]):
+            share = f"{total / wall * 100:5.1f}%" if wall else ""
+            lines.append(f"  {name:<34s} {calls:>8d} {_ms(total):>10s} {_ms(total / calls):>10s} "
+                         f"{_ms(peak):>10s} {share:>6s}")
+        if self.files:
+            lines.append("  Slowest files:")
+            for dur, name, file in sorted(self.files, reverse=True)[:top]:
+                lines.append(f"    {_ms(dur):>10s}  {name}  {file}")
+        if self.counters:
+            lines.append("  Counters:")
+            for k, v in sorted(self.counters.items()):
+                lines.append(f"    {k:<32s} {v:>14,d}")
+        if len(self.processes) > 1:
+            lines.append(f"  (spans from {len(self.processes)} processes, so totals can exceed the wall time)")
+        if self.dropped:
+            lines.append(f"  ({self.dropped} span(s) past {MAX_EVENTS} not written to the trace)")
+        return "\n".join(lines)
+
+
+def _ms(us: float) -> str:
+    return f"{us / 1000:.2f}ms" if us < 10_000_000 else f"{us / 1_000_000:.1f}s"
+
+
+class _Span:
+    """A timed span; the counters that moved while it was open go in its args."""
+
+    __slots__ = ("profiler", "name", "args", "start", "before")
+
+    def __init__(self, profiler: Profiler, name: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.before = dict(self.profiler.counters)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        end = time.perf_counter_ns()
+        p = self.profiler
+        args = self.args
+        for k, v in p.counters.items():
+            if v != self.before.get(k, 0):
+                args[k] = v - self.before.get(k, 0)
+        p.add({
+            "name": self.name,
+            "cat": self.name.split(".", 1)[0],
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": p.pid,
+            "tid": threading.get_native_id(),
+            "args": args,
+        })
+
+
+# ── recording ────────────────────────────────────────────────────────────
+
+_active: Profiler | None = None
+
+
+def active() -> bool:
+    return _active is not None
+
+
+def span(name: str, **args):
+    """Context manager timing a stage; args (e.g. file=...) label it in the trace."""
+    if _active is None:
+        return _NULL_SPAN
+    return _Span(_active, name, args)
+
+
+def timed(name: str, **labels):
+    """Decorator: time every call of the function as a span named name.
+
+    Each label is a function of the call's arguments whose result labels the
+    span, e.g. timed("token_budget.file", file=lambda path, *a, **kw: path.name).
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return fn(*args, **kwargs)
+            with _Span(_active, name, {k: label(*args, **kwargs) for k, label in labels.items()}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add n to a counter."""
+    if _active is not None:
+        _active.counters[name] = _active.counters.get(name, 0) + n
+
+
+def count_file(path: Path) -> None:
+    """Count a file's size as bytes read (the stat only happens when profiling)."""
+    if _active is not None:
+        count("bytes_read", os.stat(path).st_size)
+
+
+# ── workers and subprocesses ─────────────────────────────────────────────
+
+def call_profiled(fn, item):
+    """Run fn(item) under a fresh profiler; returns (result, export).
+
+    parallel.py maps this over --jobs workers so their spans reach the parent.
+    """
+    global _active
+    outer = _active
+    _active = Profiler(f"{outer.name if outer else 'worker'} worker")
+    try:
+        result = fn(item)
+        return result, _active.export()
+    finally:
+        _active = outer
+
+
+def merge(data: dict) -> None:
+    """Fold a call_profiled() export into this process's profile."""
+    if _active is not None:
+        _active.merge(data)
+
+
+def merge_trace(path: Path) -> None:
+    """Fold a trace written by another script (a pipeline stage) into this one."""
+    if _active is not None and path.exists():
+        _active.merge(json.loads(path.read_text(encoding="utf-8")))
+
+
+# ── command line ─────────────────────────────────────────────────────────
+
+def add_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--profile", action="store_true",
+                        help="Record stage timings and counters; print a summary and write a Chrome trace")
+    parser.add_argument("--trace", type=Path, metavar="PATH",
+                        help="With --profile: trace file (default: .cache/profile/{script}.trace.json)")
+
+
+def setup(args: argparse.Namespace, name: str | None = None) -> None:
+    """Start profiling if --profile was given; the summary and trace are written at exit."""
+    if not args.profile:
+        return
+    name = name or Path(sys.argv[0]).stem
+    start(name, args.trace or PROFILE_DIR / f"{name}.trace.json")
+
+
+def start(name: str, trace: Path) -> None:
+    global _active
+    _active = Profiler(name)
+    run = _Span(_active, name, {"argv": " ".join(sys.argv[1:])}).__enter__()
+
+    def finish() -> None:
+        run.__exit__(None, None, None)
+        trace.parent.mkdir(parents=True, exist_ok=True)
+        trace.write_text(json.dumps(_active.export()), encoding="utf-8")
+        print(f"\n{_active.summary()}\n  Trace → {trace}", file=sys.stderr)
+
+    atexit.register(finish)
@@ -16,17 +16,20 @@ Usage:
     python prompts_to_llama.py --target llama_val.md       # different target file
     python prompts_to_llama.py --dry-run                   # show what would change
     python prompts_to_llama.py --slug 15-the-9-11-ai-nft   # single essay only
+    python prompts_to_llama.py --profile                   # time matching, stripping and writing
 """
 
 from __future__ import annotations
 
 import argparse
-import re
 import sys
 from pathlib import Path
 
 # Import shared logic from token_budget.py (same directory)
 sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from pairs_file import iter_pairs_text, render_pairs, split_header, write_pairs
+from slug_index import SlugIndex
 from token_budget import parse_prompts_file, strip_prompt_from_essay
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
@@ -42,13 +45,19 @@ def norm(s: str) -> str:
     return s.replace("_", "-")
 
 
+def essay_index(slugs: list[str], cleaned_dir: Path) -> SlugIndex:
+    """Match slugs to cleaned essay stems, from one listing of the directory.
+
+    A slug matches every essay whose stem contains it (after norm); the
+    first in sorted order is the one used.
+    """
+    return SlugIndex(slugs, [f.stem for f in sorted(cleaned_dir.glob("*_clean.md"))], normalize=norm)
+
+
 def find_essay(slug: str, cleaned_dir: Path) -> Path | None:
-    """Find the cleaned essay file matching a slug."""
-    n = norm(slug)
-    for f in sorted(cleaned_dir.glob("*_clean.md")):
-        if n in norm(f.stem):
-            return f
-    return None
+    """Find the cleaned essay file matching a slug (use essay_index for many slugs)."""
+    stem = essay_index([slug], cleaned_dir).first_name(slug)
+    return cleaned_dir / f"{stem}.md" if stem else None
 
 
 # ── parsing ──────────────────────────────────────────────────────────────
@@ -56,30 +65,15 @@ def find_essay(slug: str, cleaned_dir: Path) -> Path | None:
 def parse_target(text: str) -> tuple[str, list[dict]]:
     """Parse a Llama pairs .md file into (header, list of pair dicts).
 
-    Each pair dict has: name, tier, prompt, response, raw (original block text).
+    Each pair dict has: name, tier, prompt, response.
     """
-    # Split into header + pair blocks
-    parts = re.split(r"\n(?=## pair:)", text)
-    header = parts[0]
-    pairs = []
-
-    for block in parts[1:]:
-        name_m = re.match(r"## pair:\s*(.+)", block)
-        if not name_m:
-            continue
-        name = name_m.group(1).strip()
-
-        tier_m = re.search(r"^tier:\s*(\d+)", block, re.MULTILINE)
-        tier = int(tier_m.group(1)) if tier_m else None
-
-        prompt_m = re.search(r"### prompt\n(.*?)(?=\n### response)", block, re.DOTALL)
-        prompt = prompt_m.group(1).strip() if prompt_m else ""
-
-        resp_m = re.search(r"### response\n(.*?)(?=\n-{2,3}\s*$|\Z)", block, re.DOTALL)
-        response = resp_m.group(1).strip() if resp_m else ""
-
-        pairs.append({"name": name, "tier": tier, "prompt": prompt, "response": response})
-
+    # Header = everything before the first ## pair: block (pairs_file.py)
+    header = split_header(text)
+    pairs = [
+        {"name": p["name"], "tier": p["tier"],
+         "prompt": p["prompt"] or "", "response": p["response"] or ""}
+        for p in iter_pairs_text(text) if p["name"]
+    ]
     return header, pairs
 
 
@@ -96,27 +90,9 @@ def build_response(tier: int, prompt: str, essay_text: str) -> str:
     return essay_text
 
 
-def format_pair(pair: dict) -> str:
-    """Format a pair dict as a markdown block."""
-    return "\n".join([
-        f"## pair: {pair['name']}",
-        f"tier: {pair['tier']}",
-        "",
-        "### prompt",
-        pair["prompt"],
-        "",
-        "### response",
-        pair["response"],
-    ])
-
-
 def build_output(header: str, pairs: list[dict]) -> str:
-    """Assemble the full pairs .md file."""
-    blocks = [header.rstrip(), "---"]
-    for pair in pairs:
-        blocks.append(format_pair(pair))
-        blocks.append("---")
-    return "\n\n".join(blocks) + "\n"
+    """Assemble the full pairs .md file (write_pairs writes it incrementally)."""
+    return render_pairs(header, pairs)
 
 
 # ── main ─────────────────────────────────────────────────────────────────
@@ -133,7 +109,9 @@ def main():
                         help="Replace existing tier 3 responses with full essay continuations")
     parser.add_argument("--dry-run", action="store_true",
                         help="Print what would change without writing")
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.setup(args)
 
     # Parse prompts
     if not PROMPTS_FILE.exists():
@@ -150,16 +128,20 @@ def main():
     # Build full responses from cleaned essays
     full_responses: dict[str, str] = {}  # norm_slug → full response
     no_essay = []
+    index = essay_index(list(prompts), CLEANED_DIR)
 
     for slug, entry in prompts.items():
         if not entry["prompt"]:
             continue
-        essay_path = find_essay(slug, CLEANED_DIR)
-        if essay_path is None:
+        stem = index.first_name(slug)
+        if stem is None:
             no_essay.append(slug)
             continue
-        essay_text = essay_path.read_text(encoding="utf-8").strip()
-        response = build_response(entry["tier"], entry["prompt"], essay_text)
+        essay_path = CLEANED_DIR / f"{stem}.md"
+        with profiling.span("prompts_to_llama.essay", file=essay_path.name):
+            profiling.count_file(essay_path)
+            essay_text = essay_path.read_text(encoding="utf-8").strip()
+            response = build_response(entry["tier"], entry["prompt"], essay_text)
 
         if entry["tier"] == 3 and response == essay_text:
             print(f"  WARNING: prompt not found in essay for {slug}", file=sys.stderr)
@@ -168,6 +150,10 @@ def main():
 
     if no_essay:
         print(f"  No cleaned essay found: {', '.join(no_essay)}", file=sys.stderr)
+    for slug, stems in index.ambiguous_slugs().items():
+        if prompts[slug]["prompt"]:
+            print(f"  WARNING: {slug} matches {len(stems)} essays, using {stems[0]} "
+                  f"(also {', '.join(stems[1:])})", file=sys.stderr)
 
     # Read existing target file
     if not args.target.exists():
@@ -181,6 +167,7 @@ def main():
     if args.regenerate:
         updated = 0
         unchanged = 0
+        changed: set[str] = set()  # names whose block must be rewritten
         existing_norm_names = {norm(p["name"]) for p in existing_pairs}
 
         for pair in existing_pairs:
@@ -193,6 +180,7 @@ def main():
                     print(f"  ~ {pair['name']:<40s}  T{pair['tier']}  "
                           f"{old_len:>5d} → {new_len:>5d} chars", file=sys.stderr)
                     pair["response"] = new_resp
+                    changed.add(pair["name"])
                     updated += 1
                 else:
                     unchanged += 1
@@ -206,6 +194,7 @@ def main():
                 pair = {"name": slug, "tier": entry["tier"],
                         "prompt": entry["prompt"], "response": full_responses[norm(slug)]}
                 new_pairs.append(pair)
+                changed.add(slug)
                 print(f"  + {slug:<40s}  T{entry['tier']}  (new)", file=sys.stderr)
 
         all_pairs = existing_pairs + new_pairs
@@ -219,9 +208,10 @@ def main():
         if args.dry_run:
             return
 
-        output = build_output(header, all_pairs)
-        args.target.write_text(output, encoding="utf-8")
-        print(f"  ✓ wrote {args.target.name}", file=sys.stderr)
+        result = write_pairs(args.target, header, all_pairs, changed)
+        print(f"  ✓ wrote {args.target.name} ({result['formatted']} pair(s) rewritten, "
+              f"{result['kept']} kept)" if result["written"] else f"  {args.target.name} unchanged",
+              file=sys.stderr)
         return
 
     # Default mode: append new pairs only
@@ -244,14 +234,8 @@ def main():
     if not new_pairs or args.dry_run:
         return
 
-    blocks = []
-    for pair in new_pairs:
-        blocks.append(format_pair(pair))
-        blocks.append("---")
-
-    appendix = "\n\n" + "\n\n".join(blocks) + "\n"
-    with open(args.target, "a", encoding="utf-8") as f:
-        f.write(appendix)
+    # Existing blocks are copied through unchanged (see pairs_file.write_pairs)
+    write_pairs(args.target, header, existing_pairs + new_pairs, {p["name"] for p in new_pairs})
 
     print(f"  ✓ appended {len(new_pairs)} pairs to {args.target.name}", file=sys.stderr)
 
@@ -0,0 +1,132 @@
+"""
+Match prompt slugs against essay filenames in one pass.
+
+A slug from prompts.md matches every filename that contains it
+("15-the-9-11-ai-nft" matches "15-the-9-11-ai-nft_clean").  Testing each
+slug against each filename is slugs × files substring scans.  SlugIndex
+compiles the slugs into an Aho-Corasick automaton once and runs each name
+through it, which finds every slug contained in the name in time
+proportional to the name's length.  Matching N prompts to N essays is then
+linear instead of quadratic.
+
+Lookups keep the scripts' first-match rules: for a slug, the first name in
+the order given; for a name, the first slug in the order given.  All other
+matches are kept too, so callers can report ambiguity.
+
+Used by prompts_to_llama.py (slug → essay), token_budget.py (essay → prompt)
+and watch.py.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from typing import Callable
+
+
+class SlugIndex:
+    """Which slugs occur as substrings of which names.
+
+    normalize, if given, is applied to both slugs and names before matching
+    (prompts_to_llama.norm treats "_" and "-" alike); results are always the
+    original strings.  Repeated slugs or names keep their first position.
+    """
+
+    def __init__(self, slugs: list[str], names: list[str], normalize: Callable[[str], str] | None = None):
+        self.slugs = list(slugs)
+        self.names = list(names)
+        normalize = normalize or (lambda s: s)
+        self._build([normalize(s) for s in self.slugs])
+
+        self._by_name = [self._scan(normalize(n)) for n in self.names]  # name → slug positions
+        self._by_slug: list[list[int]] = [[] for _ in self.slugs]        # slug → name positions
+        for j, found in enumerate(self._by_name):
+            for i in found:
+                self._by_slug[i].append(j)
+
+        self._slug_pos: dict[str, int] = {}
+        for i, s in enumerate(self.slugs):
+            self._slug_pos.setdefault(s, i)
+        self._name_pos: dict[str, int] = {}
+        for j, n in enumerate(self.names):
+            self._name_pos.setdefault(n, j)
+
+    # ── automaton ────────────────────────────────────────────────────────
+
+    def _build(self, patterns: list[str]) -> None:
+        goto: list[dict[str, int]] = [{}]
+        out: list[list[int]] = [[]]
+        self._empty = []  # "" is in every name
+        for i, pattern in enumerate(patterns):
+            if not pattern:
+                self._empty.append(i)
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append(i)
+
+        # Breadth-first failure links; each node's output also carries the
+        # patterns that end at its failure node (its longest proper suffix)
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0)
+                if out[fail[child]]:
+                    out[child] = out[child] + out[fail[child]]
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def _scan(self, text: str) -> list[int]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set(self._empty)
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return sorted(found)
+
+    # ── lookups ──────────────────────────────────────────────────────────
+
+    def names_matching(self, slug: str) -> list[str]:
+        """Names containing the slug, in the order given."""
+        i = self._slug_pos.get(slug)
+        return [] if i is None else [self.names[j] for j in self._by_slug[i]]
+
+    def first_name(self, slug: str) -> str | None:
+        """The first name containing the slug (None if none does)."""
+        i = self._slug_pos.get(slug)
+        return self.names[self._by_slug[i][0]] if i is not None and self._by_slug[i] else None
+
+    def slugs_in(self, name: str) -> list[str]:
+        """Slugs contained in the name, in the order given."""
+        j = self._name_pos.get(name)
+        return [] if j is None else [self.slugs[i] for i in self._by_name[j]]
+
+    def first_slug(self, name: str) -> str | None:
+        """The first slug contained in the name (None if none is)."""
+        j = self._name_pos.get(name)
+        return self.slugs[self._by_name[j][0]] if j is not None and self._by_name[j] else None
+
+    def ambiguous_slugs(self) -> dict[str, list[str]]:
+        """Slug → names, for slugs found in more than one name."""
+        return {s: [self.names[j] for j in self._by_slug[i]]
+                for i, s in enumerate(self.slugs) if len(self._by_slug[i]) > 1}
+
+    def ambiguous_names(self) -> dict[str, list[str]]:
+        """Name → slugs, for names containing more than one slug."""
+        return {n: [self.slugs[i] for i in self._by_name[j]]
+                for j, n in enumerate(self.names) if len(self._by_name[j]) > 1}
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Token streaming for the Gradio generate tab.
+
+model.generate() blocks until all max_new_tokens are out, so a generate tab
+that returns its decoded text shows nothing until then.  stream_generate()
+runs model.generate in a background thread and yields the response as it
+grows, which is what a Gradio event handler that is a generator needs:
+
+    gen_btn.click(stream_generate_fn, [prompt, max_tokens], output)
+
+Tokens come off the generation thread through a streamer queue and are
+turned into text by IncrementalDecoder, which only releases text once it is
+final: a UTF-8 character split across byte-level BPE tokens (GPT-2, Llama 3)
+is held back until its last byte arrives, and a few prompt tokens are kept as
+decoding context so SentencePiece-style leading spaces come out right.  The
+streamed pieces join to exactly tokenizer.decode(new_ids,
+skip_special_tokens=True, clean_up_tokenization_spaces=False).
+
+Each request gets a StreamStats: time to first token (prefill included),
+inter-token latencies and tokens/s.  --metrics appends them as JSON lines.
+Closing the generator (Gradio's Stop, a dropped connection) stops generation
+at the next token.
+
+Notebook use (the 3_training/inference*.ipynb generate tabs):
+    sys.path.insert(0, f"{REPO_DIR}/2_scripts")
+    from streaming import StreamStats, stream_generate
+
+    def generate(prompt, max_tokens):
+        stats = StreamStats()
+        text = ""
+        for text in stream_generate(model, tokenizer, prompt, max_new_tokens=int(max_tokens), stats=stats):
+            yield text, f"{len(stats.token_times)} tokens…"
+        yield text, str(stats)
+
+    gen_btn.click(generate, [prompt, max_tokens], [output, timings])   # timings = gr.Markdown()
+
+Usage:
+    python streaming.py tiny-gpt2 "Write an essay about walking."               # stream to the terminal
+    python streaming.py tiny-llama --canary C --max-new-tokens 256 --metrics /tmp/stream.jsonl
+    python streaming.py path/to/gpt2-voice-v1 --ui                               # Gradio generate tab
+    python streaming.py tiny-gpt2 --canary A --profile
+    python streaming.py tiny-llama --check-decoder     # streamed pieces join to decode(), multi-byte text
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import queue
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
+# Prompt tokens decoded along with the response, for tokenizers whose text
+# for a token depends on the one before it
+CONTEXT_TOKENS = 5
+
+
+def _import_torch():
+    try:
+        import torch
+        import transformers
+    except ImportError:
+        raise ImportError("streaming generation needs torch and transformers: "
+                          "pip install torch transformers") from None
+    return torch, transformers
+
+
+# ── detokenization ───────────────────────────────────────────────────────
+
+class IncrementalDecoder:
+    """Text for a growing list of token IDs, released once it can't change."""
+
+    def __init__(self, tokenizer, context: list[int] = (), skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.ids = list(context)
+        self.prefix_offset = 0              # decode window start
+        self.read_offset = len(self.ids)    # tokens before this are released
+        self.held_released = 0              # characters released past read_offset's text
+
+    def _decode(self, ids: list[int]) -> str:
+        return self.tokenizer.decode(ids, skip_special_tokens=self.skip_special_tokens,
+                                     clean_up_tokenization_spaces=False)
+
+    def push(self, ids: list[int]) -> str:
+        """Add tokens; returns the text they complete ("" while a character is partial)."""
+        self.ids.extend(ids)
+        prefix = self._decode(self.ids[self.prefix_offset:self.read_offset])
+        text = self._decode(self.ids[self.prefix_offset:])
+        start = len(prefix) + self.held_released
+        if text.endswith("�"):
+            # The tokens since read_offset end mid-character: release the
+            # characters before it, but keep decoding from read_offset so the
+            # partial bytes are still there when the rest arrives
+            piece = text.rstrip("�")[start:]
+            self.held_released += len(piece)
+            return piece
+        if len(text) <= start:
+            return ""
+        self.prefix_offset, self.read_offset = self.read_offset, len(self.ids)
+        self.held_released = 0
+        return text[start:]
+
+    def flush(self) -> str:
+        """Whatever is still held back (a character that never completed)."""
+        prefix = self._decode(self.ids[self.prefix_offset:self.read_offset])
+        text = self._decode(self.ids[self.prefix_offset:])
+        start = len(prefix) + self.held_released
+        self.prefix_offset = self.read_offset = len(self.ids)
+        self.held_released = 0
+        return text[start:]
+
+
+class _ByteChunkTokenizer:
+    """Fixed-width UTF-8 byte chunks as tokens, so most tokens end mid-character."""
+
+    def __init__(self, width: int):
+        self.width = width
+        self.vocab: list[bytes] = []
+
+    def encode(self, text: str) -> list[int]:
+        data = text.encode("utf-8")
+        ids = []
+        for i in range(0, len(data), self.width):
+            self.vocab.append(data[i:i + self.width])
+            ids.append(len(self.vocab) - 1)
+        return ids
+
+    def decode(self, ids: list[int], **kwargs) -> str:
+        return b"".join(self.vocab[i] for i in ids).decode("utf-8", errors="replace")
+
+
+CHECK_TEXTS = ["中文字符测试", "a中文字符测试", "ab 日本語のテキスト。", "naïve café — 👋🏽 emoji 🇬🇧 flags"]
+
+
+def check_decoder(tokenizer, texts: list[str] = CHECK_TEXTS) -> list[str]:
+    """Texts whose token-by-token stream doesn't join to tokenizer.decode."""
+    failed = []
+    for text in texts:
+        ids = tokenizer.encode(text)
+        decoder = IncrementalDecoder(tokenizer)
+        streamed = "".join(decoder.push([i]) for i in ids) + decoder.flush()
+        if streamed != decoder._decode(ids):
+            failed.append(text)
+    return failed
+
+
+# ── metrics ──────────────────────────────────────────────────────────────
+
+class StreamStats:
+    """Timings for one streamed request, all from time.perf_counter()."""
+
+    def __init__(self, prompt_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens  # set by stream_tokens
+        self.start = time.perf_counter()
+        self.token_times: list[float] = []  # when each token left generate()
+        self.end: float | None = None
+        self.cancelled = False
+
+    @property
+    def ttft(self) -> float | None:
+        """Seconds from the request to the first generated token."""
+        return self.token_times[0] - self.start if self.token_times else None
+
+    @property
+    def inter_token(self) -> list[float]:
+        """Seconds between consecutive tokens."""
+        return [b - a for a, b in zip(self.token_times, self.token_times[1:])]
+
+    def summary(self) -> dict:
+        gaps = sorted(self.inter_token)
+        total = (self.end or time.perf_counter()) - self.start
+        decode = self.token_times[-1] - self.token_times[0] if len(self.token_times) > 1 else 0.0
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "tokens": len(self.token_times),
+            "ttft_ms": round(self.ttft * 1000, 2) if self.ttft is not None else None,
+            "itl_p50_ms": round(statistics.median(gaps) * 1000, 2) if gaps else None,
+            "itl_p90_ms": round(gaps[int(0.9 * (len(gaps) - 1))] * 1000, 2) if gaps else None,
+            "itl_max_ms": round(gaps[-1] * 1000, 2) if gaps else None,
+            "decode_tokens_per_s": round(len(gaps) / decode, 2) if decode else None,
+            "total_s": round(total, 3),
+            "cancelled": self.cancelled,
+        }
+
+    def __str__(self) -> str:
+        s = self.summary()
+        if s["ttft_ms"] is None:
+            return "no tokens generated"
+        line = f"TTFT {s['ttft_ms']:.0f} ms · {s['tokens']} tokens in {s['total_s']:.2f}s"
+        if s["itl_p50_ms"] is not None:
+            line += (f" · {s['decode_tokens_per_s']:.1f} tok/s · inter-token p50 {s['itl_p50_ms']:.1f} ms, "
+                     f"p90 {s['itl_p90_ms']:.1f} ms, max {s['itl_max_ms']:.1f} ms")
+        return line + (" · stopped" if s["cancelled"] else "")
+
+
+# ── streaming ────────────────────────────────────────────────────────────
+
+class _QueueStreamer:
+    """generate()'s streamer interface: put() gets the prompt, then each new token; end() once."""
+
+    def __init__(self, stats: StreamStats):
+        self.stats = stats
+        self.queue: queue.Queue = queue.Queue()
+        self.prompt_seen = False
+
+    def put(self, value) -> None:
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        ids = value.reshape(-1).tolist()
+        self.stats.token_times.extend([time.perf_counter()] * len(ids))
+        self.queue.put(ids)
+
+    def end(self) -> None:
+        self.queue.put(None)
+
+
+def stop_criteria(event: threading.Event):
+    """Stopping criteria for generate() that end every row once event is set."""
+    torch, transformers = _import_torch()
+
+    class Stop(transformers.StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+    return transformers.StoppingCriteriaList([Stop()])
+
+
+def stream_tokens(model, tokenizer, prompt_ids: list[int], max_new_tokens: int,
+                  gen_kwargs: dict | None = None, stats: StreamStats | None = None) -> Iterator[str]:
+    """Yield response text pieces as model.generate (in a thread) produces tokens.
+
+    prompt_ids is the formatted, tokenized prompt.  stats, if given, is
+    filled in as the stream goes (create it when the request arrives, so TTFT
+    includes formatting and tokenizing); it is final once the generator is done.
+    """
+    torch, _ = _import_torch()
+    from canary import GEN_KWARGS
+
+    stats = stats or StreamStats()
+    stats.prompt_tokens = len(prompt_ids)
+    streamer = _QueueStreamer(stats)
+    stop = threading.Event()
+    failure: list[BaseException] = []
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    def run() -> None:
+        try:
+            with torch.no_grad():
+                model.generate(
+                    input_ids=torch.tensor([prompt_ids], device=model.device),
+                    attention_mask=torch.ones((1, len(prompt_ids)), dtype=torch.long, device=model.device),
+                    max_new_tokens=max_new_tokens, pad_token_id=pad_id, streamer=streamer,
+                    stopping_criteria=stop_criteria(stop),
+                    **(GEN_KWARGS if gen_kwargs is None else gen_kwargs),
+                )
+        except BaseException as e:  # re-raised in the consuming thread
+            failure.append(e)
+            streamer.end()
+
+    decoder = IncrementalDecoder(tokenizer, context=prompt_ids[-CONTEXT_TOKENS:])
+    thread = threading.Thread(target=run, name="stream-generate", daemon=True)
+    with profiling.span("streaming.request", prompt_tokens=len(prompt_ids)):
+        thread.start()
+        try:
+            for ids in iter(streamer.queue.get, None):
+                text = decoder.push(ids)
+                if text:
+                    yield text
+            text = decoder.flush()
+            if text:
+                yield text
+        except GeneratorExit:
+            stats.cancelled = True
+            raise
+        finally:
+            stop.set()
+            thread.join()
+            stats.end = time.perf_counter()
+    profiling.count("tokens_generated", len(stats.token_times))
+    if failure:
+        raise failure[0]
+
+
+def stream_generate(model, tokenizer, prompt: str, style: str | None = None, max_new_tokens: int = 512,
+                    gen_kwargs: dict | None = None, stats: StreamStats | None = None) -> Iterator[str]:
+    """Yield the response so far (the whole text each time, as a Gradio textbox wants).
+
+    The prompt is formatted like the training data (canary.format_prompt):
+    the GPT-2 separator, or the chat template when the tokenizer has one.
+    """
+    from canary import format_prompt, prompt_style
+
+    prompt_ids = tokenizer(format_prompt(tokenizer, prompt, style or prompt_style(tokenizer)),
+                           add_special_tokens=False)["input_ids"]
+    text = ""
+    for piece in stream_tokens(model, tokenizer, prompt_ids, max_new_tokens, gen_kwargs, stats):
+        text += piece
+        yield text
+
+
+def append_metrics(path: Path, stats: StreamStats, **fields) -> None:
+    """Append one request's summary as a JSON line."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({**fields, **stats.summary()}) + "\n")
+
+
+# ── command line ─────────────────────────────────────────────────────────
+
+def launch_ui(model, tokenizer, name: str, max_new_tokens: int, metrics: Path | None) -> None:
+    """A Gradio generate tab that streams, with each request's timings under the output."""
+    try:
+        import gradio as gr
+    except ImportError:
+        raise ImportError("--ui needs gradio: pip install gradio") from None
+
+    def generate(prompt, max_tokens):
+        stats = StreamStats()
+        text = ""
+        for text in stream_generate(model, tokenizer, prompt, max_new_tokens=int(max_tokens), stats=stats):
+            yield text, f"{len(stats.token_times)} tokens…"
+        if metrics:
+            append_metrics(metrics, stats, model=name)
+        yield text, str(stats)
+
+    with gr.Blocks(title=f"Streaming — {name}") as demo:
+        gr.Markdown(f"# {name}\nStreaming generation with time-to-first-token and inter-token latency.")
+        prompt = gr.Textbox(label="Prompt", lines=4, placeholder="Write an essay about...")
+        max_tokens = gr.Slider(64, max(max_new_tokens, 64), value=max_new_tokens, step=64, label="Max tokens")
+        with gr.Row():
+            gen_btn = gr.Button("Generate", variant="primary")
+            stop_btn = gr.Button("Stop")
+        output = gr.Textbox(label="Output", lines=30)
+        timings = gr.Markdown()
+        event = gen_btn.click(generate, [prompt, max_tokens], [output, timings])
+        stop_btn.click(None, cancels=[event])
+
+    demo.queue()
+    demo.launch()
+
+
+def main():
+    from canary import MAX_NEW_TOKENS, TINY_MODELS, load_model, prompt_style
+    from format_canary import CANARY_PROMPTS
+
+    parser = argparse.ArgumentParser(description="Stream generated text token by token, with latency metrics")
+    parser.add_argument("model", help=f"Model path or Hub id, or {' / '.join(TINY_MODELS)} (random, offline)")
+    parser.add_argument("prompt", nargs="?", default=None, help="Prompt text (or --canary)")
+    parser.add_argument("--canary", choices=sorted(CANARY_PROMPTS), default=None, help="Use a canary prompt")
+    parser.add_argument("--max-new-tokens", type=int, default=None,
+                        help="Tokens to generate (default: 512 for gpt2, 1024 for llama)")
+    parser.add_argument("--metrics", type=Path, default=None, help="Append each request's timings to this JSONL")
+    parser.add_argument("--ui", action="store_true", help="Launch a Gradio generate tab instead")
+    parser.add_argument("--check-decoder", action="store_true",
+                        help="Stream multi-byte text through the model's tokenizer and byte-chunk "
+                             "tokenizers one token at a time, and confirm it joins to decode()")
+    parser.add_argument("--device", default=None, help="Device (default: cuda if available, else cpu)")
+    parser.add_argument("--dtype", choices=["auto", "float32", "float16", "bfloat16"], default="auto",
+                        help="Weights dtype (default: float16 on cuda, float32 on cpu)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    if not (args.ui or args.check_decoder) and (args.prompt is None) == (args.canary is None):
+        print("ERROR: give a prompt or --canary (or --ui)")
+        sys.exit(1)
+
+    model, tokenizer = load_model(args.model, device=args.device, dtype=args.dtype)
+    if args.check_decoder:
+        tokenizers = {args.model: tokenizer, **{f"{w}-byte chunks": _ByteChunkTokenizer(w) for w in range(1, 5)}}
+        failed = {name: check_decoder(tok) for name, tok in tokenizers.items()}
+        for name, texts in failed.items():
+            print(f"  {'✗' if texts else '✓'} {name}" + (f": {texts}" if texts else ""))
+        if any(failed.values()):
+            print("ERROR: streamed text differs from tokenizer.decode")
+            sys.exit(1)
+        return
+    max_new_tokens = args.max_new_tokens or MAX_NEW_TOKENS[prompt_style(tokenizer)]
+    if args.ui:
+        launch_ui(model, tokenizer, args.model, max_new_tokens, args.metrics)
+        return
+
+    prompt = args.prompt if args.prompt is not None else CANARY_PROMPTS[args.canary]
+    stats = StreamStats()
+    shown = ""
+    for text in stream_generate(model, tokenizer, prompt, max_new_tokens=max_new_tokens, stats=stats):
+        print(text[len(shown):], end="", flush=True)
+        shown = text
+    print(f"\n\n{stats}", file=sys.stderr)
+    if args.metrics:
+        append_metrics(args.metrics, stats, model=args.model, canary=args.canary)
+        print(f"→ {args.metrics}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Read posts straight from a Substack export archive (.zip), without unpacking it.
+
+A Substack export holds posts.csv (one metadata row per post) and
+posts/<post_id>.html (each post's body).  iter_posts() joins every post with
+its CSV row and converts the HTML into the markdown a copy-pasted Substack post
+has — linked images with captions, [N](...#footnote-N-...) references and a
+footnote section of [N](...#footnote-anchor-N-...) definitions — which is what
+preprocess() expects.  Title, subtitle and date go into YAML frontmatter,
+which preprocess() strips.
+
+Members are read one at a time, so memory stays bounded by the largest post.
+
+Used by preprocess.py (pass an export .zip instead of .md files).
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import re
+import zipfile
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Iterator
+
+POSTS_CSV = "posts.csv"
+
+# Tags whose whole subtree carries no essay text
+_SKIP_TAGS = {"script", "style", "svg", "button", "form", "iframe", "noscript"}
+
+# Substack widgets: subscribe/share buttons, embeds, audio players
+_SKIP_CLASSES = {
+    "subscription-widget-wrap", "subscription-widget", "button-wrapper",
+    "share-dialog", "embedded-post-wrap", "native-audio-embed", "digest-post-embed",
+}
+
+_HEADINGS = {f"h{n}": n for n in range(1, 7)}
+_BLOCK_TAGS = {"p", "li", "figcaption", "pre", *_HEADINGS}
+_CONTAINER_TAGS = {"div", "blockquote", "ul", "ol", "figure"}
+_VOID_TAGS = {"img", "br", "hr", "source", "input", "meta", "link", "wbr"}
+_EMPHASIS = {"em": "*", "i": "*", "strong": "**", "b": "**"}
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+class _MarkdownConverter(HTMLParser):
+    """Substack post HTML -> markdown blocks (paragraphs, headings, items, figures)."""
+
+    def __init__(self, post_url: str, post_id: str):
+        super().__init__(convert_charrefs=True)
+        self.post_url = post_url
+        self.post_id = post_id
+        self.blocks: list[str] = []
+        self._inline: list[str] = []
+        self._stack: list[tuple[str, str, str]] = []  # (tag, role, href) of open elements
+        self._skip_depth = 0
+        self._quote_depth = 0
+        self._lists: list[list] = []  # [ordered, next number] per open list
+        self._item_marker = ""
+        self._pre = False
+        self._figure: dict | None = None
+        self._capture: list[str] | None = None  # footnote number being read
+        self._in_footnotes = False
+
+    # ── output ───────────────────────────────────────────────────────────
+
+    def _emit(self, text: str) -> None:
+        if not self._pre:
+            text = "\n".join(" ".join(line.split()) for line in text.split("\n"))
+        text = text.strip()
+        if not text:
+            return
+        if self._item_marker:
+            text = self._item_marker + text
+            self._item_marker = ""
+        if self._quote_depth:
+            prefix = "> " * self._quote_depth
+            text = "\n".join(prefix + line for line in text.split("\n"))
+        self.blocks.append(text)
+
+    def _flush(self, prefix: str = "") -> None:
+        text = "".join(self._inline)
+        self._inline = []
+        if text.strip():
+            self._emit(prefix + text)
+
+    # ── parser callbacks ─────────────────────────────────────────────────
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+
+        if self._skip_depth:
+            if tag not in _VOID_TAGS:
+                self._skip_depth += 1
+            return
+        if tag in _SKIP_TAGS or classes & _SKIP_CLASSES:
+            if tag not in _VOID_TAGS:
+                self._skip_depth = 1
+            return
+
+        if tag in _BLOCK_TAGS or tag in _CONTAINER_TAGS:
+            if tag != "figcaption":
+                self._flush()
+
+        role = ""
+        href = attrs.get("href") or ""
+        if tag == "blockquote":
+            self._quote_depth += 1
+        elif tag in ("ul", "ol"):
+            self._lists.append([tag == "ol", 1])
+        elif tag == "li" and self._lists:
+            ordered, n = self._lists[-1]
+            self._item_marker = f"{n}. " if ordered else "* "
+            self._lists[-1][1] += 1
+        elif tag == "pre":
+            self._pre = True
+        elif tag == "figure":
+            self._figure = {"href": "", "src": "", "alt": "", "caption": []}
+            role = "figure"
+        elif tag == "figcaption":
+            role = "caption"
+        elif tag == "a" and classes & {"footnote-anchor", "footnote-number"}:
+            role = "footnote-ref" if "footnote-anchor" in classes else "footnote-def"
+            self._capture = []
+        elif tag == "a" and self._figure is not None:
+            self._figure["href"] = self._figure["href"] or href
+        elif tag == "a" and href:
+            role = "link"
+            self._inline.append("[")
+        elif tag in _EMPHASIS:
+            self._inline.append(_EMPHASIS[tag])
+        elif tag == "code" and not self._pre:
+            self._inline.append("`")
+        elif tag == "img":
+            src, alt = attrs.get("src") or "", attrs.get("alt") or ""
+            if self._figure is not None:
+                self._figure["src"] = self._figure["src"] or src
+                self._figure["alt"] = self._figure["alt"] or alt
+            elif src:
+                self._inline.append(f"![{alt}]({src})")
+        elif tag == "br":
+            self._inline.append("\n")
+        elif tag == "hr":
+            self._emit("* * *")
+
+        if tag not in _VOID_TAGS:
+            self._stack.append((tag, role, href))
+
+    def handle_endtag(self, tag):
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+        if tag in _VOID_TAGS or all(t != tag for t, _, _ in self._stack):
+            return
+        # Close anything left open inside this element (sloppy HTML)
+        while self._stack:
+            open_tag, role, href = self._stack.pop()
+            self._close(open_tag, role, href)
+            if open_tag == tag:
+                break
+
+    def _close(self, tag: str, role: str, href: str) -> None:
+        if role in ("footnote-ref", "footnote-def"):
+            n = "".join(self._capture or []).strip()
+            self._capture = None
+            if role == "footnote-ref":
+                self._inline.append(f"[{n}]({self.post_url}#footnote-{n}-{self.post_id})")
+            else:
+                self._flush()
+                if not self._in_footnotes:
+                    self._emit("* * *")  # Substack rules off the footnote section
+                    self._in_footnotes = True
+                self._emit(f"[{n}]({self.post_url}#footnote-anchor-{n}-{self.post_id})")
+        elif role == "figure":
+            fig, self._figure = self._figure, None
+            if fig and fig["src"]:
+                # Copy-paste shape: caption glued to the linked image, on one line
+                caption = " ".join("".join(fig["caption"]).split())
+                self._emit(f"[![{fig['alt']}]({fig['src']})]({fig['href'] or fig['src']}){caption}")
+        elif role == "link":
+            self._inline.append(f"]({href})")
+        elif tag in _EMPHASIS:
+            self._inline.append(_EMPHASIS[tag])
+        elif tag == "code" and not self._pre:
+            self._inline.append("`")
+        elif tag == "pre":
+            code = "".join(self._inline).strip("\n")
+            self._inline = []
+            self._emit("```\n" + code + "\n```")
+            self._pre = False
+        elif tag in _HEADINGS:
+            self._flush("#" * _HEADINGS[tag] + " ")
+        elif tag == "blockquote":
+            self._flush()
+            self._quote_depth -= 1
+        elif tag in ("ul", "ol"):
+            self._flush()
+            self._lists.pop()
+        elif tag in _BLOCK_TAGS or tag in _CONTAINER_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._capture is not None:
+            self._capture.append(data)
+        elif self._figure is not None:
+            if any(role == "caption" for _, role, _ in self._stack):
+                self._figure["caption"].append(data)
+        else:
+            self._inline.append(data if self._pre else _SPACE_RE.sub(" ", data))
+
+    def close(self):
+        super().close()
+        while self._stack:
+            self._close(*self._stack.pop())
+        self._flush()
+
+
+def html_to_markdown(html: str, post_url: str = "", post_id: str = "0") -> str:
+    """Convert one post's HTML body to copy-paste-shaped Substack markdown."""
+    converter = _MarkdownConverter(post_url, post_id)
+    converter.feed(html)
+    converter.close()
+    return "\n\n".join(converter.blocks) + "\n"
+
+
+def _frontmatter(row: dict) -> str:
+    lines = ["---"]
+    for key in ("title", "subtitle", "post_date", "type", "audience"):
+        value = (row.get(key) or "").replace("\n", " ").strip()
+        if value:
+            lines.append(f"{key}: {value}")
+    lines.append("---")
+    return "\n".join(lines) + "\n\n"
+
+
+def read_metadata(zf: zipfile.ZipFile) -> dict[str, dict]:
+    """posts.csv rows keyed by post_id ("<numeric id>.<slug>")."""
+    names = [n for n in zf.namelist() if Path(n).name == POSTS_CSV]
+    if not names:
+        raise ValueError(f"{zf.filename}: no {POSTS_CSV} (is this a Substack export?)")
+    with zf.open(names[0]) as f:
+        reader = csv.DictReader(io.TextIOWrapper(f, encoding="utf-8", newline=""))
+        return {row["post_id"]: row for row in reader if row.get("post_id")}
+
+
+def iter_posts(archive: Path, include_drafts: bool = False) -> Iterator[tuple[str, str, str]]:
+    """Yield (member name, slug, markdown) for each post in a Substack export.
+
+    Posts are yielded in posts.csv order; unpublished drafts are skipped unless
+    include_drafts is set, as are rows whose HTML file is missing.
+    """
+    with zipfile.ZipFile(archive) as zf:
+        metadata = read_metadata(zf)
+        members = {Path(n).name: n for n in zf.namelist() if n.endswith(".html")}
+        for post_id, row in metadata.items():
+            if not include_drafts and (row.get("is_published") or "").lower() != "true":
+                continue
+            member = members.get(f"{post_id}.html")
+            if member is None:
+                continue
+            numeric_id, _, slug = post_id.partition(".")
+            slug = slug or numeric_id
+            html = zf.read(member).decode("utf-8")
+            body = html_to_markdown(html, f"https://substack.com/p/{slug}", numeric_id)
+            yield member, slug, _frontmatter(row) + body
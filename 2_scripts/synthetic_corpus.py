@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Seeded synthetic Substack corpus for benchmarks and pipeline dry runs.
+
+The real essays aren't in the repo, so benchmarks run on generated text
+with the same shapes: raw Substack exports (frontmatter, date line, linked
+and bare images, inline links, footnote anchors and definitions,
+share/subscribe boilerplate, section rules, endmatter), the cleaned
+essays, a prompts.md, and Llama and GPT-2 pair files split into train and
+val.  The same seed always gives the same bytes.
+
+write_corpus() lays the files out like the repo's 1_data/ tree:
+
+    OUT/1_data/raw/{slug}.md                 raw exports (3/4 essays, 1/4 Notes)
+    OUT/1_data/cleaned/{slug}_clean.md       preprocess.preprocess() of each
+    OUT/1_data/pairs/prompts.md              train prompts (prompts_to_llama.py's input)
+    OUT/1_data/pairs/{llama,gpt2}_{train,val}.md
+    OUT/1_data/corpus.json                   parameters and counts
+
+Pairs follow the tier rules: tier 1 rough draft → essay, tier 2 thesis →
+essay, tier 3 opening paragraph → the rest, tier 4 summary → Note.  Val
+pairs come from their own essays.  GPT-2 pairs skip tier 1 and keep the
+leading paragraphs that fit 1,024 tokens, estimated from word counts (so
+no tokenizer is needed).  Everything is written as it is generated, so
+100k essays don't have to fit in memory.
+
+Usage:
+    python synthetic_corpus.py /tmp/corpus                   # 1,000 essays, seed 0
+    python synthetic_corpus.py /tmp/corpus --essays 100000   # large corpus
+    python synthetic_corpus.py /tmp/corpus --seed 7 --val 0.2
+    python synthetic_corpus.py /tmp/corpus --profile         # time generation vs. cleaning (profiling.py)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from corpus_store import format_prompt
+from pairs_file import RULE, format_header, format_pair, render_pairs
+from preprocess import preprocess
+
+LLAMA_HEADERS = {
+    "train": "# Llama Training Pairs\n\nSynthetic pairs from synthetic_corpus.py.",
+    "val": "# Llama Validation Pairs\n\nHoldout pairs for evaluation. These are NOT used for training.",
+}
+GPT2_HEADERS = {
+    "train": "# GPT-2 Training Pairs\n\nSynthetic pairs from synthetic_corpus.py, cut to fit 1,024 tokens.",
+    "val": "# GPT-2 Validation Pairs\n\nHoldout pairs for evaluation. These are NOT used for training.",
+}
+PROMPTS_HEADER = "# Prompts\n\nSynthetic prompts from synthetic_corpus.py."
+
+GPT2_MAX = 1024
+SEPARATOR_TOKENS = 4  # "\n\n---\n\n"
+
+
+WORDS = (
+    "the voice of an essay lives in what gets cut and what gets kept, how a "
+    "paragraph earns its ending, the unexpected word that turns out to be the "
+    "right word, class immigrant family technology propaganda conformity "
+    "writing draft — “quoted” it’s 2024 ... 42% *emphasis* _aside_"
+).split()
+
+
+def synthetic_essay(n_paragraphs: int, seed: int = 0, short: bool = False) -> str:
+    """Seeded essay of n paragraphs with mixed lengths and trailing-space quirks.
+
+    short=True gives Notes-style one-line paragraphs, where the per-paragraph
+    sum-of-parts estimate drifts furthest from the joined token count.
+    """
+    rng = random.Random(seed)
+    paragraphs = []
+    for _ in range(n_paragraphs):
+        sentences = []
+        for _ in range(1 if short else rng.randint(1, 6)):
+            words = rng.choices(WORDS, k=rng.randint(2, 6) if short else rng.randint(4, 24))
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", "?", "!", ":"]))
+        para = " ".join(sentences)
+        if rng.random() < 0.05:
+            para += " "  # stray trailing whitespace forces the slow path
+        paragraphs.append(para)
+    return "\n\n".join(paragraphs)
+
+
+def synthetic_raw_essay(n_paragraphs: int, seed: int = 0) -> str:
+    """Seeded raw Substack export: frontmatter, date, links, images, footnotes,
+    bare URLs, share/subscribe boilerplate, section breaks and endmatter."""
+    rng = random.Random(seed)
+    slug = f"https://example.substack.com/p/essay-{seed}"
+    lines = ["---", f"title: Essay {seed}", "---", "", "Feb 23, 2024", ""]
+    notes = 0
+    for i in range(n_paragraphs):
+        roll = rng.random()
+        if roll < 0.04:
+            lines.append(f"[![](https://cdn.example.com/img{i}.png)](https://cdn.example.com/img{i}.png)Caption {i}")
+        elif roll < 0.06:
+            lines.append(f"![alt {i}](https://cdn.example.com/img{i}.jpg)")
+        elif roll < 0.08:
+            lines.append(rng.choice(["Subscribe", "Share", "Thanks for reading! Subscribe for free.", "Like"]))
+        elif roll < 0.10:
+            lines.append(rng.choice(["* * *", "---", "___"]))
+        elif roll < 0.12:
+            lines.append(f"https://example.com/ref/{i}")
+        else:
+            para = synthetic_essay(1, seed=seed * 100_003 + i)
+            words = para.split(" ")
+            if rng.random() < 0.3:
+                k = rng.randrange(len(words))
+                words[k] = f"[{words[k]}](https://example.com/{i})"
+            if rng.random() < 0.1:
+                words.append(f"see https://example.com/inline/{i}")
+            if rng.random() < 0.15:
+                notes += 1
+                words[-1] += f"[{notes}]({slug}#footnote-{notes}-{seed})"
+            lines.append(" ".join(words))
+        lines.append("")
+    lines += ["* * *", "", "_Thanks to early readers._", ""]
+    for n in range(1, notes + 1):
+        lines += [f"[{n}]({slug}#footnote-anchor-{n}-{seed})", "", f"Footnote {n} with [a link](https://example.com/fn{n}).", ""]
+    return "\n".join(lines)
+
+
+def synthetic_pairs_file(n_pairs: int, seed: int = 0) -> str:
+    """Seeded llama_train.md-shaped file: header, then n tiered prompt/response pairs."""
+    rng = random.Random(seed)
+    pairs = [{
+        "name": f"{i:05d}-synthetic-pair",
+        "tier": rng.randint(1, 4),
+        "prompt": synthetic_essay(1, seed=seed + 2 * i, short=True),
+        "response": synthetic_essay(rng.randint(1, 3), seed=seed + 2 * i + 1),
+    } for i in range(n_pairs)]
+    return render_pairs("# Synthetic pairs\n\nGenerated by synthetic_corpus.py", pairs)
+
+
+# ── corpus ───────────────────────────────────────────────────────────────
+
+def _estimate_tokens(text: str) -> int:
+    return len(text.split()) * 4 // 3 + 1
+
+
+def synthetic_post(i: int, seed: int = 0) -> dict:
+    """One seeded post: {"slug", "raw", "cleaned", "tier", "prompt", "response", "roll"}.
+
+    roll is a number in [0, 1) drawn for the post; write_corpus puts posts
+    with roll < its val fraction in val.
+    """
+    rng = random.Random(f"{seed}:{i}")
+    note = rng.random() < 0.25
+    n_paragraphs = rng.randint(1, 4) if note else rng.randint(6, 30)
+    words = [w for w in (re.sub(r"[^a-z0-9]", "", w.lower()) for w in WORDS) if w]
+    slug = f"{i:05d}-" + "-".join(rng.sample(words, 3))
+    with profiling.span("synthetic_corpus.generate"):
+        raw = synthetic_raw_essay(n_paragraphs, seed=seed * 1_000_003 + i)
+    cleaned = preprocess(raw).strip()
+    paragraphs = cleaned.split("\n\n")
+
+    if note:
+        tier = 4 if rng.random() < 0.7 else 3
+    else:
+        tier = rng.choices([1, 2, 3], weights=[15, 30, 55])[0]
+    if tier == 3 and len(paragraphs) < 2:  # nothing left to continue after the opening
+        tier = 4 if note else 2
+
+    if tier == 1:
+        # Rough draft: some words dropped, paragraphs run together in pairs
+        draft = [" ".join(w for w in p.split() if rng.random() > 0.15) for p in paragraphs]
+        prompt = "\n\n".join(" ".join(draft[k:k + 2]) for k in range(0, len(draft), 2))
+        response = cleaned
+    elif tier == 2:
+        prompt = "Write an essay arguing: " + rng.choice(paragraphs).split(". ")[0].rstrip(".") + "."
+        response = cleaned
+    elif tier == 3:
+        # The opening is the prompt; stripping it from the essay leaves the rest
+        prompt, response = paragraphs[0], "\n\n".join(paragraphs[1:])
+    else:
+        prompt = "Summary: " + " ".join(rng.choices(words, k=rng.randint(8, 20))) + "."
+        response = cleaned
+    return {"slug": slug, "raw": raw, "cleaned": cleaned, "tier": tier,
+            "prompt": prompt, "response": response, "roll": rng.random()}
+
+
+def gpt2_response(prompt: str, response: str) -> str:
+    """The leading paragraphs of response that fit GPT-2's window (word-count estimate)."""
+    budget = GPT2_MAX - _estimate_tokens(prompt) - SEPARATOR_TOKENS
+    kept = []
+    for para in response.split("\n\n"):
+        budget -= _estimate_tokens(para)
+        if budget < 0:
+            break
+        kept.append(para)
+    return "\n\n".join(kept)
+
+
+class _PairWriter:
+    """Streams a pairs file with exactly the bytes pairs_file.render_pairs would give."""
+
+    def __init__(self, path: Path, header: str):
+        self.header = header
+        self.count = 0
+        self.f = open(path, "w", encoding="utf-8")
+        self.f.write(format_header(header))
+
+    def add(self, pair: dict) -> None:
+        self.f.write(("\n" if self.count else "") + format_pair(pair) + RULE)
+        self.count += 1
+
+    def close(self) -> None:
+        if not self.count:
+            self.f.seek(0)
+            self.f.truncate()
+            self.f.write(render_pairs(self.header, []))
+        self.f.close()
+
+
+def write_corpus(root: Path, n_essays: int, seed: int = 0, val_fraction: float = 0.1,
+                 progress: bool = False) -> dict:
+    """Generate the corpus under root/1_data/ (see the module docstring); returns corpus.json's dict."""
+    data = root / "1_data"
+    raw_dir, cleaned_dir, pairs_dir = data / "raw", data / "cleaned", data / "pairs"
+    for d in (raw_dir, cleaned_dir, pairs_dir):
+        d.mkdir(parents=True, exist_ok=True)
+
+    writers = {}
+    for split in ("train", "val"):
+        writers["llama", split] = _PairWriter(pairs_dir / f"llama_{split}.md", LLAMA_HEADERS[split])
+        writers["gpt2", split] = _PairWriter(pairs_dir / f"gpt2_{split}.md", GPT2_HEADERS[split])
+    prompts = open(pairs_dir / "prompts.md", "w", encoding="utf-8")
+    prompts.write(PROMPTS_HEADER + "\n")
+
+    raw_bytes = 0
+    tiers = {t: 0 for t in (1, 2, 3, 4)}
+    start = time.perf_counter()
+    try:
+        for i in range(n_essays):
+            post = synthetic_post(i, seed)
+            (raw_dir / f"{post['slug']}.md").write_text(post["raw"], encoding="utf-8")
+            (cleaned_dir / f"{post['slug']}_clean.md").write_text(post["cleaned"] + "\n", encoding="utf-8")
+            raw_bytes += len(post["raw"].encode("utf-8"))
+            tiers[post["tier"]] += 1
+
+            split = "val" if post["roll"] < val_fraction else "train"
+            pair = {"name": post["slug"], "tier": post["tier"],
+                    "prompt": post["prompt"], "response": post["response"]}
+            writers["llama", split].add(pair)
+            if post["tier"] != 1:
+                writers["gpt2", split].add({**pair, "response": gpt2_response(post["prompt"], post["response"])})
+            if split == "train":
+                prompts.write("\n" + format_prompt(post["slug"], {"tier": post["tier"], "prompt": post["prompt"]}))
+
+            if progress and (i + 1) % 1000 == 0:
+                print(f"  {i + 1}/{n_essays} essays ({time.perf_counter() - start:.0f}s)", file=sys.stderr)
+    finally:
+        prompts.close()
+        for w in writers.values():
+            w.close()
+
+    summary = {
+        "essays": n_essays,
+        "seed": seed,
+        "val_fraction": val_fraction,
+        "raw_bytes": raw_bytes,
+        "tiers": {str(t): n for t, n in tiers.items()},
+        "pairs": {f"{model}_{split}": w.count for (model, split), w in writers.items()},
+    }
+    (data / "corpus.json").write_text(json.dumps(summary, indent=1) + "\n", encoding="utf-8")
+    return summary
+
+
+# ── main ─────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a seeded synthetic Substack corpus")
+    parser.add_argument("out", type=Path, help="Directory to create 1_data/ in")
+    parser.add_argument("--essays", type=int, default=1000, help="Number of posts (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--val", type=float, default=0.1, help="Fraction of posts held out for val (default: 0.1)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    if (args.out / "1_data").exists() and any((args.out / "1_data").iterdir()):
+        print(f"ERROR: {args.out / '1_data'} already exists and isn't empty")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    summary = write_corpus(args.out, args.essays, args.seed, args.val, progress=True)
+    print(f"Wrote {summary['essays']} posts ({summary['raw_bytes'] / 1e6:.1f} MB raw) to {args.out / '1_data'} "
+          f"in {time.perf_counter() - start:.1f}s")
+    print("  tiers: " + ", ".join(f"T{t}: {n}" for t, n in summary["tiers"].items()))
+    print("  pairs: " + ", ".join(f"{name}: {n}" for name, n in summary["pairs"].items()))
+
+
+if __name__ == "__main__":
+    main()
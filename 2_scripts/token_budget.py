@@ -20,6 +20,8 @@ Usage:
     # Mode 3: cut with prompt lookup
     python token_budget.py 1_data/cleaned/essay.md --cut --prompts
     python token_budget.py 1_data/cleaned/ --cut --prompts    # batch: all essays with prompts
+    python token_budget.py 1_data/cleaned/ --prompts --store  # prompts from the corpus store
+    python token_budget.py 1_data/cleaned/ --cut --prompts --profile  # time each step (profiling.py)
 
 The separator between prompt and response in GPT-2 format is "\\n\\n---\\n\\n"
 (~4 tokens), which is included in the budget automatically.
@@ -30,6 +32,7 @@ from __future__ import annotations
 import argparse
 import re
 import sys
+from bisect import bisect_left
 from pathlib import Path
 
 try:
@@ -39,12 +42,20 @@ except ImportError:
     print("ERROR: tiktoken required. Install with: pip install tiktoken")
     sys.exit(1)
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from slug_index import SlugIndex
+from token_cache import (PARAGRAPH_ADDITIVE, TokenCache, count_tokens, joins_exactly, separator_tokens,
+                         shared_cache)
+
 REPO_ROOT = Path(__file__).resolve().parent.parent
 PROMPTS_FILE = REPO_ROOT / "1_data" / "pairs" / "prompts.md"
+DEFAULT_STORE = REPO_ROOT / "1_data" / "corpus.sqlite3"  # corpus_store.py
 
 GPT2_MAX = 1024
 SEPARATOR = "\n\n---\n\n"
 SEPARATOR_TOKENS = len(enc.encode(SEPARATOR))
+PARAGRAPH_SEP_TOKENS = len(enc.encode("\n\n"))
 
 
 def parse_prompts_file(path: Path) -> dict[str, dict]:
@@ -55,7 +66,11 @@ def parse_prompts_file(path: Path) -> dict[str, dict]:
         tier: 3
         Prompt text here...
     """
-    text = path.read_text(encoding="utf-8")
+    return parse_prompts_text(path.read_text(encoding="utf-8"))
+
+
+def parse_prompts_text(text: str) -> dict[str, dict]:
+    """parse_prompts_file() for prompts.md text already in memory."""
     blocks = re.split(r"\n(?=## )", text)
 
     prompts = {}
@@ -79,15 +94,167 @@ def parse_prompts_file(path: Path) -> dict[str, dict]:
     return prompts
 
 
-def match_prompt(filename: str, prompts: dict[str, dict]) -> tuple[str, dict] | None:
+def match_prompt(filename: str, prompts: dict[str, dict],
+                 index: SlugIndex | None = None) -> tuple[str, dict] | None:
     """Find the prompt entry whose slug appears in the filename.
 
+    The first slug in prompts.md order wins.  Pass a SlugIndex built over
+    list(prompts) and the filenames when matching many files.
+
     Returns (slug, entry_dict) or None.
     """
-    for slug, entry in prompts.items():
-        if slug in filename:
-            return slug, entry
-    return None
+    index = index or SlugIndex(list(prompts), [filename])
+    slug = index.first_slug(filename)
+    return (slug, prompts[slug]) if slug is not None else None
+
+
+class ParagraphTokens:
+    """Token layout of a text split on blank lines, encoding as little as possible.
+
+    Counts come from the shared token cache first.  On a miss, the whole
+    text or a paragraph prefix is summed from the paragraphs' own counts
+    when its paragraphs are stripped (token_cache.joins_exactly), so editing
+    one paragraph only encodes that paragraph.  Otherwise, once the whole
+    text has been encoded (for its total), counts are read off a byte-offset
+    table of the full encoding instead of re-encoding slices; before that a
+    paragraph or prefix is encoded on its own, so a cut encodes about
+    the budget's worth of text.  BPE pre-tokenization only agrees
+    between a slice and the full text when the slice edges fall on token
+    boundaries and aren't whitespace (whitespace runs merge across the
+    separator), so anything else is encoded on its own.  Counts are
+    therefore always exactly ``len(enc.encode(slice))``.
+
+    The offset table is filled lazily, so a cut near the start of a long
+    essay only walks the tokens up to the cut.
+    """
+
+    _TABLE_CHUNK = 256
+
+    def __init__(self, text: str, cache: TokenCache | None = None):
+        self.text = text
+        self.paragraphs = text.split("\n\n")
+        self.cache = cache or shared_cache()
+        self._tokens: list[int] | None = None
+        self._starts = [0]  # byte offset where each token starts, grown on demand
+        self._spans: list[tuple[int, int]] = []  # (start, end) byte span per paragraph
+
+    @property
+    def tokens(self) -> list[int]:
+        """Full encoding of the text, computed on first use."""
+        if self._tokens is None:
+            with profiling.span("tokenize.gpt2"):
+                self._tokens = enc.encode(self.text)
+            profiling.count("tokens_encoded", len(self._tokens))
+        return self._tokens
+
+    @property
+    def total(self) -> int:
+        """Tokens in the whole text."""
+        return self._cached(self.text, lambda: self._joined(len(self.paragraphs)) or len(self.tokens))
+
+    def _cached(self, text: str, compute) -> int:
+        n = self.cache.lookup(enc.name, text)
+        if n is None:
+            n = compute()
+            self.cache.store(enc.name, text, n)
+        return n
+
+    def _joined(self, k: int) -> int | None:
+        """Tokens in the first k paragraphs from their own counts, or None where that isn't exact."""
+        if k > 1 and enc.name in PARAGRAPH_ADDITIVE and joins_exactly(self.paragraphs[:k]):
+            return sum(self.paragraph_tokens(i) for i in range(k)) + (k - 1) * separator_tokens(enc.name)
+        return None
+
+    def _span(self, i: int) -> tuple[int, int]:
+        while len(self._spans) <= i:
+            start = self._spans[-1][1] + 2 if self._spans else 0
+            para = self.paragraphs[len(self._spans)]
+            self._spans.append((start, start + len(para.encode("utf-8"))))
+        return self._spans[i]
+
+    def _token_index(self, offset: int) -> int | None:
+        """Index of the token starting at a byte offset, or None if it falls mid-token."""
+        tokens = self.tokens
+        starts = self._starts
+        while starts[-1] < offset and len(starts) <= len(tokens):
+            done = len(starts) - 1
+            for token_bytes in enc.decode_tokens_bytes(tokens[done:done + self._TABLE_CHUNK]):
+                starts.append(starts[-1] + len(token_bytes))
+        i = bisect_left(starts, offset)
+        if i < len(starts) and starts[i] == offset:
+            return i
+        return None
+
+    def _span_tokens(self, start: int, end: int) -> int | None:
+        """Token count between two byte offsets, or None if either isn't a token boundary."""
+        first = self._token_index(start)
+        last = self._token_index(end)
+        if first is None or last is None:
+            return None
+        return last - first
+
+    def _encode_paragraph(self, i: int) -> int:
+        para = self.paragraphs[i]
+        # The offset table only pays off once the full encoding exists
+        if self._tokens is not None and para and not para[0].isspace() and not para[-1].isspace():
+            n = self._span_tokens(*self._span(i))
+            if n is not None:
+                return n
+        n = len(enc.encode(para))
+        profiling.count("tokens_encoded", n)
+        return n
+
+    def _encode_prefix(self, k: int, prefix: str) -> int:
+        n = self._joined(k)
+        if n is not None:
+            return n
+        last = self.paragraphs[k - 1]
+        # As for paragraphs: a budget-sized prefix is cheaper to encode than the whole essay
+        if self._tokens is not None and last and not last[-1].isspace():
+            n = self._span_tokens(0, self._span(k - 1)[1])
+            if n is not None:
+                return n
+        n = len(enc.encode(prefix))
+        profiling.count("tokens_encoded", n)
+        return n
+
+    def paragraph_tokens(self, i: int) -> int:
+        """Tokens in paragraph i encoded on its own."""
+        return self._cached(self.paragraphs[i], lambda: self._encode_paragraph(i))
+
+    def prefix_tokens(self, k: int) -> int:
+        """Tokens in the first k paragraphs joined with blank lines."""
+        if k <= 0:
+            return 0
+        if k == len(self.paragraphs):
+            return self.total
+        prefix = "\n\n".join(self.paragraphs[:k])
+        return self._cached(prefix, lambda: self._encode_prefix(k, prefix))
+
+    def find_cut_index(self, budget: int) -> int | None:
+        """First paragraph whose sum-of-parts running total exceeds budget."""
+        running = 0
+        for i in range(len(self.paragraphs)):
+            if i > 0:
+                running += PARAGRAPH_SEP_TOKENS
+            running += self.paragraph_tokens(i)
+            if running > budget:
+                return i
+        return None
+
+    def fit(self, budget: int, cut_idx: int) -> tuple[int, int]:
+        """Back off from cut_idx to the longest paragraph prefix that actually fits.
+
+        BPE boundary effects can make joined text slightly longer than the
+        sum-of-parts estimate.  Returns (paragraphs_kept, tokens); (0, 0) if
+        nothing fits.
+        """
+        while cut_idx > 0:
+            n = self.prefix_tokens(cut_idx)
+            if n <= budget:
+                return cut_idx, n
+            cut_idx -= 1
+        return 0, 0
 
 
 def find_cut_index(essay_text: str, prompt_tokens: int) -> int | None:
@@ -95,28 +262,17 @@ def find_cut_index(essay_text: str, prompt_tokens: int) -> int | None:
 
     Returns None if the full essay fits within budget.
     """
-    overhead = prompt_tokens + SEPARATOR_TOKENS
-    budget = GPT2_MAX - overhead
-
-    paragraphs = essay_text.split("\n\n")
-    running = 0
-
-    for i, para in enumerate(paragraphs):
-        if i > 0:
-            running += len(enc.encode("\n\n"))
-        running += len(enc.encode(para))
-        if running > budget:
-            return i
-
-    return None
+    budget = GPT2_MAX - prompt_tokens - SEPARATOR_TOKENS
+    return ParagraphTokens(essay_text).find_cut_index(budget)
 
 
-def analyze_essay(essay_text: str, prompt_tokens: int) -> None:
+def analyze_essay(essay_text: str, prompt_tokens: int, layout: ParagraphTokens | None = None) -> None:
     """Print paragraph-by-paragraph token counts and mark the cutoff."""
     overhead = prompt_tokens + SEPARATOR_TOKENS
     budget = GPT2_MAX - overhead
 
-    paragraphs = essay_text.split("\n\n")
+    layout = layout or ParagraphTokens(essay_text)
+    paragraphs = layout.paragraphs
     running = 0
     cutoff_hit = False
 
@@ -126,10 +282,10 @@ def analyze_essay(essay_text: str, prompt_tokens: int) -> None:
 
     last_clean_cut = 0
     for i, para in enumerate(paragraphs, 1):
-        para_tokens = len(enc.encode(para))
+        para_tokens = layout.paragraph_tokens(i - 1)
         prev_running = running
         if i > 1:
-            running += len(enc.encode("\n\n"))
+            running += PARAGRAPH_SEP_TOKENS
         running += para_tokens
 
         marker = ""
@@ -152,23 +308,17 @@ def analyze_essay(essay_text: str, prompt_tokens: int) -> None:
         print(f"  Full essay fits! {running} / {budget} tokens used")
 
 
-def cut_essay(essay_text: str, prompt_tokens: int) -> str:
+@profiling.timed("token_budget.cut_essay")
+def cut_essay(essay_text: str, prompt_tokens: int, layout: ParagraphTokens | None = None) -> str:
     """Return the essay truncated to fit GPT-2's token budget."""
-    cut_idx = find_cut_index(essay_text, prompt_tokens)
-    paragraphs = essay_text.split("\n\n")
+    budget = GPT2_MAX - prompt_tokens - SEPARATOR_TOKENS
+    layout = layout or ParagraphTokens(essay_text)
+    cut_idx = layout.find_cut_index(budget)
     if cut_idx is None:
         return essay_text
 
-    # BPE boundary effects can make joined text slightly longer than the
-    # sum-of-parts estimate.  Verify and trim until it actually fits.
-    budget = GPT2_MAX - prompt_tokens - SEPARATOR_TOKENS
-    while cut_idx > 0:
-        result = "\n\n".join(paragraphs[:cut_idx])
-        if len(enc.encode(result)) <= budget:
-            return result
-        cut_idx -= 1
-    return ""
-
+    keep, _ = layout.fit(budget, cut_idx)
+    return "\n\n".join(layout.paragraphs[:keep])
 
 
 def normalize_text(s: str) -> str:
@@ -181,6 +331,93 @@ def normalize_text(s: str) -> str:
     return re.sub(r"\s+", " ", s)
 
 
+# Characters normalize_text rewrites
+_NORMALIZE_MAP = {
+    "\u201c": '"', "\u201d": '"',   # " "
+    "\u2018": "'", "\u2019": "'",   # ' '
+    "\u2014": "--", "\u2013": "-",  # — –
+    "\u2026": "...",                # …
+}
+# Whitespace run | rewritten char | text that normalizes to itself (words
+# joined by single spaces, so a plain sentence is one chunk)
+_PLAIN = r"[^\s\u201c\u201d\u2018\u2019\u2014\u2013\u2026]+"
+_NORMALIZE_CHUNK_RE = re.compile(
+    rf"(\s+)|([\u201c\u201d\u2018\u2019\u2014\u2013\u2026])|{_PLAIN}(?: {_PLAIN})*"
+)
+
+
+class NormalizedEssay:
+    """An essay normalized once, for stripping any number of prompts from it.
+
+    ``normalized`` is normalize_text(text).  ``index_map[k]`` is the position
+    in text of the character that produced normalized character k; a collapsed
+    whitespace run maps to the character after it, since normalize_text only
+    keeps the space once text follows it.  The map is built in one forward
+    pass, and only as far as the deepest match asked for so far.
+    """
+
+    def __init__(self, essay_text: str):
+        self.text = essay_text
+        self.normalized = normalize_text(essay_text)
+        self.index_map: list[int] = []
+        self._chunks = _NORMALIZE_CHUNK_RE.finditer(essay_text)
+        self._pending_space = False
+
+    def map_to(self, end: int) -> list[int]:
+        """Extend index_map to cover the first `end` normalized characters."""
+        index_map = self.index_map
+        while len(index_map) < end:
+            m = next(self._chunks, None)
+            if m is None:
+                break
+            start, stop = m.span()
+            if m.group(1):
+                self._pending_space = bool(index_map)  # leading whitespace is stripped
+                continue
+            if self._pending_space:
+                index_map.append(start)
+                self._pending_space = False
+            if m.group(2):
+                index_map.extend([start] * len(_NORMALIZE_MAP[m.group(2)]))
+            else:
+                index_map.extend(range(start, stop))
+        return index_map
+
+    def original_end(self, end_pos: int) -> int:
+        """Position in text just past the character behind normalized[end_pos - 1].
+
+        Equivalent to the smallest i with len(normalize_text(text[:i])) >= end_pos,
+        capped at the last character.
+        """
+        if end_pos <= 0:
+            return 0
+        return min(self.map_to(end_pos)[end_pos - 1] + 1, max(len(self.text) - 1, 0))
+
+    @profiling.timed("token_budget.strip_prompt")
+    def strip_prompt(self, prompt_text: str) -> str:
+        """Same result as strip_prompt_from_essay(self.text, prompt_text)."""
+        norm_prompt = normalize_text(prompt_text)
+
+        idx = self.normalized.find(norm_prompt)
+        if idx == -1:
+            return self.text
+
+        orig_pos = self.original_end(idx + len(norm_prompt))
+
+        # Find the next paragraph boundary
+        rest = self.text[orig_pos:]
+        next_para = rest.find("\n\n")
+        if next_para != -1:
+            return rest[next_para:].lstrip("\n")
+        return rest.strip()
+
+
+def normalize_with_map(s: str) -> tuple[str, list[int]]:
+    """normalize_text(s) plus the index map from normalized to original positions."""
+    essay = NormalizedEssay(s)
+    return essay.normalized, essay.map_to(len(essay.normalized))
+
+
 def strip_prompt_from_essay(essay_text: str, prompt_text: str) -> str:
     """Find where the prompt text ends in the essay and return everything after.
 
@@ -188,35 +425,16 @@ def strip_prompt_from_essay(essay_text: str, prompt_text: str) -> str:
     mid-paragraph (e.g., after a title or content warning in the same paragraph).
     Returns from the next paragraph boundary after the match.
     """
-    norm_prompt = normalize_text(prompt_text)
-    norm_essay = normalize_text(essay_text)
+    return NormalizedEssay(essay_text).strip_prompt(prompt_text)
 
-    idx = norm_essay.find(norm_prompt)
-    if idx == -1:
-        return essay_text
-
-    # Find the end position of the prompt in the normalized text
-    end_pos = idx + len(norm_prompt)
 
-    # Map back to original text: count how many characters of normalized text
-    # we've consumed, find the corresponding position in the original
-    norm_count = 0
-    orig_pos = 0
-    for orig_pos, ch in enumerate(essay_text):
-        if norm_count >= end_pos:
-            break
-        # Skip characters that normalize away (extra whitespace)
-        test = normalize_text(essay_text[:orig_pos + 1])
-        norm_count = len(test)
-
-    # Find the next paragraph boundary
-    rest = essay_text[orig_pos:]
-    next_para = rest.find("\n\n")
-    if next_para != -1:
-        return rest[next_para:].lstrip("\n")
-    return rest.strip()
+def strip_prompts_from_essay(essay_text: str, prompt_texts: list[str]) -> list[str]:
+    """strip_prompt_from_essay for several prompts, normalizing the essay once."""
+    essay = NormalizedEssay(essay_text)
+    return [essay.strip_prompt(p) for p in prompt_texts]
 
 
+@profiling.timed("token_budget.file", file=lambda path, *args, **kwargs: path.name)
 def process_file(
     path: Path,
     prompt_tokens: int,
@@ -225,19 +443,21 @@ def process_file(
     tier: int | None = None,
     prompt_text: str | None = None,
 ) -> None:
+    profiling.count_file(path)
     text = path.read_text(encoding="utf-8").strip()
 
     # For Tier 3, strip the opening (prompt) from the essay so we only analyze/cut the continuation
     if prompt_text and tier == 3:
         text = strip_prompt_from_essay(text, prompt_text)
 
-    total = len(enc.encode(text))
+    layout = ParagraphTokens(text)
+    total = layout.total
 
     if do_cut:
         tier_label = f"T{tier}" if tier else ""
         if slug:
             print(f"# {path.name} (slug: {slug}, {tier_label}, prompt: {prompt_tokens} tokens, response: {total} tokens)", file=sys.stderr)
-        print(cut_essay(text, prompt_tokens))
+        print(cut_essay(text, prompt_tokens, layout))
         return
 
     print(f"\n{'=' * 60}")
@@ -246,7 +466,7 @@ def process_file(
         tier_label = f"Tier {tier}" if tier else "Tier ?"
         print(f"  Prompt slug: {slug} | {tier_label} | {prompt_tokens} prompt tokens")
     print(f"{'=' * 60}")
-    analyze_essay(text, prompt_tokens)
+    analyze_essay(text, prompt_tokens, layout)
 
 
 def main():
@@ -260,7 +480,12 @@ def main():
                         help="Output the truncated essay text")
     parser.add_argument("--prompts", action="store_true",
                         help="Mode 3: read prompts from prompts.md, match by slug")
+    parser.add_argument("--store", type=Path, nargs="?", const=DEFAULT_STORE, metavar="DB",
+                        help="With --prompts: read prompts from the corpus store, synced from "
+                             "prompts.md first (default DB: 1_data/corpus.sqlite3)")
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.setup(args)
 
     # Collect files
     files = []
@@ -279,19 +504,30 @@ def main():
 
     # Mode 3: prompt lookup from file
     if args.prompts:
-        if not PROMPTS_FILE.exists():
+        if args.store:
+            from corpus_store import CorpusStore
+
+            with CorpusStore(args.store) as store:
+                store.sync_prompts()
+                prompts = store.prompts()
+        elif not PROMPTS_FILE.exists():
             print(f"ERROR: prompts file not found at {PROMPTS_FILE}", file=sys.stderr)
             sys.exit(1)
-
-        prompts = parse_prompts_file(PROMPTS_FILE)
+        else:
+            prompts = parse_prompts_file(PROMPTS_FILE)
         if not prompts:
             print("ERROR: no prompts found in prompts file.", file=sys.stderr)
             sys.exit(1)
 
+        index = SlugIndex(list(prompts), [f.stem for f in files])
+        for stem, slugs in index.ambiguous_names().items():
+            print(f"WARNING: {stem} contains {len(slugs)} prompt slugs, using {slugs[0]} "
+                  f"(also {', '.join(slugs[1:])})", file=sys.stderr)
+
         matched = 0
         skipped = []
         for f in files:
-            result = match_prompt(f.stem, prompts)
+            result = match_prompt(f.stem, prompts, index)
             if result is None:
                 skipped.append(f.name)
                 continue
@@ -302,7 +538,7 @@ def main():
                 skipped.append(f"{f.name} (empty prompt)")
                 continue
 
-            prompt_tokens = len(enc.encode(prompt_text))
+            prompt_tokens = count_tokens(prompt_text, enc.name)
             process_file(f, prompt_tokens, do_cut=args.cut, slug=slug, tier=entry["tier"], prompt_text=prompt_text)
             matched += 1
 
@@ -313,12 +549,13 @@ def main():
         if matched == 0:
             print("ERROR: no files matched any prompt slugs.", file=sys.stderr)
             sys.exit(1)
+        print(f"\n{shared_cache().summary()}", file=sys.stderr)
         return
 
     # Mode 1 & 2: manual prompt
     prompt_tokens = args.prompt_tokens
     if args.prompt:
-        prompt_tokens = len(enc.encode(args.prompt))
+        prompt_tokens = count_tokens(args.prompt, enc.name)
         if not args.cut:
             print(f"Prompt: {prompt_tokens} tokens")
 
@@ -328,6 +565,7 @@ def main():
 
     for f in files:
         process_file(f, prompt_tokens, do_cut=args.cut)
+    print(f"\n{shared_cache().summary()}", file=sys.stderr)
 
 
 if __name__ == "__main__":
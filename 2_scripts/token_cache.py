@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Persistent token-count cache shared by the data-prep scripts.
+
+Counts are keyed by (encoding name, BLAKE2 hash of the text) in a small SQLite
+file, so rerunning the pipeline after editing one essay only tokenizes the
+paragraphs, prompts and responses that actually changed: under GPT-2's
+encoding a multi-paragraph text is counted from its paragraphs' counts.  Entries carry a
+last-used stamp; when the live data grows past the size budget the least
+recently used rows are evicted.
+
+Library use:
+    from token_cache import count_tokens
+    n = count_tokens(text, "gpt2")
+
+Usage:
+    python token_cache.py              # show cache size and lifetime hit/miss stats
+    python token_cache.py --clear      # drop all cached counts
+    python token_cache.py --profile    # time the stats queries (profiling.py)
+
+Set VOICE_TOKEN_CACHE to a file path to move the cache, or to "off" to keep
+counts in memory for the current run only.
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import profiling
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CACHE_PATH = REPO_ROOT / ".cache" / "token_counts.sqlite3"
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_FLUSH_EVERY = 2000
+
+_encodings: dict = {}
+_separators: dict[str, int] = {}
+
+# Encodings with GPT-2's pre-tokenizer.  In text made of paragraphs that don't
+# start or end in whitespace, joined by blank lines, no pre-token crosses a
+# "\n\n", so the text's count is its paragraphs' counts plus the separators'.
+PARAGRAPH_ADDITIVE = {"gpt2", "r50k_base", "p50k_base"}
+
+
+def get_encoding(name: str):
+    """tiktoken encoding by name, loaded once per process."""
+    if name not in _encodings:
+        import tiktoken
+        _encodings[name] = tiktoken.get_encoding(name)
+    return _encodings[name]
+
+
+def joins_exactly(paragraphs: list[str]) -> bool:
+    """Whether "\n\n".join(paragraphs) counts as the sum of its parts (PARAGRAPH_ADDITIVE)."""
+    return all(p and not p[0].isspace() and not p[-1].isspace() for p in paragraphs)
+
+
+def separator_tokens(encoding: str) -> int:
+    """Tokens a "\n\n" between two paragraphs adds (two "\n" pieces, not the "\n\n" token)."""
+    if encoding not in _separators:
+        e = get_encoding(encoding)
+        _separators[encoding] = len(e.encode("a\n\na")) - 2 * len(e.encode("a"))
+    return _separators[encoding]
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCache:
+    """Token counts keyed by (encoding, text hash), backed by SQLite.
+
+    Lookups hit an in-memory dict first, then the database.  New counts and
+    last-used stamps are buffered and written in batches; call close() (done
+    automatically at exit for the shared cache) to flush and evict.
+    """
+
+    def __init__(self, path: Path | None = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory: dict[tuple[str, bytes], int] = {}
+        self._new: dict[tuple[str, bytes], int] = {}
+        self._touched: set[tuple[str, bytes]] = set()
+        self._db: sqlite3.Connection | None = None
+        if path is not None:
+            self._db = self._open(path)
+
+    @staticmethod
+    def _open(path: Path) -> sqlite3.Connection:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(path, timeout=30)
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")  # only takes effect on a new file
+        db.execute("PRAGMA journal_mode = WAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS counts (
+                encoding  TEXT    NOT NULL,
+                key       BLOB    NOT NULL,
+                tokens    INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (encoding, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS counts_last_used ON counts (last_used);
+            CREATE TABLE IF NOT EXISTS stats (
+                name  TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        return db
+
+    # ── lookups ──────────────────────────────────────────────────────────
+
+    def lookup(self, encoding: str, text: str) -> int | None:
+        """Cached count for text, or None (recorded as a miss)."""
+        k = (encoding, text_key(text))
+        n = self._memory.get(k)
+        if n is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT tokens FROM counts WHERE encoding = ? AND key = ?", k
+            ).fetchone()
+            if row is not None:
+                n = self._memory[k] = row[0]
+        if n is None:
+            self.misses += 1
+            profiling.count("token_cache.misses")
+            return None
+        self.hits += 1
+        profiling.count("token_cache.hits")
+        self._touched.add(k)
+        return n
+
+    def store(self, encoding: str, text: str, tokens: int) -> None:
+        k = (encoding, text_key(text))
+        self._memory[k] = tokens
+        self._new[k] = tokens
+        if len(self._new) + len(self._touched) >= _FLUSH_EVERY:
+            self.flush()
+
+    def count(self, text: str, encoding: str = "gpt2") -> int:
+        """Token count for text, tokenizing only on a cache miss.
+
+        A multi-paragraph text that joins exactly is counted paragraph by
+        paragraph, so after an edit only the changed paragraphs are tokenized.
+        """
+        n = self.lookup(encoding, text)
+        if n is None:
+            paragraphs = text.split("\n\n")
+            if encoding in PARAGRAPH_ADDITIVE and len(paragraphs) > 1 and joins_exactly(paragraphs):
+                n = (sum(self.count(p, encoding) for p in paragraphs)
+                     + (len(paragraphs) - 1) * separator_tokens(encoding))
+            else:
+                with profiling.span(f"tokenize.{encoding}"):
+                    n = len(get_encoding(encoding).encode(text))
+                profiling.count("tokens_encoded", n)
+            self.store(encoding, text, n)
+        return n
+
+    # ── persistence ──────────────────────────────────────────────────────
+
+    def flush(self) -> None:
+        """Write buffered counts and last-used stamps."""
+        if self._db is None:
+            self._new.clear()
+            self._touched.clear()
+            return
+        now = time.time_ns()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO counts (encoding, key, tokens, last_used) VALUES (?, ?, ?, ?)",
+                [(enc, key, n, now) for (enc, key), n in self._new.items()],
+            )
+            self._db.executemany(
+                "UPDATE counts SET last_used = ? WHERE encoding = ? AND key = ?",
+                [(now, enc, key) for enc, key in self._touched - self._new.keys()],
+            )
+        self._new.clear()
+        self._touched.clear()
+
+    def live_bytes(self) -> int:
+        """Bytes of the database file in use (excluding free pages)."""
+        if self._db is None:
+            return 0
+        page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+        free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    def evict(self) -> int:
+        """Drop least recently used rows until live data fits max_bytes."""
+        if self._db is None:
+            return 0
+        used = self.live_bytes()
+        if used <= self.max_bytes:
+            return 0
+        rows = self._db.execute("SELECT COUNT(*) FROM counts").fetchone()[0]
+        # aim a little under the budget so the next run doesn't evict again
+        keep = int(rows * (self.max_bytes * 0.9) / used)
+        with self._db:
+            cur = self._db.execute(
+                "DELETE FROM counts WHERE (encoding, key) IN ("
+                "  SELECT encoding, key FROM counts ORDER BY last_used LIMIT ?)",
+                (rows - keep,),
+            )
+        self._db.execute("PRAGMA incremental_vacuum")
+        self.evictions += cur.rowcount
+        return cur.rowcount
+
+    def close(self) -> None:
+        """Flush, evict past the size budget, and record hit/miss totals."""
+        if self._db is None:
+            return
+        self.flush()
+        self.evict()
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                [("hits", self.hits), ("misses", self.misses), ("evictions", self.evictions)],
+            )
+        self._db.close()
+        self._db = None
+
+    def summary(self) -> str:
+        """One-line hit/miss summary for this process."""
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"token cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+
+# ── shared cache ─────────────────────────────────────────────────────────
+
+_shared: TokenCache | None = None
+
+
+def shared_cache() -> TokenCache:
+    """The process-wide cache, opened on first use and closed at exit."""
+    global _shared
+    if _shared is None:
+        setting = os.environ.get("VOICE_TOKEN_CACHE", "")
+        if setting.lower() == "off":
+            _shared = TokenCache(path=None)
+        else:
+            _shared = TokenCache(Path(setting) if setting else DEFAULT_CACHE_PATH)
+        atexit.register(_shared.close)
+    return _shared
+
+
+def use_cache(cache: TokenCache) -> TokenCache:
+    """Replace the process-wide cache (e.g. a cold in-memory one for benchmarks)."""
+    global _shared
+    _shared = cache
+    return cache
+
+
+def count_tokens(text: str, encoding: str = "gpt2") -> int:
+    """Token count for text under a tiktoken encoding, via the shared cache."""
+    return shared_cache().count(text, encoding)
+
+
+# ── main ─────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the token-count cache")
+    parser.add_argument("--clear", action="store_true", help="Drop all cached counts")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    setting = os.environ.get("VOICE_TOKEN_CACHE", "")
+    if setting.lower() == "off":
+        print("Token cache disabled (VOICE_TOKEN_CACHE=off).")
+        return
+    path = Path(setting) if setting else DEFAULT_CACHE_PATH
+    if not path.exists():
+        print(f"No token cache at {path}")
+        return
+
+    cache = TokenCache(path)
+    db = cache._db
+    if args.clear:
+        with db:
+            db.execute("DELETE FROM counts")
+            db.execute("DELETE FROM stats")
+        db.execute("VACUUM")
+        print(f"Cleared {path}")
+        return
+
+    print(f"Cache: {path}")
+    print(f"  Size: {cache.live_bytes() / 1024:.0f} KB live / {cache.max_bytes / 1024 / 1024:.0f} MB budget")
+    for encoding, rows in db.execute("SELECT encoding, COUNT(*) FROM counts GROUP BY encoding"):
+        print(f"  {encoding}: {rows} entries")
+    stats = dict(db.execute("SELECT name, value FROM stats"))
+    hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+    total = hits + misses
+    rate = hits / total * 100 if total else 0
+    print(f"  Lifetime: {hits} hits, {misses} misses ({rate:.0f}% hit rate), "
+          f"{stats.get('evictions', 0)} evicted")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Pre-tokenized, memory-mapped training datasets.
+
+format_jsonl.py --tokens writes each split as three files next to each other:
+
+    {model}_{split}.bin   — every example's token IDs back to back, little-endian
+                            uint16 (vocab ≤ 65,536, e.g. GPT-2) or uint32 (Llama)
+    {model}_{split}.idx   — uint64 triples per example: (start, length, prompt_len)
+    {model}_{split}.json  — tokenizer name, dtype, vocab size, EOS id, counts
+
+prompt_len is the loss-mask boundary: the number of leading tokens that belong
+to the prompt (GPT-2: prompt + "\\n\\n---\\n\\n"; Llama: the chat-templated user
+turn plus the assistant header).  It is read off the full example's token
+offsets rather than by tokenizing the prompt on its own, as the notebooks do:
+GPT-2 BPE splits the separator's final "\\n\\n" differently once response text
+follows it, which puts the notebook count one token short.
+
+Training loaders open the files with TokenDataset and slice examples without
+tokenizing or copying:
+
+    ds = TokenDataset(Path("1_data/tokens/gpt2_train"))
+    ids, prompt_len = ds[0]               # ids is a memoryview into the mmap
+    x = np.frombuffer(ids, dtype=ds.dtype)     # or torch.frombuffer(...)
+
+Tokenizers are pluggable (load_tokenizer):
+    "gpt2", "cl100k_base", ...            — tiktoken encoding name
+    path/to/tokenizer.json or its folder  — Hugging Face tokenizer file (needs the
+                                            `tokenizers` package); a chat_template in
+                                            tokenizer_config.json is used for Llama
+                                            pairs when jinja2 is installed
+
+Usage:
+    python token_dataset.py 1_data/tokens/gpt2_train     # summary of a written split
+    python token_dataset.py 1_data/tokens/gpt2_train --profile
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import date
+from itertools import accumulate
+from pathlib import Path
+from typing import Callable, Iterable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+
+# array typecodes with the exact widths the file format needs
+_TYPECODES = {"uint16": "H", "uint32": "I"}
+_INDEX_TYPECODE = "Q"
+assert (array("H").itemsize, array("I").itemsize, array("Q").itemsize) == (2, 4, 8)
+
+GPT2_SEPARATOR = "\n\n---\n\n"  # same as format_jsonl.to_gpt2_format
+
+# Llama 3 chat format, used when the tokenizer ships no chat_template
+LLAMA3_BOS = "<|begin_of_text|>"
+LLAMA3_TURN = "<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>"
+LLAMA3_GENERATION_PROMPT = "<|start_header_id|>assistant<|end_header_id|>\n\n"
+
+
+# ── tokenizers ───────────────────────────────────────────────────────────
+
+class Tokenizer:
+    """A tokenizer behind one encode call, plus what the file header records.
+
+    encode_spans(text) → (ids, starts, ends): UTF-8 byte offsets in text where
+    each token starts and ends; they are what place the prompt boundary.
+    """
+
+    def __init__(self, name: str, encode_spans: Callable[[str], tuple[list[int], list[int], list[int]]],
+                 vocab_size: int, eos_id: int | None,
+                 chat_template: str | None = None, bos_token: str = ""):
+        self.name = name
+        self.encode_spans = encode_spans
+        self.vocab_size = vocab_size
+        self.eos_id = eos_id
+        self.chat_template = chat_template
+        self.bos_token = bos_token
+
+    @property
+    def dtype(self) -> str:
+        return "uint16" if self.vocab_size <= 1 << 16 else "uint32"
+
+    def encode(self, text: str) -> list[int]:
+        return self.encode_spans(text)[0]
+
+
+def _token_content(token) -> str | None:
+    """tokenizer_config.json stores special tokens as strings or {"content": ...} dicts."""
+    if isinstance(token, dict):
+        return token.get("content")
+    return token
+
+
+def load_tokenizer(spec: str) -> Tokenizer:
+    """A tiktoken encoding name, or a local tokenizer.json (file or the folder holding it)."""
+    path = Path(spec)
+    if path.is_dir():
+        path = path / "tokenizer.json"
+    if path.suffix == ".json" or path.exists():
+        if not path.exists():
+            raise FileNotFoundError(f"tokenizer file not found: {path}")
+        try:
+            from tokenizers import Tokenizer as HFTokenizer
+        except ImportError:
+            raise ImportError("tokenizer.json files need the tokenizers package: "
+                              "pip install tokenizers") from None
+        hf = HFTokenizer.from_file(str(path))
+        config_path = path.parent / "tokenizer_config.json"
+        config = json.loads(config_path.read_text(encoding="utf-8")) if config_path.exists() else {}
+        eos = _token_content(config.get("eos_token"))
+        template = config.get("chat_template")
+        if isinstance(template, list):  # named templates: take the default one
+            template = next((t["template"] for t in template if t.get("name") == "default"), None)
+
+        def encode_spans(text):
+            # Chat templates spell out BOS themselves; don't let the post-processor add another
+            encoding = hf.encode(text, add_special_tokens=False)
+            starts = [start for start, _ in encoding.offsets]  # character offsets
+            ends = [end for _, end in encoding.offsets]
+            if not text.isascii():
+                byte_at = list(accumulate((len(c.encode("utf-8")) for c in text), initial=0))
+                starts, ends = [byte_at[i] for i in starts], [byte_at[i] for i in ends]
+            return encoding.ids, starts, ends
+
+        return Tokenizer(
+            name=str(path),
+            encode_spans=encode_spans,
+            vocab_size=hf.get_vocab_size(with_added_tokens=True),
+            eos_id=hf.token_to_id(eos) if eos else None,
+            chat_template=template,
+            bos_token=_token_content(config.get("bos_token")) or "",
+        )
+
+    from token_cache import get_encoding
+    enc = get_encoding(spec)
+
+    def encode_spans(text):
+        # Chat markers are plain text to a tiktoken encoding that doesn't define them
+        ids = enc.encode(text, disallowed_special=())
+        ends = list(accumulate(map(len, enc.decode_tokens_bytes(ids))))
+        return ids, [0] + ends[:-1], ends
+
+    return Tokenizer(name=spec, encode_spans=encode_spans, vocab_size=enc.n_vocab, eos_id=enc.eot_token)
+
+
+def render_chat(tok: Tokenizer, messages: list[dict], add_generation_prompt: bool) -> str:
+    """Chat-templated text, as tokenizer.apply_chat_template(..., tokenize=False) gives it."""
+    if tok.chat_template:
+        try:
+            from jinja2.sandbox import ImmutableSandboxedEnvironment
+        except ImportError:
+            raise ImportError("rendering the tokenizer's chat_template needs jinja2: "
+                              "pip install jinja2") from None
+
+        def raise_exception(message):
+            raise ValueError(message)
+
+        env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True)
+        env.globals["raise_exception"] = raise_exception
+        env.globals["strftime_now"] = lambda fmt: date.today().strftime(fmt)
+        return env.from_string(tok.chat_template).render(
+            messages=messages, add_generation_prompt=add_generation_prompt,
+            bos_token=tok.bos_token,
+        )
+
+    text = LLAMA3_BOS + "".join(LLAMA3_TURN.format(**m) for m in messages)
+    return text + (LLAMA3_GENERATION_PROMPT if add_generation_prompt else "")
+
+
+def example_texts(entry: dict, tok: Tokenizer) -> tuple[str, str]:
+    """(full text, prompt part) for a format_jsonl entry of either model."""
+    if "messages" in entry:
+        messages = entry["messages"]
+        return (render_chat(tok, messages, add_generation_prompt=False),
+                render_chat(tok, messages[:1], add_generation_prompt=True))
+    text = entry["text"]
+    prompt, sep, _ = text.partition(GPT2_SEPARATOR)
+    return text, prompt + sep
+
+
+def tokenize_example(entry: dict, tok: Tokenizer) -> tuple[list[int], int, bool]:
+    """(token IDs, prompt_len, exact) for one format_jsonl entry.
+
+    exact is False when a token spans the prompt/response boundary or the
+    chat template renders the prompt differently from the conversation's start.
+    """
+    full, prompt = example_texts(entry, tok)
+    ids, starts, ends = tok.encode_spans(full)
+    if not full.startswith(prompt):
+        return ids, min(len(tok.encode(prompt)), len(ids)), False
+    # Prompt = the tokens that start inside the prompt text; one that runs on
+    # into the response is masked with it
+    limit = len(prompt.encode("utf-8"))
+    prompt_len = bisect_left(starts, limit)
+    return ids, prompt_len, not (prompt_len > 0 and ends[prompt_len - 1] > limit)
+
+
+# ── writing ──────────────────────────────────────────────────────────────
+
+def write_token_dataset(stem: Path, entries: Iterable[dict], tok: Tokenizer) -> dict:
+    """Tokenize format_jsonl entries into stem.bin / stem.idx / stem.json. Returns the header.
+
+    .bin and .idx are written to temporaries and renamed into place, so an
+    interrupted run leaves the previous split readable.
+    """
+    typecode = _TYPECODES[tok.dtype]
+    index = array(_INDEX_TYPECODE)
+    count = tokens = prompt_tokens = inexact = 0
+
+    stem.parent.mkdir(parents=True, exist_ok=True)
+    bin_tmp = stem.with_suffix(".bin.tmp")
+    with open(bin_tmp, "wb") as f, profiling.span("token_dataset.write", file=stem.name):
+        for entry in entries:
+            ids, prompt_len, exact = tokenize_example(entry, tok)
+            inexact += not exact
+            profiling.count("tokens_encoded", len(ids))
+
+            chunk = array(typecode, ids)
+            if sys.byteorder == "big":
+                chunk.byteswap()
+            chunk.tofile(f)
+            index.extend((tokens, len(ids), prompt_len))
+            count += 1
+            tokens += len(ids)
+            prompt_tokens += prompt_len
+
+    if sys.byteorder == "big":
+        index.byteswap()
+    idx_tmp = stem.with_suffix(".idx.tmp")
+    with open(idx_tmp, "wb") as f:
+        index.tofile(f)
+
+    header = {
+        "tokenizer": tok.name,
+        "dtype": tok.dtype,
+        "vocab_size": tok.vocab_size,
+        "eos_id": tok.eos_id,
+        "examples": count,
+        "tokens": tokens,
+        "prompt_tokens": prompt_tokens,
+        "boundary_inexact": inexact,
+    }
+    bin_tmp.replace(stem.with_suffix(".bin"))
+    idx_tmp.replace(stem.with_suffix(".idx"))
+    stem.with_suffix(".json").write_text(json.dumps(header, indent=2) + "\n", encoding="utf-8")
+    return header
+
+
+# ── reading ──────────────────────────────────────────────────────────────
+
+class TokenDataset:
+    """Read-only, zero-copy view of a split written by write_token_dataset().
+
+    ds[i] → (memoryview of token IDs, prompt_len).  Token views are typed
+    ("H"/"I"), so list(ids) gives ints and np/torch.frombuffer() wraps them.
+    """
+
+    def __init__(self, stem: Path):
+        self.stem = stem
+        self.header = json.loads(stem.with_suffix(".json").read_text(encoding="utf-8"))
+        self.dtype = self.header["dtype"]
+        if sys.byteorder == "big":
+            raise OSError("token datasets are little-endian; this reader maps them directly")
+        self._maps: list[mmap.mmap] = []
+        self._views: list[memoryview] = []
+        self._tokens = self._map(stem.with_suffix(".bin"), _TYPECODES[self.dtype])
+        self._index = self._map(stem.with_suffix(".idx"), _INDEX_TYPECODE)
+
+    def _map(self, path: Path, typecode: str) -> memoryview:
+        with open(path, "rb") as f:
+            if path.stat().st_size == 0:
+                return memoryview(b"").cast(typecode)
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(m)
+        self._views.append(memoryview(m))
+        return self._views[-1].cast(typecode)
+
+    def __len__(self) -> int:
+        return len(self._index) // 3
+
+    def __getitem__(self, i: int) -> tuple[memoryview, int]:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        start, length, prompt_len = self._index[3 * i:3 * i + 3]
+        return self._tokens[start:start + length], prompt_len
+
+    def lengths(self) -> list[int]:
+        return list(self._index[1::3])
+
+    def close(self) -> None:
+        """Unmap the files; views from ds[i] must not be in use any more."""
+        for view in (self._tokens, self._index, *self._views):
+            view.release()
+        for m in self._maps:
+            m.close()
+        self._maps, self._views = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a pre-tokenized dataset split")
+    parser.add_argument("stem", type=Path, help="Split path without suffix, e.g. 1_data/tokens/gpt2_train")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    with TokenDataset(args.stem) as ds, profiling.span("token_dataset.lengths"):
+        lengths = ds.lengths()
+        h = ds.header
+        print(f"{args.stem}: {len(ds)} examples, {h['tokens']} tokens ({h['dtype']}, {h['tokenizer']})")
+        if lengths:
+            print(f"  length min/mean/max: {min(lengths)} / {sum(lengths) / len(lengths):.0f} / {max(lengths)}")
+            print(f"  prompt tokens (masked): {h['prompt_tokens']} "
+                  f"({h['prompt_tokens'] / max(h['tokens'], 1):.0%})")
+        if h["boundary_inexact"]:
+            print(f"  WARNING: {h['boundary_inexact']} example(s) where a token spans the "
+                  f"prompt/response boundary (mask approximate)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Watch prompts, cleaned essays and Llama pair files; re-report on every save.
+
+Keeps prompts.md, the cleaned essays, llama_train.md / llama_val.md and every
+pair's token counts in memory, and polls the files (stat only) a few times a
+second.  When one changes, only the pairs it feeds are rebuilt — Tier 3
+continuation stripped from the essay, GPT-2 truncation, token limits — and
+the changed rows plus per-split totals are printed.
+
+llama_train.md is seen the way `prompts_to_llama.py --regenerate` would
+leave it (Tier 3 responses refreshed from their essays, new prompts
+appended); llama_val.md is taken as written.  GPT-2 pairs are what
+llama_to_gpt2.py would produce from those.  With --write, llama_train.md,
+gpt2_{split}.md and the JSONL files are rewritten whenever their content
+changes, as if the three scripts had been run.
+
+Usage:
+    python watch.py                 # report on every change (Ctrl-C to stop)
+    python watch.py --write         # also rewrite pair files and JSONL
+    python watch.py --interval 0.2  # poll period in seconds (default: 0.5)
+    python watch.py --once          # build, print the full report and exit
+    python watch.py --profile       # time each rebuild; trace written on exit (profiling.py)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import profiling
+from format_jsonl import (GPT2_MAX_TOKENS, LLAMA_MAX_TOKENS, OUTPUT_DIR, PAIRS_DIR, collect_pairs,
+                          count_tokens_gpt2, count_tokens_llama, to_gpt2_format, to_llama_format,
+                          write_jsonl, write_length_manifest)
+from llama_to_gpt2 import GPT2_HEADER_TRAIN, GPT2_HEADER_VAL, GPT2_MAX, SEP_TOKENS, gpt2_pairs, truncate_response
+from pairs_file import iter_pairs, write_pairs
+from prompts_to_llama import CLEANED_DIR, PROMPTS_FILE, REPO_ROOT, build_response, norm, parse_target
+from slug_index import SlugIndex
+from token_budget import parse_prompts_file
+from token_cache import count_tokens, shared_cache
+
+TARGETS = {
+    "train": PAIRS_DIR / "llama_train.md",
+    "val": PAIRS_DIR / "llama_val.md",
+}
+
+
+def _stat(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+# ── per-pair work ────────────────────────────────────────────────────────
+
+def evaluate(tier: int | None, prompt: str, response: str) -> dict:
+    """Token counts, GPT-2 truncation and problems for one Llama pair."""
+    result = {"llama_tokens": count_tokens_llama(prompt + response), "errors": []}
+    if not prompt:
+        result["errors"].append("empty prompt")
+    if not response:
+        result["errors"].append("empty response")
+    if tier is None:
+        result["errors"].append("no tier")
+    if result["llama_tokens"] > LLAMA_MAX_TOKENS:
+        result["errors"].append(f"exceeds llama {LLAMA_MAX_TOKENS}")
+
+    if tier != 1:  # tier 1 is Llama only (llama_to_gpt2.py skips it)
+        prompt_tokens = count_tokens(prompt, "gpt2")
+        truncated, trunc_tokens, orig_tokens = truncate_response(response, prompt_tokens)
+        gpt2_tokens = count_tokens_gpt2(to_gpt2_format(prompt, truncated)["text"])
+        result.update({
+            "gpt2_response": truncated,
+            "prompt_tokens": prompt_tokens,
+            "orig_tokens": orig_tokens,
+            "trunc_tokens": trunc_tokens,
+            "budget": GPT2_MAX - prompt_tokens - SEP_TOKENS,
+            "gpt2_tokens": gpt2_tokens,
+        })
+        if gpt2_tokens > GPT2_MAX_TOKENS:
+            result["errors"].append(f"exceeds gpt2 {GPT2_MAX_TOKENS}")
+    return result
+
+
+def gpt2_status(row: dict) -> str:
+    """The Status column of llama_to_gpt2.py's table."""
+    if "gpt2_response" not in row:
+        return "llama only"
+    if not row["gpt2_response"] and row["response"]:
+        return "EMPTY (prompt too large)"
+    if row["trunc_tokens"] < row["orig_tokens"]:
+        pct = (1 - row["trunc_tokens"] / row["orig_tokens"]) * 100 if row["orig_tokens"] else 0
+        return f"TRUNCATED (-{pct:.0f}%)"
+    return "ok"
+
+
+# ── workspace ────────────────────────────────────────────────────────────
+
+class Workspace:
+    """In-memory copy of the curation inputs and every pair derived from them.
+
+    refresh() takes the set of files that changed since the last call and
+    rebuilds only what depends on them: a changed essay re-strips the prompts
+    matched to it, a changed prompt re-strips its own essay, and a pair is
+    re-tokenized only when its (tier, prompt, response) differs from before.
+    """
+
+    def __init__(self):
+        self.stats: dict[Path, tuple[int, int]] = {}      # file → (size, mtime_ns) when read
+        self.prompts: dict[str, dict] = {}                 # slug → {tier, prompt}
+        self.essays: dict[Path, str] = {}                  # cleaned essay → stripped text
+        self.targets: dict[str, tuple[str, list[dict]] | None] = {s: None for s in TARGETS}
+        self.pairs: dict[str, list[dict]] = {s: [] for s in TARGETS}  # split → rows
+        self._matches: dict[str, Path | None] = {}         # slug → essay (find_essay's choice)
+        self._responses: dict[str, tuple[tuple, str]] = {}  # norm slug → (inputs, response)
+        self._evaluated: dict[tuple, dict] = {}            # (tier, prompt, response) → evaluate()
+
+    def scan(self) -> dict[Path, tuple[int, int]]:
+        """Current stat of every watched file."""
+        found = {}
+        for path in (PROMPTS_FILE, *TARGETS.values()):
+            st = _stat(path)
+            if st:
+                found[path] = st
+        if CLEANED_DIR.is_dir():
+            with os.scandir(CLEANED_DIR) as entries:
+                for entry in entries:
+                    if entry.name.endswith("_clean.md") and entry.is_file():
+                        st = entry.stat()
+                        found[CLEANED_DIR / entry.name] = (st.st_size, st.st_mtime_ns)
+        return found
+
+    def poll(self) -> set[Path]:
+        """Watched files created, modified or deleted since the last poll."""
+        found = self.scan()
+        changed = {p for p in found.keys() | self.stats.keys() if found.get(p) != self.stats.get(p)}
+        self.stats = found
+        return changed
+
+    def _read(self, path: Path) -> str | None:
+        try:
+            profiling.count_file(path)
+            return path.read_text(encoding="utf-8")
+        except FileNotFoundError:  # deleted between the poll and the read
+            self.stats.pop(path, None)
+            return None
+
+    def refresh(self, changed: set[Path]) -> tuple[list[tuple[str, dict]], list[tuple[str, str]]]:
+        """Reload changed files and rebuild affected pairs.
+
+        Returns (rows added or changed as (split, row), removed (split, name)).
+        """
+        if PROMPTS_FILE in changed:
+            self.prompts = parse_prompts_file(PROMPTS_FILE) if PROMPTS_FILE in self.stats else {}
+
+        added, removed = set(), set()
+        for path in changed:
+            if path.parent != CLEANED_DIR:
+                continue
+            text = self._read(path) if path in self.stats else None
+            if text is None:
+                if self.essays.pop(path, None) is not None:
+                    removed.add(path)
+            else:
+                if path not in self.essays:
+                    added.add(path)
+                self.essays[path] = text.strip()
+        self._update_matches(added, removed)
+
+        for split, path in TARGETS.items():
+            if path in changed:
+                text = self._read(path) if path in self.stats else None
+                self.targets[split] = parse_target(text) if text is not None else None
+
+        return self._rebuild()
+
+    def _update_matches(self, added: set[Path], removed: set[Path]) -> None:
+        """Keep slug → essay current (first match in sorted order, as find_essay).
+
+        Only new slugs and slugs whose essay was deleted are matched against
+        every essay; the rest only need checking against added essays.
+        """
+        stale = [s for s in self.prompts if s not in self._matches or self._matches[s] in removed]
+        stale_set = set(stale)
+        matches = {s: self._matches[s] for s in self.prompts if s in self._matches}
+        if stale:
+            ordered = sorted(self.essays)
+            index = SlugIndex(stale, [p.stem for p in ordered], normalize=norm)
+            by_stem = {p.stem: p for p in ordered}
+            for slug in stale:
+                matches[slug] = by_stem.get(index.first_name(slug))
+        if added:
+            kept = [s for s in self.prompts if s not in stale_set]
+            index = SlugIndex(kept, [p.stem for p in added], normalize=norm)
+            for path in added:
+                for slug in index.slugs_in(path.stem):
+                    if matches[slug] is None or path < matches[slug]:
+                        matches[slug] = path
+        self._matches = {s: matches[s] for s in self.prompts}
+
+    def unmatched(self) -> list[str]:
+        """Slugs with a prompt but no cleaned essay."""
+        return sorted(s for s, p in self._matches.items() if p is None and self.prompts[s]["prompt"])
+
+    def full_responses(self) -> dict[str, str]:
+        """norm slug → response built from its essay (prompts_to_llama.py's full_responses)."""
+        responses = {}
+        cache = {}
+        for slug, entry in self.prompts.items():
+            path = self._matches.get(slug)
+            if not entry["prompt"] or path is None:
+                continue
+            n = norm(slug)
+            key = (entry["tier"], entry["prompt"], path, self.stats.get(path))
+            cached = self._responses.get(n)
+            if cached and cached[0] == key:
+                response = cached[1]
+            else:
+                response = build_response(entry["tier"], entry["prompt"], self.essays[path])
+            cache[n] = (key, response)
+            responses[n] = response
+        self._responses = cache
+        return responses
+
+    def llama_pairs(self, split: str) -> list[dict]:
+        """The split's Llama pairs; train as --regenerate would leave it."""
+        target = self.targets[split]
+        if target is None:
+            return []
+        _, existing = target
+        if split != "train":
+            return existing
+
+        responses = self.full_responses()
+        pairs = []
+        for pair in existing:
+            n = norm(pair["name"])
+            if n in responses and pair["tier"] == 3:
+                pair = {**pair, "response": responses[n]}
+            pairs.append(pair)
+        existing_names = {norm(p["name"]) for p in existing}
+        for slug, entry in self.prompts.items():
+            if norm(slug) not in existing_names and norm(slug) in responses:
+                pairs.append({"name": slug, "tier": entry["tier"],
+                              "prompt": entry["prompt"], "response": responses[norm(slug)]})
+        return pairs
+
+    def _rebuild(self) -> tuple[list[tuple[str, dict]], list[tuple[str, str]]]:
+        changed, removed = [], []
+        evaluated = {}
+        for split in TARGETS:
+            before = {row["name"]: row for row in self.pairs[split]}
+            rows = []
+            for pair in self.llama_pairs(split):
+                key = (pair["tier"], pair["prompt"], pair["response"])
+                result = evaluated.get(key) or self._evaluated.get(key) or evaluate(*key)
+                evaluated[key] = result
+                row = {**pair, **result}
+                rows.append(row)
+                old = before.pop(pair["name"], None)
+                if old is None or (old["tier"], old["prompt"], old["response"]) != key:
+                    changed.append((split, row))
+            removed.extend((split, name) for name in before)
+            self.pairs[split] = rows
+        self._evaluated = evaluated  # drop counts for pairs that no longer exist
+        return changed, removed
+
+    # ── writing ──────────────────────────────────────────────────────────
+
+    def write_outputs(self) -> list[Path]:
+        """Write pair files and JSONL whose content changed; returns the paths written."""
+        written = []
+        header, _ = self.targets["train"] or (None, None)
+        if header is not None:
+            pairs = self.llama_pairs("train")
+            if write_pairs(TARGETS["train"], header, pairs)["written"]:
+                self.stats[TARGETS["train"]] = _stat(TARGETS["train"])  # our own write isn't a change
+                self.targets["train"] = (header, pairs)
+                written.append(TARGETS["train"])
+
+        for split, path in TARGETS.items():
+            if self.targets[split] is None:
+                continue
+            results = [{**row, "truncated_response": row["gpt2_response"]}
+                       for row in self.pairs[split] if "gpt2_response" in row]
+            gpt2_path = path.with_name(path.name.replace("llama", "gpt2"))
+            header = GPT2_HEADER_VAL if split == "val" else GPT2_HEADER_TRAIN
+            if write_pairs(gpt2_path, header, gpt2_pairs(results))["written"]:
+                written.append(gpt2_path)
+
+            # JSONL from the pair files as format_jsonl.py would read them
+            for model, pairs_path in (("llama", path), ("gpt2", gpt2_path)):
+                pairs, _ = collect_pairs(iter_pairs(pairs_path))
+                fmt = to_llama_format if model == "llama" else to_gpt2_format
+                entries = [fmt(p["prompt"], p["response"]) for p in pairs]
+                jsonl_path = OUTPUT_DIR / f"{model}_{split}.jsonl"
+                jsonl = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+                if jsonl_path.exists() and jsonl_path.read_text(encoding="utf-8") == jsonl:
+                    continue
+                write_jsonl(jsonl_path, entries)
+                write_length_manifest(jsonl_path.with_suffix(".lengths.json"), pairs, model, split)
+                written.append(jsonl_path)
+        return written
+
+
+# ── report ───────────────────────────────────────────────────────────────
+
+TABLE_HEADER = (f"  {'Split':<5s}  {'Pair':<35s}  {'Tier':>4s}  {'Llama':>6s}  {'Prompt':>6s}  "
+                f"{'Resp':>6s}  {'→':>1s}  {'Trunc':>5s}  {'Budget':>6s}  Status")
+TABLE_RULE = f"  {'-'*5}  {'-'*35}  {'-'*4}  {'-'*6}  {'-'*6}  {'-'*6}  {' ':>1s}  {'-'*5}  {'-'*6}  ------"
+
+
+def format_row(split: str, row: dict, mark: str = " ") -> str:
+    tier = f"T{row['tier']:>3d}" if row["tier"] is not None else "  T?"
+    gpt2 = (f"{row['prompt_tokens']:>6d}  {row['orig_tokens']:>6d}  →  {row['trunc_tokens']:>5d}  "
+            f"{row['budget']:>6d}" if "gpt2_response" in row else f"{'':>6s}  {'':>6s}     {'':>5s}  {'':>6s}")
+    problems = f"  ! {', '.join(row['errors'])}" if row["errors"] else ""
+    return (f"{mark} {split:<5s}  {row['name']:<35s}  {tier}  {row['llama_tokens']:>6d}  "
+            f"{gpt2}  {gpt2_status(row)}{problems}")
+
+
+def totals(ws: Workspace) -> list[str]:
+    lines = []
+    for split, rows in ws.pairs.items():
+        if ws.targets[split] is None:
+            lines.append(f"  {split}: {TARGETS[split].name} not found")
+            continue
+        gpt2 = [r for r in rows if "gpt2_response" in r]
+        truncated = sum(r["trunc_tokens"] < r["orig_tokens"] for r in gpt2)
+        empty = sum(not r["gpt2_response"] and bool(r["response"]) for r in gpt2)
+        problems = sum(bool(r["errors"]) for r in rows)
+        lines.append(f"  {split}: {len(rows)} llama | {len(gpt2)} gpt2 ({truncated} truncated, {empty} empty) "
+                     f"| {problems} with problems")
+    unmatched = ws.unmatched()
+    if unmatched:
+        lines.append(f"  No cleaned essay found: {', '.join(unmatched)}")
+    return lines
+
+
+def print_full_report(ws: Workspace) -> None:
+    print(TABLE_HEADER)
+    print(TABLE_RULE)
+    for split, rows in ws.pairs.items():
+        for row in rows:
+            print(format_row(split, row))
+    print()
+    print("\n".join(totals(ws)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch curation files and re-report affected pairs")
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="Seconds between polls (default: 0.5)")
+    parser.add_argument("--write", action="store_true",
+                        help="Also rewrite llama_train.md, gpt2_{split}.md and JSONL when they change")
+    parser.add_argument("--once", action="store_true", help="Print the full report and exit")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args)
+
+    ws = Workspace()
+    start = time.perf_counter()
+    with profiling.span("watch.refresh"):
+        ws.refresh(ws.poll())
+    print_full_report(ws)
+    if args.write:
+        with profiling.span("watch.write_outputs"):
+            written = ws.write_outputs()
+        for path in written:
+            print(f"  ✓ wrote {path.relative_to(REPO_ROOT)}")
+    shared_cache().flush()
+    print(f"  loaded in {time.perf_counter() - start:.2f}s | {shared_cache().summary()}")
+    if args.once:
+        return
+
+    print(f"\nWatching {PROMPTS_FILE.name}, {CLEANED_DIR.name}/*_clean.md, "
+          f"{', '.join(p.name for p in TARGETS.values())} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(args.interval)
+            changed = ws.poll()
+            if not changed:
+                continue
+            start = time.perf_counter()
+            with profiling.span("watch.refresh", files=len(changed)):
+                rows, removed = ws.refresh(changed)
+            with profiling.span("watch.write_outputs"):
+                written = ws.write_outputs() if args.write else []
+            seconds = time.perf_counter() - start
+
+            names = ", ".join(sorted(p.name for p in changed))
+            print(f"\n[{time.strftime('%H:%M:%S')}] {names} → {len(rows)} pair(s) rebuilt, "
+                  f"{len(removed)} removed in {seconds:.2f}s")
+            if rows:
+                print(TABLE_HEADER)
+                print(TABLE_RULE)
+                for split, row in rows:
+                    print(format_row(split, row, "~"))
+            for split, name in removed:
+                print(f"- {split:<5s}  {name}")
+            print("\n".join(totals(ws)))
+            for path in written:
+                print(f"  ✓ wrote {path.relative_to(REPO_ROOT)}")
+            shared_cache().flush()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+
+
+if __name__ == "__main__":
+    main()